@@ -13,6 +13,7 @@ setup(name='pybot-minitel',
           'Intended Audience :: Science/Research',
           'Topic :: Scientific/Engineering',
           'Programming Language :: Python :: 2.7',
+          'Programming Language :: Python :: 3',
           'Environment :: No Input/Output (Daemon)',
           'Environment :: Raspberry Pi',
           'Operating System :: POSIX :: Linux',
@@ -31,7 +32,8 @@ setup(name='pybot-minitel',
       },
       entry_points={
           'console_scripts': [
-              'pybot_minitel_demo = pybot.minitel.demos:main'
+              'pybot_minitel_demo = pybot.minitel.demos:main',
+              'pybot_minitel_daemon = pybot.minitel.daemon:main'
           ]
       }
 )
@@ -5,7 +5,7 @@
 
 __author__ = 'Eric Pascual'
 
-import constants
+from . import constants
 
 
 class AsciiArtImage(object):
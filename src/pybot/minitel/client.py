@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+""" Client of the Minitel daemon.
+
+:py:class:`MinitelClient` provides the methods of :py:class:`pybot.minitel.core.Minitel`
+listed in :py:data:`pybot.minitel.daemon.MINITEL_OPERATIONS`, executed by the daemon
+owning the Minitel (see :py:mod:`pybot.minitel.daemon`).
+
+Example::
+
+    with MinitelClient() as mt:
+        with mt.exclusive():
+            mt.clear_screen()
+            mt.display_text_center(u'Hello', y=10)
+            key = mt.wait_for_key(max_wait=30)
+"""
+
+__author__ = 'Eric Pascual'
+
+from contextlib import contextmanager
+import base64
+import json
+import socket
+
+from .compat import to_bytes
+from .daemon import DEFAULT_SOCKET_PATH, MINITEL_OPERATIONS
+
+# the exceptions raised by the daemon which are raised as is by the client
+_BUILTIN_ERRORS = dict((e.__name__, e) for e in (ValueError, TypeError, RuntimeError, KeyError, IndexError))
+
+
+class DaemonError(Exception):
+    """ An error raised by the daemon while executing a request.
+
+    Attributes:
+        type (str): the name of the exception raised by the daemon
+    """
+    def __init__(self, message, error_type=None):
+        super(DaemonError, self).__init__(message)
+        self.type = error_type
+
+
+class MinitelClient(object):
+    """ A Minitel served by the daemon.
+
+    The client can be used as a context manager, the connection being closed on exit.
+    Requests are executed in sequence, and the client must not be shared between
+    threads without synchronization.
+    """
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, terminal=None, timeout=None):
+        """
+        Parameters:
+            socket_path (str): the path of the daemon socket (default: :py:data:`DEFAULT_SOCKET_PATH`)
+            terminal (str): the name of the Minitel, optional if the daemon serves only one
+            timeout (float): the maximum time in seconds for a reply (default: no limit,
+                since requests wait for user input or for the Minitel to be released)
+
+        Raises:
+            socket.error: if the daemon cannot be reached
+        """
+        self.terminal = terminal
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(socket_path)
+        self._rfile = self._sock.makefile('rb')
+
+    def close(self):
+        """ Closes the connection, releasing the Minitel if still acquired.
+        """
+        self._rfile.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def call(self, op, *args, **kwargs):
+        """ Executes an operation on the daemon and returns its result.
+
+        Parameters:
+            op (str): the operation name
+
+        Returns:
+            the result of the operation
+
+        Raises:
+            DaemonError: if the daemon reported an error, exceptions of standard types
+                (such as ValueError) being raised as is
+            IOError: if the connection with the daemon is lost
+        """
+        request = {'op': op, 'args': args, 'kwargs': kwargs}
+        if self.terminal is not None:
+            request['terminal'] = self.terminal
+        self._sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+        line = self._rfile.readline()
+        if not line:
+            raise IOError('connection closed by the daemon')
+        reply = json.loads(line.decode('utf-8'))
+        if 'error' in reply:
+            error_type = reply.get('type')
+            if error_type in _BUILTIN_ERRORS:
+                raise _BUILTIN_ERRORS[error_type](reply['error'])
+            raise DaemonError(reply['error'], error_type)
+        return reply.get('result')
+
+    def __getattr__(self, name):
+        if name not in MINITEL_OPERATIONS:
+            raise AttributeError(name)
+
+        def operation(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+
+        operation.__name__ = name
+        return operation
+
+    def terminals(self):
+        """ Returns the Minitels served by the daemon.
+
+        Returns:
+            list of dict: the name, port, speed and model of each Minitel
+        """
+        return self.call('terminals')
+
+    def send_raw(self, data):
+        """ Sends already encoded data to the Minitel, as is.
+
+        Parameters:
+            data (bytes): the bytes to be sent
+        """
+        self.call('send_raw', base64.b64encode(to_bytes(data)).decode('ascii'))
+
+    def store_page(self, name, data):
+        """ Stores a pre-compiled page in the daemon, replacing the one with the same name if any.
+
+        Pages are shared by all the clients and all the Minitels of the daemon.
+
+        Parameters:
+            name (str): the page name
+            data (bytes): the encoded page content, as produced by :py:func:`forms.compile_layer`
+                or read from a Videotex file
+        """
+        self.call('store_page', name, base64.b64encode(to_bytes(data)).decode('ascii'))
+
+    def show_page(self, name):
+        """ Sends a stored page to the Minitel.
+
+        Parameters:
+            name (str): the page name
+
+        Raises:
+            ValueError: if there is no such page
+        """
+        self.call('show_page', name)
+
+    def drop_page(self, name):
+        """ Removes a stored page.
+
+        Parameters:
+            name (str): the page name
+
+        Returns:
+            bool: True if the page existed
+        """
+        return self.call('drop_page', name)
+
+    def acquire(self):
+        """ Reserves the Minitel for this client, waiting for the other clients to
+        release it if needed.
+
+        The requests of the other clients are then held until :py:meth:`release` is
+        called or the connection is closed. Calls can be nested.
+        """
+        self.call('acquire')
+
+    def release(self):
+        """ Releases the Minitel reserved by :py:meth:`acquire`.
+
+        Raises:
+            ValueError: if the Minitel has not been acquired
+        """
+        self.call('release')
+
+    @contextmanager
+    def exclusive(self):
+        """ Returns a context manager reserving the Minitel for the enclosed block.
+        """
+        self.acquire()
+        try:
+            yield self
+        finally:
+            self.release()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+""" Python 2 / Python 3 compatibility helpers.
+
+The library handles texts as native strings (``str`` on both versions), and the data
+exchanged on the serial link as bytes. Since the link is 7 bits, bytes received from
+the Minitel are mapped one to one to characters.
+"""
+
+__author__ = 'Eric Pascual'
+
+import sys
+
+PY3 = sys.version_info[0] >= 3
+
+if PY3:
+    string_types = (str,)
+    text_type = str
+
+    def native(data):
+        """ Returns received bytes as a native string.
+
+        Parameters:
+            data (bytes): the received bytes
+
+        Returns:
+            str: the corresponding string
+        """
+        return data.decode('latin-1')
+
+else:
+    string_types = (basestring,)
+    text_type = unicode
+
+    def native(data):
+        return data
+
+
+def to_bytes(data):
+    """ Returns an immutable copy of data held in a buffer.
+
+    Used when the data must be kept, while the buffer they come from may be reused by
+    its owner.
+
+    Parameters:
+        data (bytes, bytearray or memoryview): the data
+
+    Returns:
+        bytes: the data, as is if already bytes
+    """
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    if isinstance(data, bytearray):
+        return bytes(data)
+    return data
@@ -11,6 +11,7 @@ SOH = '\x01'
 EOT = '\x04'
 BEL = '\x07'
 BS = '\x08'
+LF = '\x0a'
 CS = '\x0c'
 CR = '\x0d'
 SO = '\x0e'
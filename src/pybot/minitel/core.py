@@ -4,17 +4,27 @@
 """
 
 import time
+import errno
+import functools
 import logging
+import os
+import select
+import tempfile
 import threading
+from collections import deque
 
 import serial
 from serial.serialutil import SerialException
 
-from .sequences import Protocol, TeleinfoCommand, TextAttribute, GET_POS, VideotexMode
+from .sequences import Protocol, TeleinfoCommand, TextAttribute, GET_POS, VideotexMode, Encoded, goto_sequence
 from .identification import DeviceSpecs
 from .constants import *
+from .writer import OutputWriter, Priority, split_chunks, write_all, BITS_PER_BYTE
+from .compat import string_types, text_type, native, to_bytes
+from .tracing import traced
+from .recorder import TrafficRecorder, TX, RX
 
-__all__ = ('Minitel', 'Part', 'DeviceCommunicationError')
+__all__ = ('Minitel', 'TerminalState', 'Part', 'DeviceCommunicationError')
 
 log = logging.getLogger('minitel')
 log.addHandler(logging.NullHandler())
@@ -25,12 +35,131 @@ log_tx = log.getChild('tx')
 
 
 def dump(data):
-    return ' '.join(c.encode('hex') for c in data)
+    return ' '.join('%02x' % b for b in bytearray(data))
+
+
+# translation table of the characters needing a G2 sequence, keyed by code point
+_TO_VT = dict((ord(c), seq if isinstance(seq, text_type) else seq.decode('ascii')) for c, seq in U_TO_VT.items())
+
+
+def encode(data):
+    """ Returns the bytes to be written on the link for a given text.
+
+    Characters which are not part of the Videotex G0 charset are translated
+    into their G2 equivalent sequences (see :py:data:`constants.U_TO_VT`). Data
+    which are already bytes are returned as is.
+
+    Parameters:
+        data (str): the text to be encoded, or a sequence of texts to be concatenated
+
+    Returns:
+        bytes: the encoded bytes
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return data
+    if not isinstance(data, string_types):
+        data = ''.join(data)
+    try:
+        # fast path for the most common case, since no ASCII character needs translating
+        return data.encode('ascii')
+    except UnicodeError:
+        return data.translate(_TO_VT).encode('utf-8')
+
+
+# the character size sequences, indexed by width then height (minus 1)
+_CHAR_SIZES = tuple(tuple(ESC + chr(0x4c + (h - 1) + (w - 1) * 2) for h in (1, 2)) for w in (1, 2))
+
+# the text style sequences already built, keyed by mode and attributes values
+_text_styles = {}
+
+# the sequences putting back the display settings to their defaults
+_VT_RESET_STATE = Encoded.TEXT + Encoded.CHAR_SIZE[0][0] + b''.join(
+    Encoded.TEXT_ATTRIBUTE[attr][False]
+    for attr in (TextAttribute.BLINK, TextAttribute.INVERSE, TextAttribute.UNDERSCORE)
+) + Encoded.FG[7] + Encoded.BG[0]
+_TELEINFO_RESET_STATE = encode(TeleinfoCommand.ATTR % 0)
+
+
+def _operation(method):
+    """ Decorator keeping track of the calls in progress of a method, so that
+    :py:meth:`Minitel.shutdown` can wait for their end.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._operations_cond:
+            self._operations += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            with self._operations_cond:
+                self._operations -= 1
+                if not self._operations:
+                    self._operations_cond.notify_all()
+
+    return wrapper
+
+
+#: the time (in seconds) the Minitel can take before starting to reply to a request
+REPLY_LATENCY = 0.1
+
+
+def reply_timeout(baudrate, size):
+    """ Returns the time to wait for the reply to a request at a given speed.
+
+    Parameters:
+        baudrate (int): the link speed
+        size (int): the count of bytes of the request and its reply
+
+    Returns:
+        float: the timeout in seconds, with a safety margin
+    """
+    return REPLY_LATENCY + 2. * size * BITS_PER_BYTE / baudrate
+
+
+class TerminalState(object):
+    """ Cached knowledge of the terminal settings.
+
+    The attributes hold the last known value of the corresponding setting, or None
+    if it is unknown :
+
+        - ``width`` : screen width (40 or 80)
+        - ``caps_lock`` : caps lock state
+        - ``roll`` : roll mode state
+        - ``speeds`` : link send and receive baud rates
+        - ``specs`` : the decoded identification ROM, as a :py:class:`DeviceSpecs` instance
+        - ``cursor_visible`` : cursor visibility
+        - ``drcs`` : the keys of the redefined character sets loaded in the terminal,
+          as a dictionary keyed by the charset number (see :py:mod:`drcs`)
+    """
+    ATTRIBUTES = ('width', 'caps_lock', 'roll', 'speeds', 'specs', 'cursor_visible', 'drcs')
+
+    def __init__(self):
+        self.width = self.caps_lock = self.roll = None
+        self.speeds = self.specs = self.cursor_visible = None
+        self.drcs = None
+
+    def invalidate(self, *names):
+        """ Forgets the values of the given settings, or all of them if none is given.
+
+        Parameters:
+            names (str): the names of the settings
+        """
+        for name in names or self.ATTRIBUTES:
+            setattr(self, name, None)
+
+    def __repr__(self):
+        return 'TerminalState(%s)' % ', '.join('%s=%s' % (n, getattr(self, n)) for n in self.ATTRIBUTES)
 
 
 class Minitel(object):
     """ Represents a Minitel beast.
 
+    The terminal settings are cached in the :py:attr:`state` attribute, so that repeated
+    status queries do not imply a round trip with the Minitel. The cache is maintained
+    according to the commands sent by the library, and invalidated when the terminal
+    is reset, or when the mode or the speed is changed. :py:meth:`refresh` forces the
+    settings to be read again.
+
     Warning:
         tested only with a Philips Minitel 2
     """
@@ -51,9 +180,23 @@ class Minitel(object):
     _in_vt_mode = None
     _vt_graphics = None
 
-    _terminate_event = threading.Event()
+    #: default setting for the use of the terminal local echo by :py:meth:`rlinput`
+    local_echo = False
+
+    #: if True, pending bulk output (see :py:meth:`send_bulk`) is cancelled when a key is received
+    cancel_on_key = True
+
+    #: the :py:class:`tracing.Tracer` recording the operations, if any
+    tracer = None
+
+    #: the directory where the recorded traffic is written when a communication problem occurs
+    #: (default: the system temporary directory)
+    traffic_dump_dir = None
 
-    def __init__(self, port=None, baud=4800, debug=False):
+    #: the minimum delay in seconds between two automatic dumps of the recorded traffic
+    traffic_dump_interval = 60
+
+    def __init__(self, port=None, baud=4800, debug=False, typeahead_size=64, traffic_capacity=16384):
         """ The serial port to be used can be either a string such as ``/dev/ttyUSB0``
         or an instance of :py:class:`serial.Serial`. In this case, the port is automatically
         opened if not yet done.
@@ -62,13 +205,22 @@ class Minitel(object):
             When providing a port instance, beware to have it initialized
             with even parity and 7 data bytes.
 
+        Keys typed by the user while the library is busy (painting the screen, querying
+        the terminal status,...) are kept in a type-ahead buffer, and returned by
+        subsequent inputs. Use :py:meth:`discard_typeahead` to get rid of them.
+
         Parameters:
             port (str or :py:class:`serial.Serial`): serial port identification or serial port instance
-            baud (int): baud rate (default: 4800)
+            baud (int or str): baud rate (default: 4800), ``'auto'`` for using the highest
+                speed supported by the Minitel model (see :py:meth:`negotiate_speed`), or None
+                for keeping the speed the Minitel is currently using
             debug (bool): if True, communications are traced
+            typeahead_size (int): the maximum count of bytes kept in the type-ahead buffer (default: 64)
+            traffic_capacity (int): the count of bytes of the last exchanges kept for diagnostic
+                (default: 16 KiB). The recording is disabled if 0. See :py:meth:`dump_traffic`.
 
         Raises:
-            ValueError: if port is not specified.
+            ValueError: if port is not specified, or if no Minitel answers on it
             TypeError: if the port type is not one of the expected ones
         """
         if not port:
@@ -78,12 +230,28 @@ class Minitel(object):
         if debug:
             log.setLevel(logging.DEBUG)
 
+        auto_speed = baud == 'auto'
+        if auto_speed:
+            baud = None
         self.baud = baud
         self.vtMode = None
         self.fg = self.bg = None
-        if isinstance(port, basestring):
+        self._typeahead = deque()
+        self._typeahead_size = typeahead_size
+        self._writer = None
+        self.state = TerminalState()
+        self.recorder = TrafficRecorder(traffic_capacity) if traffic_capacity else None
+        self._last_traffic_dump = 0
+        # failed requests are expected while the link speed is searched for
+        self._expect_failures = True
+        # cancellation of this instance operations, the pipe waking up the input waits
+        self._terminate_event = threading.Event()
+        self._wakeup_r = self._wakeup_w = None
+        self._operations = 0
+        self._operations_cond = threading.Condition()
+        if isinstance(port, string_types):
             self.portName = port
-            self.ser = serial.Serial(port, baud,
+            self.ser = serial.Serial(port, baud or LinkSpeed.BAUDRATES[-1],
                                      parity=serial.PARITY_EVEN,
                                      bytesize=serial.SEVENBITS,
                                      timeout=1)
@@ -96,91 +264,328 @@ class Minitel(object):
         else:
             raise TypeError('port parameter type mismatch')
 
-        # Since we don't know the current speed setting of the Minitel,
-        # we test all possible ones until it works in order to be able to
-        # communicate with it
+        try:
+            self._wakeup_r, self._wakeup_w = os.pipe()
+            try:
+                self._port_fd = self.ser.fileno()
+            except (AttributeError, NotImplementedError, ValueError, SerialException):
+                # input waits cannot be interrupted
+                self._port_fd = None
+
+            self._discover_speed()
+
+            # get rid of whatever has been received while trying wrong speeds
+            self.discard_typeahead()
+
+            self.set_mode(self.VIDEOTEX)
+
+            if auto_speed:
+                self.negotiate_speed()
+
+        except Exception:
+            if self.ser is not port:
+                # we opened it, nobody else will close it
+                self.ser.close()
+            self._close_wakeup()
+            raise
 
+    def _discover_speed(self):
+        """ Finds the speed the Minitel is currently using, and switches it to the requested
+        one if any.
+
+        Since we don't know the current speed setting of the Minitel, we test all possible
+        ones until it works. The reply timeout is scaled to each tested speed, so that the
+        fast ones are not waited for as long as the slow ones.
+
+        Raises:
+            ValueError: if no speed works
+        """
         log.debug('communication speed discovery and setting :')
 
+        timeout = self.ser.timeout
         init_ok = False
         last_attempt = False
-        log.debug('- first attempt, supposing Minitel in Videotex')
-        while not init_ok:
-            for speed in reversed(LinkSpeed.BAUDRATES):
-                log.debug('+ trying with baudrate=%d' % speed)
-                self.ser.baudrate = speed
-                if self.probe():
-                    # we found the current operating speed
-                    log.debug('+ current speed is %d' % speed)
-                    if speed != baud:
-                        log.debug('+ changing it to %d' % baud)
-                        self.set_speed(baud)
-                    else:
-                        log.debug('+ already at the requested speed')
-                    init_ok = True
-                    break
-
-            if last_attempt:
-                break
-
-            # check that it worked
-            if not init_ok:
-                # maybe we are in Teleinfo mode => try switching to Videotex using all possible speeds
-                # and re-attempt
-                log.debug('* maybe in Teleinfo => switch to Videotex')
+        try:
+            log.debug('- first attempt, supposing Minitel in Videotex')
+            while not init_ok:
                 for speed in reversed(LinkSpeed.BAUDRATES):
+                    log.debug('+ trying with baudrate=%d' % speed)
                     self.ser.baudrate = speed
-                    self.send(TeleinfoCommand.TO_VIDEOTEX)
-                    time.sleep(0.1)
+                    self.ser.timeout = reply_timeout(speed, len(Protocol.ENQROM) + Protocol.ROM_SIZE)
                     if self.probe():
-                        log.debug('- now in Videotex => last attempt')
+                        # we found the current operating speed
+                        log.debug('+ current speed is %d' % speed)
+                        if self.baud is None:
+                            self.baud = speed
+                        elif speed != self.baud:
+                            log.debug('+ changing it to %d' % self.baud)
+                            self.set_speed(self.baud)
+                        else:
+                            log.debug('+ already at the requested speed')
+                        init_ok = True
                         break
 
-                last_attempt = True
+                if last_attempt:
+                    break
+
+                # check that it worked
+                if not init_ok:
+                    # maybe we are in Teleinfo mode => try switching to Videotex using all possible speeds
+                    # and re-attempt
+                    log.debug('* maybe in Teleinfo => switch to Videotex')
+                    for speed in reversed(LinkSpeed.BAUDRATES):
+                        self.ser.baudrate = speed
+                        self.ser.timeout = reply_timeout(speed, len(Protocol.ENQROM) + Protocol.ROM_SIZE)
+                        self.send(TeleinfoCommand.TO_VIDEOTEX)
+                        time.sleep(0.1)
+                        if self.probe():
+                            log.debug('- now in Videotex => last attempt')
+                            break
+
+                    last_attempt = True
+
+        finally:
+            self.ser.timeout = timeout
+            self._expect_failures = False
 
         if not init_ok:
             raise ValueError('speed setting failed')
 
-        self.set_mode(self.VIDEOTEX)
-
     def close(self):
         """ Closes the communication.
 
         Should be invoked only when the instance is no more needed.
         """
+        self.stop_writer()
         self.ser.close()
+        self._close_wakeup()
+
+    def _close_wakeup(self):
+        for fd in (self._wakeup_r, self._wakeup_w):
+            if fd is not None:
+                os.close(fd)
+        self._wakeup_r = self._wakeup_w = None
 
     def interrupt(self):
-        """ Interrupts pending input wait if any."""
+        """ Interrupts pending input wait if any.
+
+        Only the operations of this instance are affected. Input waits return
+        immediately by raising :py:exc:`KeyboardInterrupt`, as do subsequent inputs,
+        and pending bulk output is abandoned.
+
+        Can be called from another thread.
+        """
+        if self._terminate_event.is_set():
+            return
         self._terminate_event.set()
+        try:
+            os.write(self._wakeup_w, b'x')
+        except (OSError, TypeError):
+            # already closed
+            pass
 
     @property
     def terminating(self):
-        return self._terminate_event.isSet()
+        return self._terminate_event.is_set()
+
+    def shutdown(self, timeout=5):
+        """ Stops pending inputs and closes the communication.
+
+        Waits for the inputs and bulk outputs in progress in other threads to stop
+        before closing the port.
 
-    def shutdown(self):
-        """ Stops pending inputs and closes the communication."""
+        Parameters:
+            timeout (float): maximum wait time in seconds for the operations to stop
+                (default: 5)
+        """
         self.interrupt()
-        time.sleep(1)
+        deadline = time.time() + timeout
+        with self._operations_cond:
+            while self._operations:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    log.warning('closing with %d operation(s) still in progress', self._operations)
+                    break
+                self._operations_cond.wait(remaining)
         self.close()
 
     def send(self, data):
         """ Sends data to the Minitel.
 
-        :param str data: the data to be sent
+        :param str data: the data to be sent, already encoded ones being sent as is
+        """
+        if data:
+            self.send_raw(encode(data))
+
+    def send_raw(self, data, priority=Priority.NORMAL, block=True):
+        """ Sends already encoded data to the Minitel, as is.
+
+        Used for pre-compiled sequences, such as the ones produced by :py:func:`encode`.
+        The data can be held in a ``bytearray`` or a ``memoryview``, which the caller
+        is free to reuse once the method returns.
+
+        The priority is meaningful only if the background writer is active (see
+        :py:meth:`start_writer`).
+
+        :param bytes data: the bytes to be sent
+        :param int priority: the output priority (see :py:class:`writer.Priority`)
+        :param bool block: if False, the data are queued without waiting for room in the
+            queue of the background writer
         """
         if data:
-            encoded = ''.join([
-                U_TO_VT.get(c, c) for c in data
-            ])
-            if log_tx.isEnabledFor(logging.DEBUG):
-                log_tx.debug(dump(encoded))
-            self.ser.write(encoded.encode('utf-8'))
+            self.record_output(data)
+            if self._writer:
+                self._writer.write(to_bytes(data), priority, block)
+            else:
+                try:
+                    write_all(self.ser, data)
+                except SerialException as e:
+                    self._traffic_incident('write failed (%s)' % e)
+                    raise
+
+    def record_output(self, data):
+        """ Records, logs and traces output data, as done by :py:meth:`send_raw`.
+
+        Used for data written to the port by other means, such as ``sendfile``.
+
+        :param bytes data: the bytes sent
+        """
+        if self.recorder is not None:
+            self.recorder.record(TX, to_bytes(data))
+        if log_tx.isEnabledFor(logging.DEBUG):
+            log_tx.debug(dump(data))
+        if self.tracer:
+            self.tracer.data_sent(len(data))
+
+    @traced()
+    @_operation
+    def send_bulk(self, data, chunk_size=None):
+        """ Sends a large amount of data (such as images or long pages) in an interruptible way.
+
+        The data are sent in chunks, which do not split control sequences. If a key is
+        received while chunks remain to be sent and :py:attr:`cancel_on_key` is set, the
+        remaining ones are dropped, and the terminal is put back in a known state (see
+        :py:meth:`cancel_output`).
+
+        When the background writer is active, the chunks are queued with the ``BULK``
+        priority and the method returns immediately. Otherwise each chunk is written and
+        flushed before checking for a received key.
+
+        Parameters:
+            data (str): the data to be sent
+            chunk_size (int): the chunk size (default: what the link transmits in 0.1s)
+
+        Returns:
+            bool: False if the transfer has been interrupted, True otherwise
+        """
+        chunk_size = chunk_size or max(16, self.ser.baudrate // (BITS_PER_BYTE * 10))
+        chunks = split_chunks(encode(data), chunk_size)
+
+        if self._writer:
+            for chunk in chunks:
+                self.send_raw(chunk, Priority.BULK)
+            return True
+
+        for chunk in chunks:
+            if self.terminating:
+                log.debug('bulk output interrupted by termination')
+                return False
+            if self.cancel_on_key and self.ser.inWaiting():
+                log.debug('bulk output interrupted by user input')
+                self.send_raw(self._reset_state_sequence())
+                return False
+            self.send_raw(chunk)
+            self.ser.flush()
+        return True
+
+    def cancel_output(self, reset=False):
+        """ Cancels the pending bulk output if any, and puts the terminal back in a known state.
+
+        The charset, the character size, the text attributes and the colors are reset, and
+        the graphics mode is left.
 
+        Parameters:
+            reset (bool): if True, the terminal state is reset even if there was no pending
+                output, as needed when data have been written without the background writer
+
+        Returns:
+            bool: True if some output has been cancelled
+        """
+        cancelled = bool(self._writer and self._writer.cancel_bulk())
+        if cancelled:
+            log.debug('bulk output cancelled')
+        if cancelled or reset:
+            self.send_raw(self._reset_state_sequence())
+        return cancelled
+
+    def _reset_state_sequence(self):
+        """ Returns the sequence resetting the display settings to their defaults, and
+        updates their current values accordingly.
+        """
+        if self._in_vt_mode:
+            self._vt_graphics = False
+            self.fg, self.bg = 7, 0
+            return _VT_RESET_STATE
+
+        self.fg = self.bg = None
+        return _TELEINFO_RESET_STATE
+
+    def start_writer(self, max_size=4096, high_watermark=None, low_watermark=None,
+                     on_high=None, on_low=None, coalesce_delay=0.005):
+        """ Starts a background writer, so that sending data does not block the
+        caller until the data are accepted by the system.
+
+        Data are then queued and written by a dedicated thread. Small writes occurring
+        within a short delay are grouped, and the application can be notified when the
+        amount of pending data crosses the high and low watermarks. :py:meth:`flush`
+        waits for all the queued data to be written.
+
+        See :py:class:`writer.OutputWriter` for details about the parameters.
+
+        Parameters:
+            max_size (int): the maximum count of pending bytes, :py:meth:`send` blocking
+                while there is not enough room (default: 4096)
+            high_watermark (int): the count of pending bytes triggering ``on_high``
+            low_watermark (int): the count of pending bytes triggering ``on_low``
+            on_high (callable): invoked without argument when the high watermark is reached
+            on_low (callable): invoked without argument when the low watermark is reached back
+            coalesce_delay (float): the time window (in seconds) for grouping small writes
+                (default: 0.005)
+        """
+        if self._writer:
+            return
+
+        self._writer = OutputWriter(
+            self.ser, max_size=max_size,
+            high_watermark=high_watermark, low_watermark=low_watermark,
+            on_high=on_high, on_low=on_low,
+            coalesce_delay=coalesce_delay,
+            on_error=lambda e: self._traffic_incident('write failed (%s)' % e)
+        )
+        self._writer.start()
+
+    def stop_writer(self, timeout=None):
+        """ Stops the background writer if any, once the data queued so far are written.
+
+        Parameters:
+            timeout (float): maximum wait time in seconds for the writer termination
+        """
+        if self._writer:
+            writer, self._writer = self._writer, None
+            writer.stop(timeout)
+
+    @property
+    def writer(self):
+        """ The background writer, None if not started."""
+        return self._writer
+
+    @_operation
     def receive(self, count=1):
         """ Receives a given count of bytes from the Minitel.
 
-        Does not wait for data, but returns whats is currently available.
+        Waits at most for the port timeout, and returns what has been received. Data
+        pending in the type-ahead buffer are returned first. The wait ends as soon as
+        :py:meth:`interrupt` is called.
 
         Parameters:
             count (int): the expected count of bytes (default: 1)
@@ -194,22 +599,157 @@ class Minitel(object):
         if self.terminating:
             raise KeyboardInterrupt()
 
-        data = self.ser.read(count)
-        if data:
-            log_rx.debug(dump(data))
+        if self._typeahead:
+            data = ''.join(self._typeahead.popleft() for _ in range(min(count, len(self._typeahead))))
+        else:
+            if not self._wait_input(self.ser.timeout):
+                if self.terminating:
+                    raise KeyboardInterrupt()
+                return ''
+            data = self._read(count)
+            if data:
+                if self.cancel_on_key and self._writer and self._writer.has_bulk:
+                    self.cancel_output()
+        if data and self.tracer:
+            self.tracer.key_received()
         return data
 
-    def request(self, command, reply_size):
+    def _wait_input(self, timeout):
+        """ Waits for data to be received, or for the instance to be interrupted.
+
+        Returns:
+            bool: True if data can be read, or if the port does not support waiting, False if
+            interrupted or if nothing has been received in time
+        """
+        if self._port_fd is None:
+            return not self.terminating
+        try:
+            ready = select.select([self._port_fd, self._wakeup_r], [], [], timeout)[0]
+        except (select.error, OSError) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return True
+        return self._port_fd in ready
+
+    def discard_typeahead(self):
+        """ Discards the keys typed in advance, including the ones not yet read
+        from the serial link.
+        """
+        self._typeahead.clear()
+        self.ser.flushInput()
+
+    def _stash(self, data):
+        """ Appends received data to the type-ahead buffer, dropping what exceeds
+        its capacity.
+        """
+        room = self._typeahead_size - len(self._typeahead)
+        if len(data) > room:
+            log.debug('type-ahead buffer full, %d byte(s) dropped', len(data) - room)
+        self._typeahead.extend(data[:max(room, 0)])
+
+    def _stash_input(self):
+        """ Moves the data pending on the serial link to the type-ahead buffer.
+        """
+        try:
+            pending = self.ser.inWaiting()
+        except SerialException as e:
+            self._traffic_incident('read failed (%s)' % e)
+            raise
+        if pending:
+            self._stash(self._read(pending))
+
+    def _read(self, count):
+        """ Reads data from the serial link, records them and returns them as a native string.
+        """
+        try:
+            data = self.ser.read(count)
+        except SerialException as e:
+            self._traffic_incident('read failed (%s)' % e)
+            raise
+        if data:
+            if self.recorder is not None:
+                self.recorder.record(RX, data)
+            if log_rx.isEnabledFor(logging.DEBUG):
+                log_rx.debug(dump(data))
+        return native(data)
+
+    def _read_reply(self, reply_size, reply_lead=None):
+        """ Reads the reply to a request.
+
+        If the first byte of the reply is known, the bytes received before it (i.e. keys
+        typed by the user meanwhile) are moved to the type-ahead buffer.
+
+        The output sent so far, including what the background writer still holds, is
+        transmitted before waiting for the reply, so that the reply timeout does not
+        include the time needed for it.
+        """
+        if self.tracer:
+            self.tracer.round_trip()
+        self.flush()
+        reply = self._read(reply_size)
+        if reply_lead and reply:
+            skip = reply.find(reply_lead)
+            if skip == -1:
+                skip = len(reply)
+            if skip:
+                self._stash(reply[:skip])
+                reply = reply[skip:] + self._read(skip)
+        if len(reply) < reply_size and not self._expect_failures:
+            self._traffic_incident('incomplete reply (%d/%d bytes)' % (len(reply), reply_size))
+        return reply
+
+    def dump_traffic(self, path=None, reason=None):
+        """ Writes the last exchanges with the Minitel to a file.
+
+        This is done automatically when a communication problem occurs (link error or
+        incomplete reply to a request), at most once per :py:attr:`traffic_dump_interval`.
+
+        Parameters:
+            path (str): the file path (default: a time stamped file in :py:attr:`traffic_dump_dir`)
+            reason (str): an optional explanation, written in the file
+
+        Returns:
+            str: the path of the written file, or None if the traffic is not recorded
+        """
+        if self.recorder is None:
+            return None
+
+        if not path:
+            path = os.path.join(
+                self.traffic_dump_dir or tempfile.gettempdir(),
+                'minitel-traffic-%s.log' % time.strftime('%Y%m%d-%H%M%S')
+            )
+        self.recorder.dump(path, reason)
+        return path
+
+    def _traffic_incident(self, reason):
+        """ Dumps the recorded traffic after a communication problem.
+        """
+        now = time.time()
+        if self.recorder is None or now - self._last_traffic_dump < self.traffic_dump_interval:
+            return
+        self._last_traffic_dump = now
+        try:
+            path = self.dump_traffic(reason=reason)
+        except (IOError, OSError) as e:
+            log.error('%s - cannot dump the recorded traffic (%s)', reason, e)
+        else:
+            log.warning('%s - recorded traffic dumped to %s', reason, path)
+
+    @traced()
+    def request(self, command, reply_size, reply_lead=None):
         """ Sends a request and returns its reply.
 
-        Warning:
-            The serial input link is flushed before issuing the request to be sure
-            that the returned value will not contain data remaining from previous
-            communications. This means that such data will be lost.
+        The data pending on the serial input link are moved to the type-ahead
+        buffer before issuing the request, so that the returned value will not contain
+        data remaining from previous communications, while preserving keys typed by
+        the user.
 
         Parameters:
             command (str): the command to be sent
             reply_size (int): the size of the expected reply
+            reply_lead (str): the first byte of the reply, if known. Used to set apart
+                keys typed while the request is processed.
 
         Returns:
             str: the reply
@@ -217,12 +757,11 @@ class Minitel(object):
         if Protocol.is_protocol_command(command) and not self._in_vt_mode:
             raise RuntimeError('protocol commands available in Videotex mode only')
 
-        self.ser.flushInput()
+        self._stash_input()
         self.send(command)
-        reply = self.ser.read(reply_size)
-        log_rx.debug(dump(reply))
-        return reply
+        return self._read_reply(reply_size, reply_lead)
 
+    @traced()
     def probe(self):
         """ Reads the content of the identification ROM and returns it in a
         decoded form.
@@ -230,14 +769,37 @@ class Minitel(object):
         Returns:
             :py:class:`DeviceSpecs`: the decoded identification ROM
         """
-        self.ser.flushInput()
+        self._stash_input()
         self.send(Protocol.ENQROM)
-        data = self.ser.read(Protocol.ROM_SIZE)
+        data = self._read_reply(Protocol.ROM_SIZE, SOH)
         if len(data) != 5 or data[0] != SOH or data[-1] != EOT:
             return None
 
         maker, model, version = data[1:4]
-        return DeviceSpecs(model, maker, version)
+        self.state.specs = DeviceSpecs(model, maker, version)
+        return self.state.specs
+
+    @property
+    def device_specs(self):
+        """ The decoded identification ROM, read once and cached.
+        """
+        return self.state.specs or self.probe()
+
+    @traced()
+    def refresh(self):
+        """ Reads the terminal settings again and updates the cached state.
+
+        Returns:
+            :py:class:`TerminalState`: the updated state
+        """
+        self.state.invalidate('width', 'caps_lock', 'roll', 'speeds', 'specs')
+        if self._in_vt_mode:
+            self.probe()
+            self.get_functional_status()
+            self.get_speeds()
+        else:
+            self.is_w80()
+        return self.state
 
     def in_videotex_mode(self):
         """ Tells if we are presently in Videotex mode.
@@ -258,10 +820,12 @@ class Minitel(object):
         Returns:
             tuple: send/received baudrates
         """
-        data = ord(self.request(Protocol.STATUS_SPEED, Protocol.PRO2_LEN)[-1])
-        send_speed = LinkSpeed.baudrate((data >> 3) & 7)
-        recv_speed = LinkSpeed.baudrate(data & 7)
-        return send_speed, recv_speed
+        if self.state.speeds is None:
+            data = ord(self.request(Protocol.STATUS_SPEED, Protocol.PRO2_LEN, ESC)[-1])
+            send_speed = LinkSpeed.baudrate((data >> 3) & 7)
+            recv_speed = LinkSpeed.baudrate(data & 7)
+            self.state.speeds = send_speed, recv_speed
+        return self.state.speeds
 
     def set_speed(self, speed):
         """ Sets the communication link communication speed.
@@ -281,11 +845,70 @@ class Minitel(object):
         speed_code = LinkSpeed.code(speed)
         prog_value = 0x40 | (speed_code << 3) | speed_code
         self.send(Protocol.PROG + chr(prog_value))
+        self.state.invalidate('speeds')
+        self.flush()
         # let the beast process the command
         time.sleep(0.05)
 
         self.ser.baudrate = LinkSpeed.baudrate(speed)
 
+    @traced()
+    def negotiate_speed(self):
+        """ Switches the link to the highest speed supported by the Minitel model.
+
+        The maximum speed of the model is obtained from its identification ROM. The
+        speed change is verified by querying the speed settings of the Minitel, and
+        the next lower speed is tried if this fails. The current speed is kept if none
+        of the higher ones can be used.
+
+        Returns:
+            int: the resulting baud rate
+        """
+        self._expect_failures = True
+        try:
+            return self._negotiate_speed()
+        finally:
+            self._expect_failures = False
+
+    def _negotiate_speed(self):
+        current = self.ser.baudrate
+        specs = self.device_specs
+        if not specs:
+            log.warning('cannot read the identification ROM => speed kept at %d', current)
+            return current
+
+        candidates = [b for b in reversed(LinkSpeed.BAUDRATES) if current < b <= specs.model_specs.baud]
+        for speed in candidates:
+            log.debug('+ trying to switch to %d', speed)
+            self.set_speed(speed)
+            if self._check_speed(speed):
+                break
+
+            # go back to the previous speed before trying the next lower one
+            self.ser.baudrate = current
+            if not self.probe():
+                # the Minitel could have switched anyway
+                self.ser.baudrate = speed
+                if self.probe():
+                    break
+                self.ser.baudrate = current
+            log.debug('+ failed')
+
+        self.discard_typeahead()
+        self.baud = self.ser.baudrate
+        log.debug('+ speed is now %d', self.baud)
+        return self.baud
+
+    def _check_speed(self, speed):
+        """ Tells if the Minitel speed settings match a given baud rate.
+        """
+        try:
+            return self.get_speeds() == (speed, speed)
+        except (IndexError, ValueError):
+            # no or invalid reply
+            return False
+
+    @traced()
     def set_mode(self, mode, force=False):
         """ Sets the Minitel mode.
 
@@ -312,6 +935,7 @@ class Minitel(object):
         else:
             self.mode = mode
             self._in_vt_mode = mode == self.VIDEOTEX
+            self.state.invalidate('width', 'caps_lock', 'roll')
             if self._in_vt_mode:
                 self.videotex_graphic_mode(False)
                 self.activate_echo(False)
@@ -334,11 +958,40 @@ class Minitel(object):
         Returns:
             tuple: caps lock state, roll mode, screen width
         """
-        data = ord(self.request(Protocol.STATUS, Protocol.PRO2_LEN)[-1])
-        caps_lock = (data & 0x08) == 0
-        roll = (data & 0x02) == 1
-        width = (40, 80)[data & 0x01]
-        return caps_lock, roll, width
+        state = self.state
+        if None in (state.caps_lock, state.roll, state.width):
+            self._update_functional_status(self.request(Protocol.STATUS, Protocol.PRO2_LEN, ESC))
+        return state.caps_lock, state.roll, state.width
+
+    def _update_functional_status(self, reply):
+        """ Updates the cached state with a functional status reply.
+        """
+        data = ord(reply[-1])
+        state = self.state
+        state.caps_lock = (data & 0x08) == 0
+        state.roll = bool(data & 0x02)
+        state.width = (40, 80)[data & 0x01]
+
+    def set_roll_mode(self, on=True):
+        """ Activates or deactivates the roll mode.
+
+        In roll mode, a line feed on the last line scrolls the screen up instead of
+        moving the cursor back to the first line. The status line is not affected.
+
+        Parameters:
+            on (bool): True to activate the roll mode, False to deactivate it
+
+        Raises:
+            ValueError: if not in Videotex mode
+        """
+        if not self._in_vt_mode:
+            raise ValueError('not available in current mode')
+
+        reply = self.request(Protocol.ROLL_ON if on else Protocol.ROLL_OFF, Protocol.PRO2_LEN, ESC)
+        if len(reply) == Protocol.PRO2_LEN:
+            self._update_functional_status(reply)
+        else:
+            self.state.roll = on
 
     def is_w80(self):
         """ Tells if the screen is currently in 80 chars width.
@@ -347,10 +1000,12 @@ class Minitel(object):
             bool: is large screen currently active
         """
         if self.mode == self.TELEINFO:
+            self.state.width = 80
             return True
 
-        data = ord(self.request(Protocol.STATUS, Protocol.PRO2_LEN)[-1])
-        return bool(data & 0x01)
+        if self.state.width is None:
+            self.get_functional_status()
+        return self.state.width == 80
 
     def get_screen_width(self):
         """ Returns the width of the screen (in characters), depending on the
@@ -395,7 +1050,7 @@ class Minitel(object):
         if height not in [1, 2]:
             raise ValueError('invalid height')
 
-        return '\x1b' + chr(0x4c + (height - 1) + (width - 1) * 2)
+        return _CHAR_SIZES[width - 1][height - 1]
 
     def set_text_style(self, blink=None, inverse=None, underscore=None, bright=None):
         """ Sets the attributes for subsequently displayed text.
@@ -403,17 +1058,29 @@ class Minitel(object):
         self.send(self.text_style_sequence(blink, inverse, underscore, bright))
 
     def text_style_sequence(self, blink=None, inverse=None, underscore=None, bright=None):
-        # will allow us to access the arguments by their names
-        args = locals()
+        """ Returns the sequence setting the attributes for subsequently displayed text.
+
+        Attributes not available in the current mode are ignored.
+
+        Returns:
+            str: the sequence
+        """
+        key = (bool(self._in_vt_mode), blink, inverse, underscore, bright)
+        try:
+            return _text_styles[key]
+        except KeyError:
+            pass
+
+        args = {
+            TextAttribute.BLINK: blink, TextAttribute.INVERSE: inverse,
+            TextAttribute.UNDERSCORE: underscore, TextAttribute.BRIGHT: bright
+        }
         # selects the text attributes sequence table for the current mode
         mode_attributes = TextAttribute.VIDEOTEX if self._in_vt_mode else TextAttribute.TELEINFO
-        # build the sequence corresponding to the attributes specified in the call and send it
-        return ''.join(
-            mode_attributes[attr][value]
-            for attr, value in (
-                (a, args[a]) for a in mode_attributes if args[a] is not None
-            )
+        sequence = _text_styles[key] = ''.join(
+            mode_attributes[attr][args[attr]] for attr in sorted(mode_attributes) if args[attr] is not None
         )
+        return sequence
 
     def set_text_normal(self):
         """ Reverts to normal text.
@@ -434,6 +1101,7 @@ class Minitel(object):
         except (IndexError, TypeError):
             raise ValueError('invalid charset num (%s)' % num)
 
+    @traced()
     def clear_screen(self, part=Part.ALL):
         """ Clears (a part of) the screen.
 
@@ -487,15 +1155,29 @@ class Minitel(object):
     def beep(self):
         self.send(BEL)
 
-    def rlinput(self, max_length=40, marker=' ', start_pos=None, initial_value=None, max_wait=None):
+    @traced()
+    @_operation
+    def rlinput(self, max_length=40, marker=' ', start_pos=None, initial_value=None, max_wait=None,
+                local_echo=None, on_idle=None):
         """ User input with basic Gnu's readline features
 
+        When the local echo is used, typed characters are displayed by the Minitel itself
+        instead of being sent back by the library, which makes typing more responsive and
+        halves the serial traffic. The echo is suspended when the field is full, so that
+        extra characters do not overflow it. Keys typed before a change of the echo setting
+        is processed by the terminal are displayed or erased by the library as needed.
+
         Parameters:
             max_length (int): max length of the input
             marker (str): the char to be used as the input area filler
             start_pos (tuple): input area start position (default: current one)
             initial_value(str): the value of the input on entry
             max_wait (int): maximum wait time in seconds for user to complete the input (if None, waits indefinitely)
+            local_echo (bool): True to use the terminal local echo in Videotex mode (default: the
+                setting of the :py:attr:`local_echo` attribute)
+            on_idle (callable): invoked with the current value while waiting for keys, so that
+                the caller can update other parts of the screen. It must return True if it
+                has sent something, the cursor being then put back at the input position.
 
         Returns:
             tuple: the entered value and the key used to terminate the entry. If the time limit has been reached,
@@ -503,7 +1185,9 @@ class Minitel(object):
         """
         initial_value = initial_value or ''
         chars = list(initial_value)
-        self.ser.flushInput()
+        if local_echo is None:
+            local_echo = self.local_echo
+        local_echo = local_echo and self._in_vt_mode
 
         # define the field starting position
         if start_pos:
@@ -516,54 +1200,114 @@ class Minitel(object):
         self.send(initial_value.ljust(max_length, marker))
         self.goto_xy(x0 + len(initial_value), y0)
 
+        echo = False
+        # the keys received before the last changes of the echo setting reached the terminal,
+        # as (count, echoed by the terminal) segments in their order of arrival
+        backlog = deque()
+
+        def update_echo():
+            # the local echo is active only while there is room left in the field
+            wanted = local_echo and len(chars) < max_length
+            if wanted != echo:
+                self.activate_echo(wanted)
+                # the keys typed before the command was processed follow the previous setting
+                self.flush()
+                self._stash_input()
+                count = len(self._typeahead) - sum(n for n, _ in backlog)
+                if count > 0:
+                    backlog.append((count, echo))
+            return wanted
+
+        def next_key():
+            # returns the next key, and tells if the terminal has displayed it
+            key = self.receive()
+            if not key:
+                return key, False
+            if backlog:
+                count, echoed = backlog[0]
+                if count > 1:
+                    backlog[0] = (count - 1, echoed)
+                else:
+                    backlog.popleft()
+                return key, echoed
+            return key, echo
+
+        def erase_echo():
+            # the key has been displayed past the end of the field if it is full
+            self.send(BS + (marker if len(chars) < max_length else ' ') + BS)
+
         # handle user typed keys
-        limit = time.time() + (max_wait if max_wait else float('inf'))
-        while time.time() < limit:
-            c = self.receive()
-            if c:
-                if c == SEP:
-                    c = self.receive()
-                    if c in (KeyCode.SEND, KeyCode.NEXT, KeyCode.PREV, KeyCode.CONTENT):
-                        break
-                    elif c == KeyCode.CORRECTION:
-                        if chars:
-                            del chars[-1]
-                            self.send(BS + marker + BS)
+        try:
+            echo = update_echo()
+            limit = time.time() + (max_wait if max_wait else float('inf'))
+            while time.time() < limit:
+                c, echoed = next_key()
+                if c:
+                    if c == SEP:
+                        c = next_key()[0]
+                        if c in (KeyCode.SEND, KeyCode.NEXT, KeyCode.PREV, KeyCode.CONTENT):
+                            break
+                        elif c == KeyCode.CORRECTION:
+                            if chars:
+                                del chars[-1]
+                                self.send(BS + marker + BS)
+                                echo = update_echo()
+                            else:
+                                self.beep()
+                        elif c == KeyCode.CANCEL:
+                            if chars:
+                                chars = []
+                                self.goto_xy(x0, y0)
+                                self.send(marker * max_length)
+                                self.goto_xy(x0, y0)
+                                echo = update_echo()
+                            else:
+                                self.beep()
                         else:
                             self.beep()
-                    elif c == KeyCode.CANCEL:
-                        if chars:
-                            chars = []
-                            self.goto_xy(x0, y0)
-                            self.send(marker * max_length)
-                            self.goto_xy(x0, y0)
+                    elif '\x20' <= c <= '\x7a':
+                        if len(chars) < max_length:
+                            chars.append(c)
+                            if not echoed:
+                                self.send(c)
+                            elif self.tracer:
+                                self.tracer.key_echoed()
+                            echo = update_echo()
                         else:
+                            if echoed:
+                                # typed before the echo suspension reached the terminal
+                                erase_echo()
                             self.beep()
+                    elif c == CR:
+                        break
                     else:
+                        if echoed and c <= '\x7e':
+                            # printable, but not accepted
+                            erase_echo()
                         self.beep()
-                elif '\x20' <= c <= '\x7a':
-                    if len(chars) < max_length:
-                        chars.append(c)
-                        self.send(c)
-                    else:
-                        self.beep()
-                elif c == CR:
-                    break
+
                 else:
-                    self.beep()
+                    if on_idle and on_idle(''.join(chars)):
+                        self.goto_xy(x0 + len(chars), y0)
+                    # do not hog CPU
+                    self._terminate_event.wait(0.1)
 
-            # do not hog CPU
-            time.sleep(0.1)
+        finally:
+            if echo:
+                self.activate_echo(False)
 
         return ''.join(chars), c
 
+    @traced()
+    @_operation
     def input(self, max_length=40, prompt=None, input_start_xy=None, marker=' ', max_wait=None):
         """ Get a user input from the Minitel.
 
         Handles common editing actions, such as backspace and clear input.
 
-        Warning:
-            The serial link is flushed before waiting for the input.
+        Note:
+            Keys typed in advance are taken into account. Use :py:meth:`discard_typeahead`
+            before calling this method if this is not wanted.
 
         Parameters:
             max_length (int): maximum length of entered text
@@ -592,6 +1336,8 @@ class Minitel(object):
         self.send(' ' * (max_length - len(value)))
         return value, key
 
+    @traced()
+    @_operation
     def wait_for_key(self, key_set=(SEP + KeyCode.SEND,), max_wait=None):
         """ Waits for the user to type any key in the provided set.
 
@@ -605,7 +1351,6 @@ class Minitel(object):
         special_keys = set((seq[1] for seq in key_set if len(seq) > 1))
         normal_keys = set(key_set) - special_keys
 
-        self.ser.flushInput()
         limit = time.time() + (max_wait if max_wait else float('inf'))
         while time.time() < limit:
             c = self.receive()
@@ -625,9 +1370,11 @@ class Minitel(object):
                     else:
                         self.beep()
 
-            # no need to eat CPU cycles since the user will not type at light speed ;)
-            time.sleep(0.1)
+            else:
+                # no need to eat CPU cycles since the user will not type at light speed ;)
+                self._terminate_event.wait(0.1)
 
+    @traced()
     def display_text(self, text, x=0, y=0, clear_eol=False, clear_bol=False, charset=0, char_width=1, char_height=1):
         """ Displays a text at a given position of the screen, with various options.
 
@@ -661,6 +1408,7 @@ class Minitel(object):
         # remember we are no more interpreting graphical characters
         self._vt_graphics = False
 
+    @traced()
     def display_text_center(self, text, y=0, charset=0, char_width=1, char_height=1, pad_char=' '):
         """ Convenience method for displaying a centered text on a given line.
 
@@ -684,7 +1432,9 @@ class Minitel(object):
         """
         if self._in_vt_mode:
             if 0 <= x < 40:
-                self.send(US + '\x40' + chr(0x41 + x) + text + '\x0a')
+                # the status line is left by a line feed, which restores the previous cursor
+                # position : it can thus be written in the middle of other output
+                self.send_raw(encode(US + '\x40' + chr(0x41 + x) + text + '\x0a'), Priority.URGENT)
             else:
                 raise ValueError('invalid X position (%d)' % x)
         else:
@@ -714,21 +1464,37 @@ class Minitel(object):
         Raises:
             ValueError: if coordinates are outside valid ranges
         """
-        if not 0 <= y <= Y_MAX:
-            raise ValueError('invalid Y position (%d)' % y)
-
-        if self._in_vt_mode:
-            if not 0 <= x < 40:
-                raise ValueError('invalid X position (%d)' % x)
-            self.send(US + chr(0x41 + y) + chr(0x41 + x))
+        if self._in_vt_mode and 0 <= y <= Y_MAX and 0 <= x < 40:
+            self.send_raw(Encoded.GOTO[y][x])
         else:
-            if not 0 <= x < 80:
-                raise ValueError('invalid X position (%d)' % x)
-            self.send(TeleinfoCommand.CUP % (y, x))
+            self.send(self.goto_xy_sequence(x, y))
 
         # seems to need some time to execute
         time.sleep(0.1)
 
+    def goto_xy_sequence(self, x, y):
+        """ Returns the sequence for moving the cursor to the given 0 based coordinates
+        in the current mode.
+
+        Parameters:
+            x (int): X (col) position
+            y (int): Y (line) position
+
+        Returns:
+            str: the sequence
+
+        Raises:
+            ValueError: if coordinates are outside valid ranges
+        """
+        if not 0 <= y <= Y_MAX:
+            raise ValueError('invalid Y position (%d)' % y)
+
+        x_max = 40 if self._in_vt_mode else 80
+        if not 0 <= x < x_max:
+            raise ValueError('invalid X position (%d)' % x)
+
+        return goto_sequence(x, y, teleinfo=not self._in_vt_mode)
+
     def cursor_home(self):
         """ Moves the cursor to the top-left corner of the screen.
         """
@@ -740,7 +1506,7 @@ class Minitel(object):
         Returns:
             tuple: X, Y coordinates as a tuple
         """
-        _, y, x = self.request(GET_POS, 3)
+        _, y, x = self.request(GET_POS, 3, US)
         return ord(x) - 65, ord(y) - 65
 
     def show_cursor(self, on=True):
@@ -756,6 +1522,7 @@ class Minitel(object):
                 self.send('\x11')
             else:
                 self.send('\x14')
+            self.state.cursor_visible = on
 
     def set_colors(self, fg=None, bg=None):
         """ Sets the color of subsequently displayed text.
@@ -769,15 +1536,15 @@ class Minitel(object):
         Raises:
             ValueError if color is out of range
         """
-        seq = ''
+        seq = b''
         if fg is not None and fg != self.fg:
             if not 0 <= fg <= 7:
                 raise ValueError('Foreground out of range: %d' % fg)
 
             if self._in_vt_mode:
-                seq += ESC + chr(0x40 + fg)
+                seq += Encoded.FG[fg]
             else:
-                seq += TeleinfoCommand.ATTR % +(30 + fg)
+                seq += encode(TeleinfoCommand.ATTR % (30 + fg))
             self.fg = fg
 
         if bg is not None and bg != self.bg:
@@ -785,14 +1552,15 @@ class Minitel(object):
                 raise ValueError('Background out of range: %d' % bg)
 
             if self._in_vt_mode:
-                seq += ESC + chr(0x50 + bg)
+                seq += Encoded.BG[bg]
             else:
-                seq += TeleinfoCommand.ATTR % (40 + bg)
+                seq += encode(TeleinfoCommand.ATTR % (40 + bg))
             self.bg = bg
 
         if seq:
-            self.send(seq)
+            self.send_raw(seq)
 
+    @traced()
     def reset(self):
         """ Guess what...
         """
@@ -800,10 +1568,16 @@ class Minitel(object):
             self.send(Protocol.PRO1 + Protocol.RESET)
         else:
             self.send(ESC + 'c')
+        self.state.invalidate()
 
     def flush(self):
         """ Flushes the serial link (output direction).
+
+        If the background writer is active, waits first for all the data queued so far
+        to be written.
         """
+        if self._writer:
+            self._writer.drain()
         self.ser.flush()
 
 
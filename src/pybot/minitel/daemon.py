@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+
+""" A daemon sharing Minitels between processes.
+
+Only one process can own a serial port, and opening a Minitel implies the discovery
+of its link speed, which can take several seconds. The daemon opens the Minitels once
+and keeps them ready, other processes using them through a Unix domain socket, with
+the help of :py:class:`pybot.minitel.client.MinitelClient`.
+
+The protocol is made of JSON objects, one per line, encoded in UTF-8. A request has
+the following members :
+
+    - ``op`` : the operation name
+    - ``terminal`` : the name of the target Minitel (optional if only one is served)
+    - ``args``, ``kwargs`` : the arguments of the operation (optional)
+
+and is answered by either ``{"result": ...}`` or ``{"error": "message", "type": "ValueError"}``.
+
+The operations are the ones listed in :py:data:`MINITEL_OPERATIONS`, which invoke the
+method of the same name of the Minitel, plus the following ones :
+
+    - ``terminals`` : returns the description of the served Minitels
+    - ``send_raw`` : sends encoded data, passed in base64
+    - ``store_page``, ``show_page``, ``drop_page`` : manage pre-compiled pages (such as
+      the static layers of forms or ``.vdt`` files), stored by the daemon so that they
+      can be displayed by sending only their name
+    - ``acquire``, ``release`` : reserve a Minitel for the connection, the requests
+      of the other connections for it waiting until it is released
+
+Each request holds the lock of its Minitel while executed, so that requests from
+different clients are not interleaved. For this reason, the wait time of the input
+operations (``wait_for_key``, ``input``, ``rlinput``) is limited to
+:py:data:`SHARED_MAX_WAIT` unless the Minitel has been acquired, so that a client
+waiting for a key does not block the others. Clients can repeat the operation until
+they get a key, or acquire the Minitel for longer waits.
+
+The socket is accessible by the user running the daemon only, unless another mode is
+specified. A daemon refuses to start if another one is already listening on its socket.
+"""
+
+__author__ = 'Eric Pascual'
+
+import argparse
+import base64
+import errno
+import json
+import logging
+import os
+import socket
+import stat
+import tempfile
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from .core import Minitel
+from .discovery import discover
+
+log = logging.getLogger('minitel').getChild('daemon')
+
+#: the default path of the daemon socket, in the runtime directory of the user if any
+DEFAULT_SOCKET_PATH = (
+    os.path.join(os.environ['XDG_RUNTIME_DIR'], 'pybot-minitel.sock') if os.environ.get('XDG_RUNTIME_DIR')
+    else os.path.join(tempfile.gettempdir(), 'pybot-minitel-%d.sock' % os.getuid())
+)
+
+#: the default access mode of the daemon socket
+DEFAULT_SOCKET_MODE = 0o600
+
+#: the maximum wait time in seconds of the input operations requested by clients which
+#: have not acquired the Minitel
+SHARED_MAX_WAIT = 5
+
+# the position of the max_wait argument of the input operations
+_MAX_WAIT_ARG = {'wait_for_key': 1, 'input': 4, 'rlinput': 4}
+
+#: the Minitel methods available through the daemon
+MINITEL_OPERATIONS = frozenset((
+    'send', 'newline', 'beep', 'flush', 'reset',
+    'set_mode', 'videotex_graphic_mode', 'set_roll_mode', 'show_cursor', 'activate_echo',
+    'clear_screen', 'clear_status', 'clear_all', 'clear_line',
+    'goto_xy', 'get_cursor_position', 'set_colors', 'set_text_style', 'set_text_normal',
+    'set_char_size', 'set_charset', 'display_text', 'display_text_center', 'display_status',
+    'receive', 'discard_typeahead', 'wait_for_key', 'input', 'rlinput',
+    'get_screen_width', 'get_functional_status', 'get_speeds',
+))
+
+
+def _remove_stale_socket(path):
+    """ Removes the socket left by a previous run which did not terminate properly.
+
+    Raises:
+        OSError: if another daemon is listening on the socket, or if the path is not a socket
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISSOCK(mode):
+        raise OSError(errno.EEXIST, 'not a socket (%s)' % path)
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, 'a daemon is already listening on %s' % path)
+
+
+def _cap_max_wait(op, args, kwargs):
+    """ Returns the arguments of an input operation, its wait time being limited to
+    :py:data:`SHARED_MAX_WAIT`.
+    """
+    def capped(max_wait):
+        # no wait time means waiting indefinitely
+        return min(max_wait, SHARED_MAX_WAIT) if max_wait else SHARED_MAX_WAIT
+
+    pos = _MAX_WAIT_ARG[op]
+    args, kwargs = list(args), dict(kwargs)
+    if len(args) > pos:
+        args[pos] = capped(args[pos])
+    else:
+        kwargs['max_wait'] = capped(kwargs.get('max_wait'))
+    return args, kwargs
+
+
+class Terminal(object):
+    """ A Minitel served by the daemon.
+    """
+    def __init__(self, name, mt):
+        self.name = name
+        self.mt = mt
+        # reentrant, so that a connection can hold it across requests (see acquire)
+        self.lock = threading.RLock()
+
+    def describe(self):
+        specs = self.mt.state.specs
+        return {
+            'name': self.name,
+            'port': getattr(self.mt.ser, 'port', None),
+            'speed': self.mt.ser.baudrate,
+            'model': specs.model_specs.name if specs else None,
+        }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """ Serves the requests of a client connection, in its own thread.
+    """
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        # count of acquire requests by terminal, released when the connection ends
+        self.held = {}
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line.decode('utf-8'))
+                reply = {'result': self.server.execute(request, self)}
+            except Exception as e:
+                log.debug('request failed (%s: %s)', type(e).__name__, e)
+                reply = {'error': str(e), 'type': type(e).__name__}
+
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+    def finish(self):
+        for terminal, count in self.held.items():
+            log.warning('connection closed while holding %s', terminal.name)
+            for _ in range(count):
+                terminal.lock.release()
+        self.held.clear()
+        socketserver.StreamRequestHandler.finish(self)
+
+
+class MinitelDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Serves Minitels to the clients connecting to a Unix domain socket.
+
+    Use :py:meth:`serve_forever` to process the requests, and :py:meth:`close` to
+    release the socket and close the Minitels once it has returned. If the daemon runs
+    in another thread, :py:meth:`shutdown` makes it return.
+    """
+    daemon_threads = True
+
+    def __init__(self, terminals, socket_path=DEFAULT_SOCKET_PATH, socket_mode=DEFAULT_SOCKET_MODE):
+        """
+        Parameters:
+            terminals (dict): the Minitels to be served, keyed by their names
+            socket_path (str): the path of the socket (default: :py:data:`DEFAULT_SOCKET_PATH`)
+            socket_mode (int): the access mode of the socket (default: :py:data:`DEFAULT_SOCKET_MODE`)
+
+        Raises:
+            ValueError: if no Minitel is provided
+            OSError: if the socket path is used by another daemon, or is not a socket
+        """
+        if not terminals:
+            raise ValueError('no Minitel to serve')
+
+        self.terminals = dict((name, Terminal(name, mt)) for name, mt in terminals.items())
+        self.pages = {}
+        self._pages_lock = threading.Lock()
+        self.socket_mode = socket_mode
+
+        _remove_stale_socket(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+        self.socket_path = socket_path
+
+    def server_bind(self):
+        # the socket must not be accessible to other users, even for a short while
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, self.socket_mode)
+
+    def close(self):
+        """ Removes the socket and closes the Minitels.
+        """
+        self.server_close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        for terminal in self.terminals.values():
+            terminal.mt.close()
+
+    def _terminal(self, name):
+        if name is None:
+            if len(self.terminals) != 1:
+                raise ValueError('terminal name is mandatory when several Minitels are served')
+            return next(iter(self.terminals.values()))
+        try:
+            return self.terminals[name]
+        except KeyError:
+            raise ValueError('no such terminal (%s)' % name)
+
+    def _page(self, name):
+        with self._pages_lock:
+            try:
+                return self.pages[name]
+            except KeyError:
+                raise ValueError('no such page (%s)' % name)
+
+    def execute(self, request, handler):
+        """ Executes a request and returns its result.
+
+        Parameters:
+            request (dict): the decoded request
+            handler: the handler of the connection issuing the request
+
+        Returns:
+            the result of the operation
+
+        Raises:
+            ValueError: if the request is invalid
+        """
+        op = request.get('op')
+        args = request.get('args') or []
+        kwargs = request.get('kwargs') or {}
+
+        if op == 'terminals':
+            return [t.describe() for t in sorted(self.terminals.values(), key=lambda t: t.name)]
+        if op == 'store_page':
+            name, data = args
+            with self._pages_lock:
+                self.pages[name] = base64.b64decode(data)
+            return None
+        if op == 'drop_page':
+            with self._pages_lock:
+                return self.pages.pop(args[0], None) is not None
+
+        terminal = self._terminal(request.get('terminal'))
+        if op == 'acquire':
+            terminal.lock.acquire()
+            handler.held[terminal] = handler.held.get(terminal, 0) + 1
+            return None
+        if op == 'release':
+            if not handler.held.get(terminal):
+                raise ValueError('terminal not acquired (%s)' % terminal.name)
+            handler.held[terminal] -= 1
+            if not handler.held[terminal]:
+                del handler.held[terminal]
+            terminal.lock.release()
+            return None
+
+        if op in ('send_raw', 'show_page'):
+            data = base64.b64decode(args[0]) if op == 'send_raw' else self._page(args[0])
+            with terminal.lock:
+                return terminal.mt.send_raw(data)
+
+        if op not in MINITEL_OPERATIONS:
+            raise ValueError('invalid operation (%s)' % op)
+        if op in _MAX_WAIT_ARG and not handler.held.get(terminal):
+            args, kwargs = _cap_max_wait(op, args, kwargs)
+        with terminal.lock:
+            return getattr(terminal.mt, op)(*args, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shares Minitels between processes.")
+    parser.add_argument(
+        'ports',
+        nargs='*',
+        help="the ports of the Minitels, as NAME=DEVICE or DEVICE, the name being then the "
+             "device base name (default: the discovered Minitels)"
+    )
+    parser.add_argument(
+        '-s', '--socket',
+        help='socket path (default: %s)' % DEFAULT_SOCKET_PATH,
+        default=DEFAULT_SOCKET_PATH
+    )
+    parser.add_argument(
+        '-m', '--mode',
+        help='socket access mode, in octal (default: %o)' % DEFAULT_SOCKET_MODE,
+        type=lambda s: int(s, 8),
+        default=DEFAULT_SOCKET_MODE
+    )
+    parser.add_argument(
+        '-b', '--baud',
+        help="baud rate, or 'auto' for the highest one supported by the model (default: 4800)",
+        type=lambda s: s if s == 'auto' else int(s),
+        choices=(1200, 4800, 9600, 'auto'),
+        default=4800
+    )
+    parser.add_argument(
+        '-d', '--debug',
+        help='activates debug trace',
+        action='store_true'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="[%(levelname).1s] %(name)s: %(message)s"
+    )
+
+    devices = {}
+    for spec in args.ports:
+        name, _, device = spec.rpartition('=')
+        devices[name or os.path.basename(device)] = device
+
+    terminals = {}
+    try:
+        if devices:
+            for name, device in devices.items():
+                terminals[name] = Minitel(device, baud=args.baud)
+        else:
+            for result in discover(keep_open=True, baud=args.baud):
+                terminals[os.path.basename(result.port)] = result.minitel
+
+        if not terminals:
+            parser.exit(1, '[ERROR] no Minitel found\n')
+
+        server = MinitelDaemon(terminals, args.socket, args.mode)
+    except (ValueError, EnvironmentError) as e:
+        for mt in terminals.values():
+            mt.close()
+        parser.exit(1, '[ERROR] %s\n' % e)
+
+    log.info('serving %s on %s', ', '.join(sorted(terminals)), args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,3 @@
 # -*- coding: utf-8 -*-
 
-from pybot_minitel_demo import main
+from .pybot_minitel_demo import main
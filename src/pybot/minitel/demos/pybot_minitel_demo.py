@@ -15,10 +15,12 @@ except ImportError:
     Image = None
 
 from pybot.minitel import Minitel
+from pybot.minitel.core import encode
 from pybot.minitel.forms import Form
 from pybot.minitel.image import VideotexImage
 from pybot.minitel.asciiart import AsciiArtImage
 from pybot.minitel.menu import Menu
+from pybot.minitel.player import FilePlayer
 
 logging.basicConfig(
     level=logging.INFO,
@@ -112,7 +114,7 @@ class Runner(object):
             code = vt_img.to_videotex()
 
             mt.videotex_graphic_mode()
-            mt.send(code)
+            mt.send_bulk(code)
 
             mt.display_text('ENVOI', 34, 23)
             mt.wait_for_key(max_wait=60)
@@ -121,7 +123,7 @@ class Runner(object):
         """ loads and display an ASCII art image
         """
         mt.clear_all()
-        with file(os.path.join(self.images_dir, 'youpi-ascii.txt'), 'rt') as fp:
+        with open(os.path.join(self.images_dir, 'youpi-ascii.txt'), 'rt') as fp:
             lines = fp.readlines()
             img = AsciiArtImage(lines)
             img.display(mt, x=4, y=4)
@@ -147,18 +149,33 @@ class Runner(object):
 
         if _args.save:
             img_file = 'image.vt'
-            with file(img_file, 'wb') as fp:
-                fp.write(''.join(code))
+            with open(img_file, 'wb') as fp:
+                fp.write(encode(''.join(code)))
                 print("Videotex image saved as : %s" % img_file)
 
         mt.videotex_graphic_mode()
-        mt.send(code)
+        mt.send_bulk(code)
 
         mt.display_text('YOUPI 2.0', x=3, y=18, char_width=2, char_height=2)
         mt.display_text('by POBOT', x=30, y=23)
 
         mt.wait_for_key(max_wait=_args.wait)
 
+    def demo_play(self, mt, opts):
+        """ plays Videotex files (.vt, .vdt)
+        """
+        _parser = argparse.ArgumentParser()
+        _parser.add_argument('files', nargs='+')
+        _parser.add_argument('-w', '--wait', type=int, default=5)
+        _args = _parser.parse_args(opts)
+
+        for path in _args.files:
+            with FilePlayer(mt, path) as player:
+                if not player.play():
+                    break
+            if mt.wait_for_key(max_wait=_args.wait):
+                break
+
     def demo_input(self, mt, opts):
         """ gets a user input
         """
@@ -277,7 +294,7 @@ class Runner(object):
         """ loads a form from its JSON representation and displays it
         """
         form = Form(mt)
-        with file(os.path.join(self.data_dir, 'form_def.json'), 'rt') as fp:
+        with open(os.path.join(self.data_dir, 'form_def.json'), 'rt') as fp:
             form.load_definition(fp.read())
 
         content = form.render_and_input()
@@ -310,9 +327,9 @@ def main():
     )
     parser.add_argument(
         '-b', '--baud',
-        help='baud rate (default: 9600)',
-        type=int,
-        choices=(1200, 4800, 9600),
+        help="baud rate, or 'auto' for the highest one supported by the model (default: 9600)",
+        type=lambda s: s if s == 'auto' else int(s),
+        choices=(1200, 4800, 9600, 'auto'),
         default=9600
     )
     parser.add_argument(
@@ -336,7 +353,7 @@ def main():
     try:
         Runner(args).run_demo(args.demo_name, args.demo_opts)
     except NoSuchDemoError as e:
-        parser.exit(2, '[ERROR] no such demo (%s)\n' % e.message)
+        parser.exit(2, '[ERROR] no such demo (%s)\n' % e)
 
 if __name__ == '__main__':
     main()
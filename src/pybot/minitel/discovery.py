@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+""" Discovery of the Minitels connected to the serial ports.
+
+The ports are probed concurrently, each one in its own thread, so that the discovery
+takes roughly the time of the slowest port instead of the sum of all of them. Finding
+the speed of a Minitel can take several seconds when it is set to a slow one, or when
+nothing answers on the port.
+
+Example::
+
+    for result in discover():
+        print('%s: %s at %d bauds' % (result.port, result.specs.model_specs.name, result.speed))
+"""
+
+__author__ = 'Eric Pascual'
+
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import glob
+import logging
+
+from serial.serialutil import SerialException
+
+from .core import Minitel
+
+log = logging.getLogger('minitel').getChild('discovery')
+
+#: the patterns of the device files of the ports scanned by default
+PORT_PATTERNS = ('/dev/ttyUSB*', '/dev/ttyACM*')
+
+
+class DiscoveryResult(namedtuple('DiscoveryResult', 'port speed specs minitel')):
+    """ A Minitel found on a port.
+
+    Attributes:
+        port (str): the port device
+        speed (int): the link speed the Minitel is using
+        specs (:py:class:`DeviceSpecs`): the decoded identification ROM
+        minitel (:py:class:`Minitel`): the ready to use instance, if it has been kept open,
+            None otherwise
+    """
+    __slots__ = ()
+
+
+def candidate_ports(patterns=PORT_PATTERNS):
+    """ Returns the ports which can have a Minitel connected.
+
+    Parameters:
+        patterns (iterable of str): the glob patterns of the port devices
+
+    Returns:
+        list of str: the port devices, sorted by name
+    """
+    return sorted(set(path for pattern in patterns for path in glob.glob(pattern)))
+
+
+def probe_port(port, keep_open=False, **kwargs):
+    """ Looks for a Minitel on a port.
+
+    The speed of the Minitel is left unchanged, unless a ``baud`` keyword argument is
+    provided.
+
+    Parameters:
+        port (str): the port device
+        keep_open (bool): if True, the :py:class:`Minitel` instance is returned in the
+            result instead of being closed
+        kwargs: additional arguments for the :py:class:`Minitel` constructor
+
+    Returns:
+        :py:class:`DiscoveryResult`: the discovered Minitel, or None if no Minitel answered
+    """
+    kwargs.setdefault('baud', None)
+    try:
+        mt = Minitel(port, **kwargs)
+    except (ValueError, SerialException, OSError) as e:
+        log.debug('no Minitel found on %s (%s)', port, e)
+        return None
+
+    result = DiscoveryResult(port, mt.ser.baudrate, mt.device_specs, mt if keep_open else None)
+    if not keep_open:
+        mt.close()
+    log.info('%s found on %s at %d bauds', result.specs.model_specs.name, port, result.speed)
+    return result
+
+
+def discover(ports=None, keep_open=False, max_workers=None, **kwargs):
+    """ Looks for Minitels on several ports concurrently.
+
+    Parameters:
+        ports (iterable of str): the ports to be probed (default: the ones returned by
+            :py:func:`candidate_ports`)
+        keep_open (bool): if True, the :py:class:`Minitel` instances are returned in the
+            results instead of being closed
+        max_workers (int): the maximum count of ports probed at the same time (default:
+            all of them)
+        kwargs: additional arguments for the :py:class:`Minitel` constructor
+
+    Returns:
+        list of :py:class:`DiscoveryResult`: the discovered Minitels, in the order of the ports
+    """
+    ports = candidate_ports() if ports is None else list(ports)
+    if not ports:
+        return []
+
+    pool = ThreadPool(min(max_workers or len(ports), len(ports)))
+    try:
+        results = pool.map(lambda port: probe_port(port, keep_open, **kwargs), ports)
+    finally:
+        pool.close()
+        pool.join()
+    return [result for result in results if result]
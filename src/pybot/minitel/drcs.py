@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+""" Dynamically redefinable character sets (DRCS) management.
+
+Minitel 2 and later models allow redefining the patterns of the characters, each one
+being an 8x10 pixels matrix. Once loaded, a redefined character is displayed with a
+single byte, which makes logos and detailed images much cheaper to display than their
+mosaic equivalent, especially when they are displayed several times.
+
+The :py:func:`image_to_glyphs` converter produces a glyph set and the character map
+reproducing an image, identical tiles sharing the same glyph.
+
+Warning:
+    The image converter depends on the availability of PIL.
+"""
+
+__author__ = 'Eric Pascual'
+
+import hashlib
+import logging
+
+from .constants import SI, SO
+from .core import encode
+from .sequences import Drcs, goto_sequence
+
+log = logging.getLogger('minitel').getChild('drcs')
+
+try:
+    import PIL.Image as Image
+except ImportError:
+    Image = None
+
+#: glyph width in pixels
+GLYPH_WIDTH = 8
+#: glyph height in pixels
+GLYPH_HEIGHT = 10
+#: the codes of the redefinable characters
+GLYPH_CODES = [chr(c) for c in range(0x21, 0x7f)]
+
+_BLANK = (0,) * GLYPH_HEIGHT
+
+
+def pattern_sequence(rows):
+    """ Returns the encoded pattern of a glyph, as expected by the terminal.
+
+    The 80 bits of the matrix are sent as 14 bytes of 6 bits, the last one being
+    padded with zeros.
+
+    Parameters:
+        rows (tuple of int): the 10 rows of the glyph, as 8 bits values (MSB being the left pixel)
+
+    Returns:
+        str: the pattern sequence
+    """
+    bits = 0
+    for row in rows:
+        bits = (bits << GLYPH_WIDTH) | (row & 0xff)
+    bits <<= 4
+    return ''.join(chr(0x40 + ((bits >> shift) & 0x3f)) for shift in range(78, -1, -6))
+
+
+class GlyphSet(object):
+    """ A set of redefined characters.
+
+    Glyphs are associated to the character codes in the range [0x21, 0x7e]. Identical
+    glyphs are stored once, :py:meth:`add` returning the code of the existing one.
+
+    The set is loaded in the terminal by :py:meth:`upload`, which does nothing if it has
+    already been loaded since the last reset of the terminal.
+    """
+    def __init__(self, charset=0):
+        """
+        Parameters:
+            charset (int): the redefined charset (0 for G0, 1 for G1)
+
+        Raises:
+            ValueError: if invalid charset
+        """
+        if charset not in (0, 1):
+            raise ValueError('invalid charset (%s)' % charset)
+
+        self._charset = charset
+        self._glyphs = []
+        self._codes = {}
+        self._key = None
+
+    @property
+    def charset(self):
+        """ The redefined charset."""
+        return self._charset
+
+    def __len__(self):
+        return len(self._glyphs)
+
+    def add(self, rows):
+        """ Adds a glyph to the set, if not already defined.
+
+        Parameters:
+            rows (iterable of int): the 10 rows of the glyph, as 8 bits values (MSB being the left pixel)
+
+        Returns:
+            str: the character displaying the glyph
+
+        Raises:
+            ValueError: if the glyph is invalid, or if there is no more room in the set
+        """
+        rows = tuple(rows)
+        if len(rows) != GLYPH_HEIGHT:
+            raise ValueError('glyphs must have %d rows' % GLYPH_HEIGHT)
+
+        try:
+            return self._codes[rows]
+        except KeyError:
+            pass
+
+        if len(self._glyphs) == len(GLYPH_CODES):
+            raise ValueError('glyph set is full (%d glyphs)' % len(GLYPH_CODES))
+
+        code = GLYPH_CODES[len(self._glyphs)]
+        self._glyphs.append(rows)
+        self._codes[rows] = code
+        self._key = None
+        return code
+
+    @property
+    def key(self):
+        """ A digest of the set content, identifying it in the terminal state.
+        """
+        if self._key is None:
+            self._key = hashlib.md5(repr((self._charset, self._glyphs)).encode('ascii')).hexdigest()
+        return self._key
+
+    def upload_sequence(self):
+        """ Returns the encoded sequence loading the set in the terminal.
+
+        Returns:
+            str: the sequence
+        """
+        return encode(
+            (Drcs.LOAD_G1 if self._charset else Drcs.LOAD_G0) +
+            Drcs.LOAD_FROM % GLYPH_CODES[0] +
+            ''.join(pattern_sequence(rows) + Drcs.END_CHAR for rows in self._glyphs) +
+            # any cursor positioning terminates the loading
+            goto_sequence(0, 1)
+        )
+
+    def upload(self, mt, force=False):
+        """ Loads the set in the terminal, unless already done.
+
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+            force (bool): if True, the set is loaded even if already done
+
+        Returns:
+            bool: True if the set has been loaded, False if it was already there
+
+        Raises:
+            ValueError: if the model does not support redefinable characters
+        """
+        specs = mt.device_specs
+        if not (specs and specs.model_specs.chars):
+            raise ValueError('redefinable characters not supported by this model')
+
+        loaded = mt.state.drcs or {}
+        if not force and loaded.get(self._charset) == self.key:
+            return False
+
+        log.debug('loading %d glyph(s) in G%d', len(self._glyphs), self._charset)
+        mt.send_raw(self.upload_sequence())
+        loaded[self._charset] = self.key
+        mt.state.drcs = loaded
+        return True
+
+    def text_sequence(self, chars):
+        """ Returns the sequence displaying characters with the redefined set, and
+        restoring the standard one afterwards.
+
+        Parameters:
+            chars (str): the characters, as returned by :py:meth:`add`
+
+        Returns:
+            str: the sequence
+        """
+        if self._charset:
+            return Drcs.USE_G1 + SO + chars + SI + Drcs.STD_G1
+        return Drcs.USE_G0 + chars + Drcs.STD_G0
+
+    def display(self, mt, lines, x=0, y=0):
+        """ Displays lines of redefined characters at a given position, loading the
+        set first if needed.
+
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+            lines (list of str): the characters to be displayed, organized as a list of lines
+            x, y (int): the coordinates of the target area (default: 0, 0)
+        """
+        self.upload(mt)
+        mt.send(''.join(
+            mt.goto_xy_sequence(x, y + i) + self.text_sequence(line)
+            for i, line in enumerate(lines)
+        ))
+
+
+def image_to_glyphs(image, threshold=128, glyph_set=None):
+    """ Converts an image into redefined characters.
+
+    The image is converted to black and white, and cut in 8x10 pixels tiles, its size
+    being rounded up to whole tiles. Identical tiles share the same glyph, and blank
+    ones are rendered as spaces.
+
+    Parameters:
+        image (:py:class:`PIL.Image`): the image to be converted
+        threshold (int): the gray level above which pixels are lit (default: 128)
+        glyph_set (GlyphSet): the set in which glyphs are added (default: a new G0 set)
+
+    Returns:
+        tuple: the glyph set, and the characters reproducing the image, as a list of lines
+
+    Raises:
+        ValueError: if the image needs more glyphs than a set can hold
+        RuntimeError: if PIL is not available
+    """
+    if not Image:
+        raise RuntimeError('PIL is not available')
+
+    glyph_set = glyph_set or GlyphSet()
+
+    im = image.convert('L')
+    w, h = im.size
+    cols = (w + GLYPH_WIDTH - 1) // GLYPH_WIDTH
+    rows = (h + GLYPH_HEIGHT - 1) // GLYPH_HEIGHT
+    pixels = im.load()
+
+    def bit(px, py):
+        return 1 if px < w and py < h and pixels[px, py] >= threshold else 0
+
+    lines = []
+    for row in range(rows):
+        line = []
+        for col in range(cols):
+            x0, y0 = col * GLYPH_WIDTH, row * GLYPH_HEIGHT
+            tile = tuple(
+                sum(bit(x0 + i, y0 + j) << (GLYPH_WIDTH - 1 - i) for i in range(GLYPH_WIDTH))
+                for j in range(GLYPH_HEIGHT)
+            )
+            line.append(' ' if tile == _BLANK else glyph_set.add(tile))
+        lines.append(''.join(line))
+
+    return glyph_set, lines
@@ -0,0 +1,602 @@
+# -*- coding: utf-8 -*-
+
+""" Interpreter of the Videotex and Teleinfo streams.
+
+The :py:class:`Emulator` consumes the bytes sent to a Minitel, as produced by
+:py:meth:`Minitel.send` or stored in a ``.vt`` file, and maintains a model of the
+resulting screen, as a grid of cells. It can be used to check what a sequence
+displays without looking at a physical terminal, for instance in test suites or
+when analyzing captures.
+
+The stream is split in tokens by a single regular expression, the runs of plain
+characters being processed as a whole, so that megabytes of data are processed in
+a few seconds.
+
+Warning:
+    The PNG render depends on the availability of PIL.
+"""
+
+__author__ = 'Eric Pascual'
+
+import re
+
+from .constants import U_TO_VT
+
+try:
+    import PIL.Image as Image
+    import PIL.ImageDraw as ImageDraw
+    import PIL.ImageFont as ImageFont
+except ImportError:
+    Image = ImageDraw = ImageFont = None
+
+# cell attributes bits
+FG_MASK = 0x07
+BG_SHIFT = 3
+BG_MASK = 0x07 << BG_SHIFT
+BLINK = 0x40
+INVERSE = 0x80
+UNDERSCORE = 0x100
+MASKED = 0x200
+MOSAIC = 0x400
+DOUBLE_WIDTH = 0x800
+DOUBLE_HEIGHT = 0x1000
+#: the cell is covered by the right or upper part of a double size character
+COVERED = 0x2000
+
+#: the attributes set by the cursor positioning (white on black)
+DEFAULT_ATTR = 7
+
+#: the RGB values of the colors
+PALETTE = (
+    (0, 0, 0), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+    (0, 0, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255)
+)
+
+ROWS = 25
+CELL_WIDTH = 8
+CELL_HEIGHT = 10
+
+_BLANK = (u' ', DEFAULT_ATTR)
+
+# the characters of the G2 set, keyed by their code, preceded by the accent if any
+_G2 = dict((seq[1:].decode('latin-1') if isinstance(seq, bytes) else seq[1:], c) for c, seq in U_TO_VT.items())
+
+_TOKENS = re.compile(
+    u'(?P<text>[\x20-\x7f]+)'
+    u'|\x1b\\[(?P<params>[\x30-\x3f]*)(?P<final>[\x40-\x7e])'
+    u'|\x1b\x39(?P<pro1>.)|\x1b\x3a(?P<pro2>..)|\x1b\x3b(?P<pro3>...)'
+    u'|\x1b\x23[\x20\x21].'
+    u'|\x1b[\x28-\x2b]\x20?[\x40-\x7e]'
+    u'|\x1f(?P<us>..)'
+    u'|\x19(?P<g2>[\x41-\x4f].|[^\x41-\x4f])'
+    u'|\x12(?P<rep>.)'
+    u'|\x13(?P<sep>.)'
+    # sequences cut at the end of the data, completed by the next chunk
+    u'|(?P<partial>(?:\x1b(?:\\[[\x30-\x3f]*|\x39|\x3a.?|\x3b.{0,2}|\x23.?|[\x28-\x2b]\x20?)?'
+    u'|\x1f.?|\x19[\x41-\x4f]?|\x12|\x13)\\Z)'
+    u'|\x1b(?P<esc>.)'
+    u'|(?P<ctl>[\x00-\x1f])'
+    u'|(?P<other>.)',
+    re.S
+)
+
+
+def _mosaic_char(code):
+    """ Returns the Unicode sextant character matching a mosaic code.
+    """
+    bits = (code & 0x1f) | ((code & 0x40) >> 1)
+    if bits == 0:
+        return u' '
+    if bits == 0x3f:
+        return u'█'
+    if bits == 0x15:
+        return u'▌'
+    if bits == 0x2a:
+        return u'▐'
+    index = bits - 1 - (bits > 0x15) - (bits > 0x2a)
+    return (b'\\U%08x' % (0x1fb00 + index)).decode('unicode-escape')
+
+
+class Emulator(object):
+    """ A model of the Minitel screen, updated by the data sent to the terminal.
+
+    Rows are numbered as for the cursor positioning sequences : row 0 is the status
+    line, and rows 1 to 24 are the screen ones. Columns are 0 based.
+
+    Mosaic characters are stored with their code, and the :py:data:`MOSAIC` attribute.
+    """
+    def __init__(self, teleinfo=False):
+        """
+        Parameters:
+            teleinfo (bool): if True, the terminal is supposed to be in Teleinfo mode initially
+        """
+        self._pending = u''
+        self.reset(teleinfo)
+
+    def reset(self, teleinfo=False):
+        """ Resets the terminal model.
+
+        Parameters:
+            teleinfo (bool): if True, the terminal is put in Teleinfo mode
+        """
+        self.teleinfo = teleinfo
+        self.width = 80 if teleinfo else 40
+        self.rows = [[_BLANK] * self.width for _ in range(ROWS)]
+        self.x, self.y = 0, 1
+        self.roll = teleinfo
+        self.cursor_visible = False
+        self.insert_mode = False
+        self._pending = u''
+        self._saved = None
+        self._reset_attributes()
+        self._last = None
+
+    def _reset_attributes(self):
+        self.attr = DEFAULT_ATTR
+        self.size = 0
+        self.mosaic = False
+        self._pending_bg = None
+
+    # ---------------------------------------------------------------------------------
+    # public API
+    # ---------------------------------------------------------------------------------
+
+    def feed(self, data):
+        """ Processes data sent to the terminal.
+
+        Sequences split between successive calls are correctly handled.
+
+        Parameters:
+            data (bytes): the data
+        """
+        if isinstance(data, bytes):
+            data = data.decode('latin-1')
+        data = self._pending + data
+        self._pending = u''
+
+        for m in _TOKENS.finditer(data):
+            kind = m.lastgroup
+            if kind == 'text':
+                self._text(m.group(kind))
+            elif kind == 'final':
+                self._csi(m.group('params'), m.group('final'))
+            elif kind == 'ctl':
+                self._control(m.group(kind))
+            elif kind == 'esc':
+                self._escape(m.group(kind))
+            elif kind == 'us':
+                self._locate(m.group(kind))
+            elif kind == 'g2':
+                self._g2(m.group(kind))
+            elif kind == 'rep':
+                if self._last is not None:
+                    for _ in range(ord(m.group(kind)) & 0x3f):
+                        self._put(self._last)
+            elif kind == 'pro2':
+                self._pro2(m.group(kind))
+            elif kind == 'partial':
+                self._pending = m.group(kind)
+
+    def load(self, path, chunk_size=65536):
+        """ Processes the content of a file, such as a ``.vt`` capture.
+
+        Parameters:
+            path (str): the file path
+            chunk_size (int): the size of the chunks read from the file
+        """
+        with open(path, 'rb') as fp:
+            while True:
+                data = fp.read(chunk_size)
+                if not data:
+                    break
+                self.feed(data)
+
+    @property
+    def cursor(self):
+        """ The cursor position, as a (x, y) tuple.
+        """
+        return self.x, self.y
+
+    def cell(self, x, y):
+        """ Returns the content of a cell.
+
+        Parameters:
+            x (int): the column
+            y (int): the row
+
+        Returns:
+            tuple: the character and its attributes
+        """
+        return self.rows[y][x]
+
+    def line(self, y, mosaic=None):
+        """ Returns the text of a row.
+
+        Parameters:
+            y (int): the row
+            mosaic (str): the character replacing the mosaic ones (default: the matching
+                Unicode sextant)
+
+        Returns:
+            unicode: the text
+        """
+        chars = []
+        for c, attr in self.rows[y]:
+            if attr & COVERED:
+                chars.append(u' ')
+            elif attr & MOSAIC:
+                chars.append(mosaic if mosaic is not None else _mosaic_char(ord(c)))
+            else:
+                chars.append(c)
+        return u''.join(chars)
+
+    def text(self, status=False, mosaic=None):
+        """ Returns the text displayed on the screen.
+
+        Parameters:
+            status (bool): if True, the status line is included as first line
+            mosaic (str): see :py:meth:`line`
+
+        Returns:
+            unicode: the screen lines, separated by line feeds
+        """
+        return u'\n'.join(self.line(y, mosaic) for y in range(0 if status else 1, ROWS))
+
+    def render(self, scale=1):
+        """ Renders the screen as an image.
+
+        Double size characters are displayed with the normal size.
+
+        Parameters:
+            scale (int): the scaling factor of the image (default: 1)
+
+        Returns:
+            :py:class:`PIL.Image`: the image
+
+        Raises:
+            RuntimeError: if PIL is not available
+        """
+        if not Image:
+            raise RuntimeError('PIL is not available')
+
+        im = Image.new('RGB', (self.width * CELL_WIDTH, ROWS * CELL_HEIGHT))
+        draw = ImageDraw.Draw(im)
+        font = ImageFont.load_default()
+        for y, row in enumerate(self.rows):
+            for x, (c, attr) in enumerate(row):
+                fg, bg = PALETTE[attr & FG_MASK], PALETTE[(attr & BG_MASK) >> BG_SHIFT]
+                if attr & INVERSE:
+                    fg, bg = bg, fg
+                x0, y0 = x * CELL_WIDTH, y * CELL_HEIGHT
+                draw.rectangle((x0, y0, x0 + CELL_WIDTH - 1, y0 + CELL_HEIGHT - 1), fill=bg)
+                if attr & (COVERED | MASKED):
+                    continue
+                if attr & MOSAIC:
+                    code = ord(c)
+                    bits = (code & 0x1f) | ((code & 0x40) >> 1)
+                    for i in range(6):
+                        if bits & (1 << i):
+                            bx, by = x0 + (i % 2) * 4, y0 + (i // 2) * 3 + (1 if i >= 4 else 0)
+                            draw.rectangle((bx, by, bx + 3, by + (3 if i >= 4 else 2)), fill=fg)
+                elif c != u' ':
+                    draw.text((x0 + 1, y0), c, fill=fg, font=font)
+                if attr & UNDERSCORE and not attr & MOSAIC:
+                    draw.line((x0, y0 + CELL_HEIGHT - 1, x0 + CELL_WIDTH - 1, y0 + CELL_HEIGHT - 1), fill=fg)
+
+        if scale != 1:
+            im = im.resize((im.size[0] * scale, im.size[1] * scale))
+        return im
+
+    def save_png(self, path, scale=1):
+        """ Saves the render of the screen as a PNG file.
+
+        Parameters:
+            path (str): the file path
+            scale (int): the scaling factor of the image (default: 1)
+        """
+        self.render(scale).save(path, 'PNG')
+
+    # ---------------------------------------------------------------------------------
+    # cursor and screen manipulations
+    # ---------------------------------------------------------------------------------
+
+    def _blank(self):
+        return u' ', self.attr & BG_MASK | DEFAULT_ATTR
+
+    def _clear_rows(self, start, end):
+        for y in range(start, end):
+            self.rows[y] = [_BLANK] * self.width
+
+    def _scroll_up(self, top=1, count=1):
+        rows = self.rows
+        del rows[top:top + count]
+        rows[ROWS - count:ROWS - count] = [[_BLANK] * self.width for _ in range(count)]
+        del rows[ROWS:]
+
+    def _scroll_down(self, top=1, count=1):
+        rows = self.rows
+        rows[top:top] = [[_BLANK] * self.width for _ in range(count)]
+        del rows[ROWS:]
+
+    def _line_feed(self):
+        if self.y == 0:
+            # leaving the status line restores the previous position
+            if self._saved:
+                (self.x, self.y), self._saved = self._saved, None
+                self._reset_attributes()
+            return
+        if self.y < ROWS - 1:
+            self.y += 1
+        elif self.roll:
+            self._scroll_up()
+        else:
+            self.y = 1
+
+    def _move_up(self):
+        if self.y > 1:
+            self.y -= 1
+        elif self.y == 1:
+            if self.roll:
+                self._scroll_down()
+            else:
+                self.y = ROWS - 1
+
+    def _goto(self, x, y):
+        if y == 0 and self.y != 0:
+            self._saved = (self.x, self.y)
+        self.x, self.y = x, y
+
+    # ---------------------------------------------------------------------------------
+    # characters output
+    # ---------------------------------------------------------------------------------
+
+    def _put(self, c):
+        """ Displays a single character at the cursor position.
+        """
+        if self.x >= self.width:
+            if self.y == 0:
+                return
+            self.x = 0
+            self._line_feed()
+
+        attr = self.attr
+        if self.mosaic and not 0x40 <= ord(c) <= 0x5f:
+            attr |= MOSAIC
+        elif self._pending_bg is not None and c == u' ':
+            # background color is a zone attribute in text mode, validated by a delimiter
+            attr = self.attr = attr & ~BG_MASK | self._pending_bg << BG_SHIFT
+            self._pending_bg = None
+
+        row, x, y = self.rows[self.y], self.x, self.y
+        if self.insert_mode:
+            row.insert(x, (c, attr))
+            del row[self.width:]
+        else:
+            row[x] = (c, attr | self.size)
+
+        step = 1
+        if self.size & DOUBLE_WIDTH and x + 1 < self.width:
+            row[x + 1] = (u' ', attr | COVERED)
+            step = 2
+        if self.size & DOUBLE_HEIGHT and y > 1:
+            above = self.rows[y - 1]
+            above[x] = (u' ', attr | COVERED)
+            if step == 2:
+                above[x + 1] = (u' ', attr | COVERED)
+
+        self._last = c
+        self.x += step
+
+    def _text(self, text):
+        """ Displays a run of plain characters.
+        """
+        if self.teleinfo:
+            text = text.replace(u'\x7f', u'')
+            if not text:
+                return
+
+        if self.size or self.insert_mode or self.mosaic or self._pending_bg is not None or self.y == 0:
+            for c in text:
+                self._put(c)
+            return
+
+        # fast path : plain text, written by slices
+        width, cell_attr = self.width, self.attr
+        pos = 0
+        while pos < len(text):
+            if self.x >= width:
+                self.x = 0
+                self._line_feed()
+            count = min(len(text) - pos, width - self.x)
+            self.rows[self.y][self.x:self.x + count] = [(c, cell_attr) for c in text[pos:pos + count]]
+            self.x += count
+            pos += count
+        self._last = text[-1]
+
+    def _g2(self, code):
+        if self.teleinfo:
+            return
+        c = _G2.get(code) or _G2.get(code[:1]) or code[1:] or u'?'
+        self._put(c)
+
+    # ---------------------------------------------------------------------------------
+    # control sequences
+    # ---------------------------------------------------------------------------------
+
+    def _control(self, c):
+        if c == u'\x0a':
+            self._line_feed()
+        elif c == u'\x0d':
+            self.x = 0
+        elif c == u'\x08':
+            if self.x > 0:
+                self.x -= 1
+            elif self.y > 0:
+                self.x = self.width - 1
+                self._move_up()
+        elif c == u'\x09':
+            self.x += 1
+            if self.x >= self.width and self.y:
+                self.x = 0
+                self._line_feed()
+        elif c == u'\x0b':
+            self._move_up()
+        elif c == u'\x0c':
+            self._clear_rows(1, ROWS)
+            self.x, self.y = 0, 1
+            self._reset_attributes()
+        elif c == u'\x1e':
+            self.x, self.y = 0, 1
+            self._reset_attributes()
+        elif c == u'\x18':
+            row = self.rows[self.y]
+            row[self.x:] = [self._blank()] * (self.width - self.x)
+        elif c == u'\x0e':
+            if not self.teleinfo:
+                self.mosaic = True
+        elif c == u'\x0f':
+            self.mosaic = False
+        elif c == u'\x11':
+            self.cursor_visible = True
+        elif c == u'\x14':
+            self.cursor_visible = False
+
+    def _locate(self, coords):
+        if self.teleinfo:
+            return
+        r, c = ord(coords[0]), ord(coords[1])
+        if 0x30 <= r <= 0x32:
+            # decimal form : row number in 2 digits, on column 1
+            y, x = (r - 0x30) * 10 + c - 0x30, 0
+        else:
+            y, x = r - 0x40, c - 0x41
+        if 0 <= y < ROWS and 0 <= x < self.width:
+            self._goto(x, y)
+            self._reset_attributes()
+
+    def _escape(self, c):
+        if self.teleinfo:
+            return
+        code = ord(c)
+        if 0x40 <= code <= 0x47:
+            self.attr = self.attr & ~FG_MASK | code - 0x40
+        elif 0x50 <= code <= 0x57:
+            if self.mosaic:
+                self.attr = self.attr & ~BG_MASK | (code - 0x50) << BG_SHIFT
+            else:
+                self._pending_bg = code - 0x50
+        elif code == 0x48:
+            self.attr |= BLINK
+        elif code == 0x49:
+            self.attr &= ~BLINK
+        elif 0x4c <= code <= 0x4f:
+            self.size = (0, DOUBLE_HEIGHT, DOUBLE_WIDTH, DOUBLE_WIDTH | DOUBLE_HEIGHT)[code - 0x4c]
+        elif code == 0x58:
+            self.attr |= MASKED
+        elif code == 0x5f:
+            self.attr &= ~MASKED
+        elif code == 0x59:
+            self.attr &= ~UNDERSCORE
+        elif code == 0x5a:
+            self.attr |= UNDERSCORE
+        elif code == 0x5c:
+            self.attr &= ~INVERSE
+        elif code == 0x5d:
+            self.attr |= INVERSE
+
+    def _pro2(self, args):
+        if args == u'\x31\x7d' or args == u'\x32\x7d':
+            self._set_teleinfo(True)
+        elif args == u'\x32\x7e':
+            self._set_teleinfo(False)
+        elif args == u'\x69\x43':
+            self.roll = True
+        elif args == u'\x6a\x43':
+            self.roll = False
+
+    def _set_teleinfo(self, teleinfo):
+        if teleinfo != self.teleinfo:
+            self.reset(teleinfo)
+
+    def _csi(self, params, final):
+        if params == u'?' and final == u'{':
+            self._set_teleinfo(False)
+            return
+
+        args = [int(p) if p.isdigit() else 0 for p in params.split(u';')] if params else []
+        n = max(args[0], 1) if args else 1
+        width = self.width
+        rows, x, y = self.rows, self.x, self.y
+
+        if final == u'A':
+            self.y = max(1, y - n)
+        elif final == u'B':
+            self.y = min(ROWS - 1, y + n)
+        elif final == u'C':
+            self.x = min(width - 1, x + n)
+        elif final == u'D':
+            self.x = max(0, x - n)
+        elif final == u'H':
+            row = args[0] if args else 1
+            col = args[1] if len(args) > 1 else 1
+            self.x = min(max(col, 1), width) - 1
+            self.y = min(max(row, 1), ROWS - 1)
+        elif final == u'J':
+            mode = args[0] if args else 0
+            if mode == 0:
+                rows[y][x:] = [_BLANK] * (width - x)
+                self._clear_rows(y + 1, ROWS)
+            elif mode == 1:
+                self._clear_rows(1, y)
+                rows[y][:x + 1] = [_BLANK] * (x + 1)
+            elif mode == 2:
+                self._clear_rows(1, ROWS)
+        elif final == u'K':
+            mode = args[0] if args else 0
+            if mode == 0:
+                rows[y][x:] = [_BLANK] * (width - x)
+            elif mode == 1:
+                rows[y][:x + 1] = [_BLANK] * (x + 1)
+            elif mode == 2:
+                rows[y] = [_BLANK] * width
+        elif final == u'P':
+            row = rows[y]
+            del row[x:x + n]
+            row.extend([_BLANK] * (width - len(row)))
+        elif final == u'@':
+            row = rows[y]
+            row[x:x] = [_BLANK] * n
+            del row[width:]
+        elif final == u'M':
+            if y:
+                self._scroll_up(y, min(n, ROWS - y))
+        elif final == u'L':
+            if y:
+                self._scroll_down(y, min(n, ROWS - y))
+        elif final in u'hl' and args == [4]:
+            self.insert_mode = final == u'h'
+        elif final == u'm':
+            self._sgr(args or [0])
+
+    def _sgr(self, args):
+        attr = self.attr
+        for a in args:
+            if a == 0:
+                attr = DEFAULT_ATTR
+            elif a == 4:
+                attr |= UNDERSCORE
+            elif a == 5:
+                attr |= BLINK
+            elif a == 7:
+                attr |= INVERSE
+            elif a == 24:
+                attr &= ~UNDERSCORE
+            elif a == 25:
+                attr &= ~BLINK
+            elif a == 27:
+                attr &= ~INVERSE
+            elif 30 <= a <= 37:
+                attr = attr & ~FG_MASK | a - 30
+            elif 40 <= a <= 47:
+                attr = attr & ~BG_MASK | (a - 40) << BG_SHIFT
+        self.attr = attr
@@ -4,11 +4,16 @@
 """
 
 from collections import namedtuple
+import glob
 import json
+import os
+import threading
 import time
 
-from .core import Minitel
+from .core import Minitel, encode
 from .constants import *
+from .sequences import goto_sequence
+from .tracing import traced
 
 __author__ = 'Eric Pascual'
 
@@ -26,6 +31,9 @@ class Form(object):
     For convenience, the :py:meth:`dump_definition` does the reverse operation, which
     allows producing the JSON data directly from the current definition of the form.
 
+    Applications using a lot of forms should rather load them once in a :py:class:`FormRegistry`,
+    and create the instances from the prepared templates it holds.
+
     Warning:
         The class is intended to be used in Videotex mode. Maybe it works fine in
         Teleinfo mode too, but it has not been tested. By the way, to ensure all
@@ -41,13 +49,21 @@ class Form(object):
             raise ValueError('missing or invalid mt parameter')
 
         self._mt = mt
-        self._width = 80 if mt.is_w80() else 40
 
         self._prompts = []
         self._fields = {}
         self._fields_sequence = []
+        self._static_layer = None
         self._prepared = False
 
+        # what is currently displayed for each field, None if the form is not on screen
+        self._drawn = None
+        # the field being edited by input(), and the updates waiting for the input loop, keyed
+        # by field name for values and by position for prompts
+        self._editing = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
     def add_prompt(self, x, y, text):
         """ Adds a fixed text to the form, at a given position.
 
@@ -72,29 +88,51 @@ class Form(object):
         self._fields[name] = FieldDefinition(x, y, size, marker or '.')
         self._prepared = False
 
-    def _screen_pos(self, o):
-        return o.y * self._width + o.x
+    @classmethod
+    def from_template(cls, mt, template):
+        """ Creates a form from a prepared template.
 
-    def _cmp_prompt(self, a, b):
-        return cmp(self._screen_pos(a), self._screen_pos(b))
+        No processing is involved, the instance sharing the sorted prompts and fields
+        and the compiled static layer of the template.
 
-    def _cmp_field(self, a, b):
-        return cmp(self._screen_pos(self._fields[a]), self._screen_pos(self._fields[b]))
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+            template (:py:class:`FormTemplate`): the form template
+
+        Returns:
+            Form: the form instance
+        """
+        form = cls(mt)
+        form._prompts = list(template.prompts)
+        form._fields = dict(template.fields)
+        form._fields_sequence = list(template.fields_sequence)
+        form._static_layer = template.static_layer
+        form._prepared = True
+        return form
 
     def prepare(self):
         """ Prepares the form by sorting the prompts and fields according to
-         their position.
+         their position, and compiles the static layer of the form.
+
+         The static layer is the byte sequence clearing the screen and drawing the
+         prompts and the empty fields. It is computed once and cached until the
+         definition of the form is modified.
 
          Is automatically invoked by :py:meth:`render`.
         """
         if self._prepared:
             return
 
-        self._prompts.sort(self._cmp_prompt)
-        self._fields_sequence = (sorted(self._fields.keys(), cmp=self._cmp_field))
+        self._prompts.sort(key=_screen_pos)
+        self._fields_sequence = sorted(self._fields, key=lambda name: _screen_pos(self._fields[name]))
+        self._static_layer = compile_layer(
+            self._prompts,
+            (self._fields[name] for name in self._fields_sequence)
+        )
 
         self._prepared = True
 
+    @traced()
     def render(self, content=None):
         """ Renders the form on the screen.
 
@@ -107,19 +145,149 @@ class Form(object):
             content (dict): optional dictionary containing the initial field values
         """
         self._mt.set_mode(Minitel.VIDEOTEX)
+        self._mt.videotex_graphic_mode(False)
 
         content = content or {}
 
         self.prepare()
-        self._mt.clear_screen()
-        for prompt in self._prompts:
-            self._mt.display_text(prompt.text, prompt.x, prompt.y)
+        self._mt.send_raw(self._static_layer)
+        self._mt.send(''.join(
+            goto_sequence(field.x, field.y) + content[field_name]
+            for field_name, field in (
+                (name, self._fields[name]) for name in self._fields_sequence
+            )
+            if content.get(field_name)
+        ))
+        self._drawn = dict(
+            (name, content.get(name, '')) for name in self._fields_sequence
+        )
+
+    @traced()
+    def update(self, content):
+        """ Updates the displayed field values, redrawing only the characters which
+        have changed since the last time they were drawn.
+
+        The form is fully rendered if not yet displayed.
+
+        If :py:meth:`input` is running in another thread, the values are applied by its
+        loop while it waits for keys, so that the cursor stays in the edited field. The
+        value of the field being edited is applied when the user leaves it.
+
+        Parameters:
+            content (dict): the new values of the fields to be updated. Values of fields
+                not included are left unchanged.
 
+        Raises:
+            KeyError: if the content refers to an unknown field
+        """
+        unknown = set(content) - set(self._fields)
+        if unknown:
+            raise KeyError('unknown fields : %s' % ', '.join(sorted(unknown)))
+
+        if self._drawn is None:
+            self.render(content)
+            return
+
+        with self._lock:
+            if self._editing is not None:
+                self._pending.update(content)
+                return
+
+        self._patch(content)
+
+    def _patch(self, content):
+        """ Redraws the characters of the fields which have changed, and records their
+        new values.
+        """
+        patches = []
         for field_name in self._fields_sequence:
+            if field_name not in content:
+                continue
             field = self._fields[field_name]
-            value = content.get(field_name, '')
-            self._mt.display_text(value.ljust(field.size, field.marker), field.x, field.y)
+            value = content[field_name] or ''
+            patches.append(patch_sequence(
+                field.x, field.y,
+                self._drawn[field_name].ljust(field.size, field.marker),
+                value.ljust(field.size, field.marker)
+            ))
+            self._drawn[field_name] = value
 
+        self._mt.send(''.join(patches))
+
+    def _send_pending(self, pending):
+        """ Redraws the prompts and the field values updated while the form was being input.
+
+        Returns:
+            dict: the updated field values
+        """
+        values = {}
+        patches = []
+        for key, update in pending.items():
+            if isinstance(key, tuple):
+                patches.append(_prompt_patch(key[0], key[1], *update))
+            else:
+                values[key] = update
+        self._mt.send(''.join(patches))
+        self._patch(values)
+        return values
+
+    def _apply_pending(self, content, exclude=None):
+        """ Applies the updates received while the form is being input.
+
+        Parameters:
+            content (dict): the values being input, updated accordingly
+            exclude (str): the field which updates are kept pending
+
+        Returns:
+            bool: True if something has been sent
+        """
+        with self._lock:
+            pending = dict((k, v) for k, v in self._pending.items() if k != exclude)
+            for key in pending:
+                del self._pending[key]
+        if not pending:
+            return False
+        content.update(self._send_pending(pending))
+        return True
+
+    @traced()
+    def set_prompt(self, x, y, text):
+        """ Changes the text of the prompt located at a given position.
+
+        If the form is currently displayed, only the characters which have changed
+        are redrawn. If no prompt exists at this position, it is added to the form.
+
+        As for :py:meth:`update`, the prompt is redrawn by the loop of :py:meth:`input`
+        if it is running in another thread.
+
+        Parameters:
+            x (int): X coordinate of the prompt start position
+            y (int): Y coordinate of the prompt start position
+            text (str): the new prompt text (can include an attributes sequence)
+        """
+        for i, prompt in enumerate(self._prompts):
+            if (prompt.x, prompt.y) == (x, y):
+                old_text = prompt.text
+                self._prompts[i] = PromptDefinition(x, y, text)
+                self._prepared = False
+                break
+        else:
+            old_text = ''
+            self.add_prompt(x, y, text)
+
+        if self._drawn is None:
+            return
+
+        with self._lock:
+            if self._editing is not None:
+                # the prompt can be changed again before being redrawn
+                drawn_text = self._pending.get((x, y), (old_text, None))[0]
+                self._pending[(x, y)] = (drawn_text, text)
+                return
+
+        self._mt.send(_prompt_patch(x, y, old_text, text))
+
+    @traced()
     def input(self, content=None, max_wait=None):
         """ Handles user interactions and return the fields content if the form is submitted.
 
@@ -153,7 +321,12 @@ class Form(object):
         Returns:
             dict: the fields content if the form has been submitted, None otherwise.
         """
-        content = content or {}
+        content = content or dict(self._drawn or {})
+
+        def on_idle(value):
+            # keep track of the typed characters, and apply the updates of the other fields
+            self._drawn[self._editing] = value
+            return self._apply_pending(content, exclude=self._editing)
 
         field_num = 0
         field_count = len(self._fields_sequence)
@@ -164,14 +337,21 @@ class Form(object):
                 remain = limit - time.time()
                 field_name = self._fields_sequence[field_num]
                 field = self._fields[field_name]
+                with self._lock:
+                    self._editing = field_name
                 value, key = self._mt.rlinput(
                     field.size, field.marker, (field.x, field.y), content.get(field_name, ''),
-                    max_wait=remain
+                    max_wait=remain, on_idle=on_idle if self._drawn is not None else None
                 )
+                if self._drawn is not None:
+                    self._drawn[field_name] = value
+
                 if key in (None, KeyCode.CONTENT):
                     return None
 
                 content[field_name] = value
+                # an update of the field received while it was edited replaces the typed value
+                self._apply_pending(content)
                 if key == KeyCode.SEND:
                     return content
 
@@ -183,6 +363,11 @@ class Form(object):
                     self._mt.beep()
 
         finally:
+            with self._lock:
+                self._editing = None
+                pending, self._pending = self._pending, {}
+            if pending:
+                self._send_pending(pending)
             self._mt.show_cursor(False)
 
     def render_and_input(self, content=None):
@@ -211,21 +396,12 @@ class Form(object):
 
         try:
             defs = json.loads(data)
-            self._fields = {}
-            self._prompts = []
-
-            for prompt_def in defs['prompts']:
-                x, y, text = prompt_def
-                self.add_prompt(int(x), int(y), text)
-
-            for field_name, field_def in defs['fields'].iteritems():
-                x, y, size, marker = (field_def + ['.'])[:4]
-
-                self.add_field(str(field_name), int(x), int(y), int(size), str(marker))
-
         except ValueError as e:
             raise ValueError('invalid form definition data (%s)' % e)
 
+        self._prompts, self._fields = parse_definition(defs)
+        self._prepared = False
+
     def dump_definition(self):
         """ Returns the form current definition as a JSON formatted structure.
 
@@ -270,6 +446,114 @@ class Form(object):
         return json.dumps(data)
 
 
+def compile_layer(prompts, fields):
+    """ Returns the encoded sequence clearing the screen and drawing the given prompts
+    and empty fields, in the provided order.
+
+    The cursor is moved only when the item does not start where the previous one ended,
+    and no charset or size sequence is issued, since the Videotex cursor positioning
+    resets them to their default.
+
+    Parameters:
+        prompts (iterable of :py:class:`PromptDefinition`): the prompts
+        fields (iterable of :py:class:`FieldDefinition`): the fields
+
+    Returns:
+        bytes: the encoded sequence, ready to be sent with :py:meth:`Minitel.send_raw`
+    """
+    parts = [CSI + '%dJ' % Part.ALL]
+    cursor = None
+    items = [(p.x, p.y, p.text) for p in prompts]
+    items.extend((f.x, f.y, f.marker * f.size) for f in fields)
+    for x, y, text in items:
+        if not text:
+            continue
+        if (x, y) != cursor:
+            parts.append(goto_sequence(x, y))
+        parts.append(text)
+        # we can keep track of the cursor only for plain texts not wrapping to the next line
+        end_x = x + len(text)
+        cursor = (end_x, y) if end_x < 40 and all(c >= ' ' for c in text) else None
+
+    return encode(u''.join(parts))
+
+
+def patch_sequence(x, y, old, new):
+    """ Returns the sequence transforming a text displayed at a given position
+    into a new one, limited to the part which differs.
+
+    The common leading and trailing characters of both texts are not redrawn. This
+    optimization is skipped for texts containing control sequences, since the cursor
+    positioning would reset the attributes they define.
+
+    Parameters:
+        x (int): X coordinate of the text start position
+        y (int): Y coordinate of the text start position
+        old (str): the currently displayed text
+        new (str): the text to be displayed (should not be shorter than the old one if
+            the remaining part of the old one must be erased)
+
+    Returns:
+        str: the (not yet encoded) sequence, empty if both texts are the same
+    """
+    if old == new:
+        return ''
+
+    start, end = 0, len(new)
+    if all(c >= ' ' for c in old + new):
+        while start < min(len(old), end) and old[start] == new[start]:
+            start += 1
+        if len(old) == len(new):
+            while end > start and old[end - 1] == new[end - 1]:
+                end -= 1
+
+    return goto_sequence(x + start, y) + new[start:end]
+
+
+def _prompt_patch(x, y, old_text, text):
+    """ Returns the sequence replacing the text of a displayed prompt.
+    """
+    # pad with spaces to erase what remains of a longer previous text
+    return patch_sequence(x, y, old_text, text.ljust(len(old_text)))
+
+
+def parse_definition(defs):
+    """ Builds the prompts and fields definitions from the decoded JSON structure
+    of a form.
+
+    Refer to :py:meth:`Form.dump_definition` documentation for the structure
+    specifications.
+
+    Parameters:
+        defs (dict): the decoded form definition
+
+    Returns:
+        tuple: the list of :py:class:`PromptDefinition` and the dictionary of
+        :py:class:`FieldDefinition` keyed by the field names
+
+    Raises:
+        ValueError: if invalid data provided
+    """
+    try:
+        prompts = [
+            PromptDefinition(int(x), int(y), text)
+            for x, y, text in defs['prompts']
+        ]
+        fields = {}
+        for field_name, field_def in defs['fields'].items():
+            x, y, size, marker = (field_def + ['.'])[:4]
+            fields[str(field_name)] = FieldDefinition(int(x), int(y), int(size), str(marker))
+
+    except ValueError as e:
+        raise ValueError('invalid form definition data (%s)' % e)
+
+    return prompts, fields
+
+
+def _screen_pos(o):
+    return o.y, o.x
+
+
 PromptDefinition = namedtuple('PromptDefinition', 'x y text')
 
 
@@ -285,3 +569,164 @@ class FieldDefinition(namedtuple('FieldDefinition', 'x y size marker')):
             raise ValueError('invalid field size : %s' % size)
 
         return super(FieldDefinition, cls).__new__(cls, x, y, size, (marker or '.')[0])
+
+
+class FormTemplate(namedtuple('FormTemplate', 'name prompts fields fields_sequence static_layer')):
+    """ The prepared and immutable definition of a form.
+
+    Templates are built once from the form definition (see :py:meth:`Form.dump_definition`
+    for its structure). They contain the sorted prompts and fields, as well as the
+    compiled static layer, so that creating a :py:class:`Form` from them is cheap.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_definition(cls, name, defs):
+        """ Builds the template of a form from its decoded JSON definition.
+
+        Parameters:
+            name (str): the form name
+            defs (dict): the decoded form definition
+
+        Returns:
+            FormTemplate: the template
+
+        Raises:
+            ValueError: if invalid data provided
+        """
+        prompts, fields = parse_definition(defs)
+        prompts.sort(key=_screen_pos)
+        fields_sequence = sorted(fields, key=lambda n: _screen_pos(fields[n]))
+        return cls(
+            name,
+            tuple(prompts),
+            tuple((n, fields[n]) for n in fields_sequence),
+            tuple(fields_sequence),
+            compile_layer(prompts, (fields[n] for n in fields_sequence))
+        )
+
+    def create(self, mt):
+        """ Creates a form instance based on this template.
+
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+
+        Returns:
+            Form: the form instance
+        """
+        return Form.from_template(mt, self)
+
+
+class FormRegistry(object):
+    """ A collection of form templates, loaded once and shared by the application.
+
+    Forms can be loaded from a directory containing one JSON file per form, the name
+    of the form being the one of its file without extension, or from a bundle, which
+    is a JSON dictionary of form definitions keyed by the form names.
+
+    Example: ::
+
+        registry = FormRegistry()
+        registry.load_directory('/path/to/forms')
+        ...
+        form = registry.create('login', mt)
+        content = form.render_and_input()
+    """
+    def __init__(self):
+        self._templates = {}
+
+    def add(self, name, defs):
+        """ Adds a form to the registry, replacing any existing one with the same name.
+
+        Parameters:
+            name (str): the form name
+            defs (dict): the decoded form definition
+
+        Returns:
+            FormTemplate: the template of the form
+        """
+        template = FormTemplate.from_definition(name, defs)
+        self._templates[name] = template
+        return template
+
+    def load_bundle(self, data):
+        """ Loads the forms contained in a JSON bundle.
+
+        Parameters:
+            data (str): the JSON bundle, as a dictionary of form definitions keyed by their names
+
+        Raises:
+            ValueError: if no data or invalid JSON data provided
+        """
+        if not data:
+            raise ValueError('no bundle provided')
+
+        try:
+            bundle = json.loads(data)
+        except ValueError as e:
+            raise ValueError('invalid forms bundle data (%s)' % e)
+
+        for name, defs in bundle.items():
+            self.add(str(name), defs)
+
+    def load_directory(self, path, pattern='*.json'):
+        """ Loads the forms stored in the files of a directory.
+
+        Parameters:
+            path (str): the directory path
+            pattern (str): the pattern of the form files names (default: ``*.json``)
+
+        Raises:
+            ValueError: if a file contains invalid JSON data
+        """
+        for file_path in sorted(glob.glob(os.path.join(path, pattern))):
+            name = os.path.splitext(os.path.basename(file_path))[0]
+            with open(file_path, 'rt') as fp:
+                try:
+                    defs = json.load(fp)
+                except ValueError as e:
+                    raise ValueError('invalid form definition data in %s (%s)' % (file_path, e))
+            self.add(name, defs)
+
+    def get(self, name):
+        """ Returns the template of a form.
+
+        Parameters:
+            name (str): the form name
+
+        Returns:
+            FormTemplate: the template
+
+        Raises:
+            KeyError: if no form with this name is registered
+        """
+        return self._templates[name]
+
+    def create(self, name, mt):
+        """ Creates an instance of a registered form.
+
+        Parameters:
+            name (str): the form name
+            mt (:py:class:`Minitel`): the Minitel instance
+
+        Returns:
+            Form: the form instance
+
+        Raises:
+            KeyError: if no form with this name is registered
+        """
+        return self._templates[name].create(mt)
+
+    def names(self):
+        """ Returns the names of the registered forms.
+
+        Returns:
+            list of str: the sorted names
+        """
+        return sorted(self._templates)
+
+    def __contains__(self, name):
+        return name in self._templates
+
+    def __len__(self):
+        return len(self._templates)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+""" Simultaneous display on several Minitels.
+"""
+
+__author__ = 'Eric Pascual'
+
+from .core import encode
+from .compat import to_bytes
+
+
+class MinitelGroup(object):
+    """ A set of Minitels displaying the same content.
+
+    The data are encoded once, and the same buffer is queued to the background writers
+    of all the members, which write them in parallel. The writers are started by the
+    group for the members which do not have one yet. Members can run at different
+    speeds, the slower ones being reported by :py:meth:`lagging`.
+
+    Queuing never waits for a member, so that a slow or stalled one does not delay the
+    others. The data are dropped for the members which are already more than ``max_lag``
+    behind the most advanced one, as for the ones which writer has been stopped, and these
+    members are reported by :py:meth:`dropped` so that their display can be redrawn.
+
+    Since the data go through :py:meth:`Minitel.send_raw`, they are recorded and traced
+    by each member as its own output.
+
+    Warning:
+        The internal state of the members (mode, colors,...) is not updated by the data
+        sent through the group. Members are thus supposed to be in the same mode and
+        state, and should not be used directly while data sent through the group are
+        pending.
+
+    Example: ::
+
+        group = MinitelGroup([mt1, mt2, mt3])
+        group.send(mt1.goto_xy_sequence(0, 10) + 'Hello everybody')
+        group.flush()
+    """
+    def __init__(self, members=None, max_lag=5):
+        """
+        Parameters:
+            members (iterable of :py:class:`Minitel`): the initial members of the group
+            max_lag (float): the delay (in seconds) behind the most advanced member above
+                which the data sent to a member are dropped (default: 5)
+        """
+        self.max_lag = max_lag
+        # (member, True if its writer has been started by the group) pairs
+        self._members = []
+        # the count of bytes dropped for each member
+        self._dropped = {}
+        for mt in members or []:
+            self.add(mt)
+
+    def add(self, mt):
+        """ Adds a member to the group.
+
+        The background writer of the member is started if not active yet.
+
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+        """
+        if mt in self.members:
+            return
+        owned = mt.writer is None
+        if owned:
+            mt.start_writer()
+        self._members.append((mt, owned))
+
+    def _release(self, mt, owned, timeout):
+        self._dropped.pop(mt, None)
+        # the writers started by the member itself are left running
+        if owned:
+            mt.stop_writer(timeout)
+        elif mt.writer:
+            mt.writer.drain(timeout)
+
+    def _writers(self):
+        """ Returns the members which writer is active, with it.
+        """
+        return [(mt, mt.writer) for mt, _ in self._members if mt.writer]
+
+    def remove(self, mt, timeout=None):
+        """ Removes a member from the group, after the data queued for it are written.
+
+        The background writer of the member is stopped if it has been started by the group.
+
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+            timeout (float): maximum wait time in seconds for the pending data to be written
+
+        Raises:
+            ValueError: if the Minitel is not a member of the group
+        """
+        for i, (member, owned) in enumerate(self._members):
+            if member is mt:
+                del self._members[i]
+                self._release(mt, owned, timeout)
+                return
+        raise ValueError('not a member of the group')
+
+    @property
+    def members(self):
+        """ The list of the members of the group."""
+        return [mt for mt, _ in self._members]
+
+    def __len__(self):
+        return len(self._members)
+
+    def send(self, data):
+        """ Sends data to all the members of the group.
+
+        Parameters:
+            data (str): the data to be sent
+        """
+        if data:
+            self.send_raw(encode(data))
+
+    def send_raw(self, data):
+        """ Sends already encoded data to all the members of the group.
+
+        Parameters:
+            data (bytes): the bytes to be sent
+        """
+        data = to_bytes(data)
+        backlog = dict(self.backlog())
+        limit = min(backlog.values()) + self.max_lag if backlog else 0
+        for mt, _ in self._members:
+            if backlog.get(mt, limit + 1) <= limit:
+                mt.send_raw(data, block=False)
+            else:
+                self._dropped[mt] = self._dropped.get(mt, 0) + len(data)
+
+    def dropped(self):
+        """ Returns the members for which data have been dropped, because they were lagging
+        too much or their writer was stopped.
+
+        Their display is incomplete, and should be redrawn once they have caught up
+        (see :py:meth:`clear_dropped`).
+
+        Returns:
+            list of tuple: (member, count of dropped bytes) pairs
+        """
+        return [(mt, self._dropped[mt]) for mt in self.members if mt in self._dropped]
+
+    def clear_dropped(self, mt=None):
+        """ Forgets the data dropped for a member, typically once its display has been redrawn.
+
+        Parameters:
+            mt (:py:class:`Minitel`): the member (default: all of them)
+        """
+        if mt is None:
+            self._dropped.clear()
+        else:
+            self._dropped.pop(mt, None)
+
+    def backlog(self):
+        """ Returns the estimated time needed by each member for displaying what
+        has been sent so far.
+
+        Members which writer has been stopped are not included.
+
+        Returns:
+            list of tuple: (member, time in seconds) pairs
+        """
+        return [(mt, writer.backlog_time()) for mt, writer in self._writers()]
+
+    def lagging(self, max_delay=0.5):
+        """ Returns the members which are behind.
+
+        Parameters:
+            max_delay (float): the backlog time (in seconds) above which a member is considered
+                as lagging (default: 0.5)
+
+        Returns:
+            list of :py:class:`Minitel`: the lagging members
+        """
+        return [mt for mt, delay in self.backlog() if delay > max_delay]
+
+    def failed(self):
+        """ Returns the members for which a write error occurred.
+
+        Returns:
+            list of tuple: (member, exception) pairs
+        """
+        return [(mt, writer.error) for mt, writer in self._writers() if writer.error]
+
+    def flush(self, timeout=None):
+        """ Waits until the data sent so far are written to all the members, and flushes
+        their serial links. Members which writer has been stopped are ignored.
+
+        Parameters:
+            timeout (float): maximum wait time in seconds, for each member (if None, waits indefinitely)
+
+        Returns:
+            list of :py:class:`Minitel`: the members which have not completed in time
+        """
+        late = []
+        for mt, writer in self._writers():
+            if writer.drain(timeout):
+                mt.ser.flush()
+            else:
+                late.append(mt)
+        return late
+
+    def close(self, timeout=None):
+        """ Removes all the members, once their pending data are written.
+
+        The members themselves are not closed, and the background writers they had
+        before joining the group are left running.
+
+        Parameters:
+            timeout (float): maximum wait time in seconds for each member
+        """
+        for mt, owned in self._members:
+            self._release(mt, owned, timeout)
+        self._members = []
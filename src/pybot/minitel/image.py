@@ -60,8 +60,8 @@ class VideotexImage(object):
             return []
 
         # tweak w and h to proper values
-        w = ((w + 1) / 2) * 2
-        h = ((h + 2) / 3) * 3
+        w = ((w + 1) // 2) * 2
+        h = ((h + 2) // 3) * 3
 
         # convert image to gray scale and resize
         im = self._image.convert("L")
@@ -74,16 +74,16 @@ class VideotexImage(object):
         im = ImageOps.posterize(im, 3)
 
         # color hack each 6-cell
-        for i in range(w / 2):
-            for j in range(h / 3):
+        for i in range(w // 2):
+            for j in range(h // 3):
                 self._color_hack(im, i * 2, j * 3)
 
         # generate codes for videotex
         self.last_dark = self.last_light = -255
         codes = []
-        for j in range(h / 3):
+        for j in range(h // 3):
             code_line = ''
-            for i in range(w / 2):
+            for i in range(w // 2):
                 code_line += self._generate_code(im, i * 2, j * 3)
             codes.append(code_line)
         return codes
@@ -4,7 +4,15 @@
 __author__ = 'Eric Pascual'
 
 
-from forms import Form
+from collections import OrderedDict, namedtuple
+from itertools import islice
+import time
+
+from .forms import Form, FieldDefinition, PromptDefinition, compile_layer
+from .core import Minitel
+from .constants import KeyCode, CR, SEP, Y_MAX
+from .tracing import traced
+from .compat import string_types
 
 
 class Menu(object):
@@ -15,10 +23,13 @@ class Menu(object):
 
     Canceling is possible by using the SOMMAIRE (content) key, unless `cancelable`
     is set to False.
+
+    Menus with 9 options or less can use the fast selection mode, in which the option
+    is selected as soon as its digit key is hit, without having to validate with ENVOI.
     """
     def __init__(self, mt, title, choices,
                  prompt=None, line_skip=0, margin_top=0, prompt_line=None, addit=None,
-                 cancelable=True
+                 cancelable=True, fast_select=False
                  ):
         """
         Parameters:
@@ -32,6 +43,8 @@ class Menu(object):
             addit (list of tuple): additional prompts as a list of (x, y, text) tuples
             cancelable (bool): if True, the cancel key (SOMMAIRE) can be used, and `get_choice` will exit
             and return None. If False, the cancel key will be treated as an invalid choice.
+            fast_select (bool): if True and there are 9 options or less, hitting a digit key selects
+            the option immediately. Ignored for longer menus.
         """
         if not mt:
             raise ValueError('mt parameter is mandatory')
@@ -42,7 +55,7 @@ class Menu(object):
         if len(choices) < 2:
             raise ValueError('choices must contain at least 2 items')
 
-        if isinstance(title, basestring):
+        if isinstance(title, string_types):
             title = [title]
 
         if not prompt:
@@ -51,9 +64,13 @@ class Menu(object):
         addit = addit or []
 
         choice_max = len(choices)
+        fast_select = fast_select and choice_max <= 9
         prompt = "%s [1..%d] : " % (prompt, choice_max)
-        prompt_text = prompt + ('..' if choice_max > 9 else '.') + " + ENVOI"
-        x_prompt = max(0, (40 - len(prompt_text)) / 2)
+        if fast_select:
+            prompt_text = prompt
+        else:
+            prompt_text = prompt + ('..' if choice_max > 9 else '.') + " + ENVOI"
+        x_prompt = max(0, (40 - len(prompt_text)) // 2)
 
         form = Form(mt)
 
@@ -64,7 +81,7 @@ class Menu(object):
 
         choice_lines = ["%2d - %s" % (i + 1, s) for i, s in enumerate(choices)]
         max_len = max(len(s) for s in choice_lines)
-        x = max(0, (40 - max_len) / 2)
+        x = max(0, (40 - max_len) // 2)
         y += 1
         y_inc = line_skip + 1
         for line in choice_lines:
@@ -73,7 +90,8 @@ class Menu(object):
 
         y = prompt_line or y + 1
         form.add_prompt(x_prompt, y, prompt_text)
-        form.add_field('choice', x_prompt + len(prompt), y, 1 if choice_max < 10 else 2)
+        if not fast_select:
+            form.add_field('choice', x_prompt + len(prompt), y, 1 if choice_max < 10 else 2)
 
         for addit_prompt in addit:
             form.add_prompt(*addit_prompt)
@@ -82,7 +100,9 @@ class Menu(object):
         self._form = form
         self._choice_max = choice_max
         self._cancelable = cancelable
+        self._fast_select = fast_select
 
+    @traced()
     def get_choice(self, max_wait=None):
         """ Waits for the user input and returns it.
 
@@ -96,6 +116,9 @@ class Menu(object):
             the option number (starting from 1) or None if input has been canceled
         """
         self._form.render()
+        if self._fast_select:
+            return self._get_key_choice(max_wait)
+
         while True:
             content = self._form.input(max_wait=max_wait)
             if content:
@@ -113,3 +136,311 @@ class Menu(object):
                     return None
                 else:
                     self._mt.beep()
+
+    def _get_key_choice(self, max_wait):
+        """ Fast selection mode input, the option being selected by its digit key.
+        """
+        keys = [str(i + 1) for i in range(self._choice_max)]
+        if self._cancelable:
+            keys.append(SEP + KeyCode.CONTENT)
+        key = self._mt.wait_for_key(keys, max_wait=max_wait)
+        return int(key) if key and key.isdigit() else None
+
+
+_Page = namedtuple('_Page', 'labels has_prev has_next layer')
+
+
+class PagedMenu(object):
+    """ A menu displaying its choices one page at a time, for long or lazily produced
+    lists of options.
+
+    The choices can be provided as a sequence, or as any iterable, including a generator
+    fetching them from a database for instance. Only the choices of the current page are
+    read, and pages are rendered once and cached, so that moving back to an already
+    visited page is immediate.
+
+    Options are numbered from 1 on each page, so that the selection input stays short.
+    The ``SUITE`` and ``RETOUR`` keys move to the next and previous pages. As for
+    :py:class:`Menu`, pages of 9 options or less can use the fast selection mode.
+
+    Iterables are read sequentially, only the current page and the first option of the
+    next one being kept, so that the memory used does not depend on the count of options.
+    Going back to a page which is no more in the cache restarts the iteration.
+
+    Note:
+        When choices are provided by an iterator (which cannot be restarted), only the
+        previous pages still in the cache can be displayed again.
+    """
+    def __init__(self, mt, title, choices, page_size=9,
+                 prompt=None, line_skip=0, margin_top=0, addit=None,
+                 cancelable=True, cache_size=8, fast_select=False
+                 ):
+        """
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+            title (str or list of str): the menu title, displayed centered on the screen
+            choices (iterable of str): the options
+            page_size (int): the maximum number of options displayed on a page. Default: 9
+            prompt (str): the prompt displayed with the input field. Default: "Your choice"
+            line_skip (int): vertical space between options. Default (0) places options on consecutive lines
+            margin_top (int): vertical space before the menu title. Default: 0
+            addit (list of tuple): additional prompts as a list of (x, y, text) tuples
+            cancelable (bool): if True, the cancel key (SOMMAIRE) can be used, and `get_choice` will exit
+                and return None. If False, the cancel key will be treated as an invalid choice.
+            cache_size (int): the maximum number of rendered pages kept in memory. Default: 8
+            fast_select (bool): if True and the page size is 9 or less, hitting a digit key selects
+                the option immediately. Ignored for larger pages.
+
+        Raises:
+            ValueError: if a parameter is invalid, or if the pages do not fit on the screen
+        """
+        if not mt:
+            raise ValueError('mt parameter is mandatory')
+
+        if choices is None:
+            raise ValueError('choices parameter must be an iterable of option labels')
+
+        if not 1 <= page_size <= 99:
+            raise ValueError('invalid page size : %s' % page_size)
+
+        if isinstance(title, string_types):
+            title = [title]
+
+        self._mt = mt
+        self._title = title
+        self._page_size = page_size
+        self._prompt = prompt or "Your choice"
+        self._line_skip = line_skip
+        self._margin_top = margin_top
+        self._addit = addit or []
+        self._cancelable = cancelable
+        self._fast_select = fast_select and page_size <= 9
+        self._cache_size = max(1, cache_size)
+        self._cache = OrderedDict()
+
+        self._prompt_line = margin_top + len(title) + 1 + page_size * (line_skip + 1)
+        if self._prompt_line >= Y_MAX:
+            raise ValueError('pages do not fit on the screen')
+
+        if hasattr(choices, '__getitem__') and hasattr(choices, '__len__'):
+            self._sequence = choices
+            self._reader = None
+        else:
+            self._sequence = None
+            # one shot iterators cannot be restarted
+            self._restartable = iter(choices) is not choices
+            self._reader = choices if not self._restartable else iter(choices)
+        self._choices = choices
+        # the items read ahead from the iterable source, and the index of the first one
+        self._ahead = []
+        self._ahead_pos = 0
+
+        self.page = 0
+        self.selection = None
+
+        if not self._get_page(0).labels:
+            raise ValueError('choices must contain at least 1 item')
+
+    def _read(self, start, stop):
+        """ Returns the items of the iterable source in a given range, reading it from
+        its current position.
+        """
+        if start < self._ahead_pos:
+            self._reader = iter(self._choices)
+            self._ahead = []
+            self._ahead_pos = 0
+
+        skip = start - self._ahead_pos
+        if skip > len(self._ahead):
+            # consume the items of the skipped pages
+            next(islice(self._reader, skip - len(self._ahead), skip - len(self._ahead)), None)
+            self._ahead = []
+        else:
+            del self._ahead[:skip]
+        self._ahead_pos = start
+
+        missing = stop - start - len(self._ahead)
+        if missing > 0:
+            self._ahead.extend(islice(self._reader, missing))
+        return self._ahead[:stop - start]
+
+    def _fetch(self, num):
+        """ Returns the labels of a given page, and tells if a next page exists.
+        """
+        start = num * self._page_size
+        stop = start + self._page_size + 1
+
+        if self._sequence is not None:
+            items = [self._sequence[i] for i in range(start, min(stop, len(self._sequence)))]
+        else:
+            items = self._read(start, stop)
+
+        return items[:self._page_size], len(items) > self._page_size
+
+    def _available(self, num):
+        """ Tells if a page can be displayed, which is not the case for the pages of one
+        shot iterators which have been read and are no more in the cache.
+        """
+        return (
+            self._sequence is not None or self._restartable or
+            num in self._cache or num * self._page_size >= self._ahead_pos
+        )
+
+    def _get_page(self, num):
+        page = self._cache.pop(num, None)
+        if page is None:
+            labels, has_next = self._fetch(num)
+        else:
+            labels, has_next = page.labels, page.has_next
+
+        while len(self._cache) >= self._cache_size:
+            self._cache.popitem(last=False)
+
+        has_prev = num > 0 and self._available(num - 1)
+        if page is None or page.has_prev != has_prev:
+            # for one shot iterators, the previous page may have been dropped from the cache
+            # since this one was rendered
+            page = _Page(labels, has_prev, has_next, self._compile_page(num, labels, has_prev, has_next))
+
+        self._cache[num] = page
+        return page
+
+    def _choice_field(self, labels):
+        prompt = "%s [1..%d] : " % (self._prompt, len(labels))
+        x_prompt = max(0, (40 - len(prompt) - 10) // 2)
+        size = 1 if len(labels) < 10 else 2
+        return prompt, x_prompt, FieldDefinition(x_prompt + len(prompt), self._prompt_line, size)
+
+    def _compile_page(self, num, labels, has_prev, has_next):
+        prompts = []
+        y = self._margin_top
+        for line in self._title:
+            prompts.append(PromptDefinition(0, y, line.center(40)))
+            y += 1
+
+        choice_lines = ["%2d - %s" % (i + 1, s) for i, s in enumerate(labels)]
+        x = max(0, (40 - max(len(s) for s in choice_lines)) // 2)
+        y += 1
+        for line in choice_lines:
+            prompts.append(PromptDefinition(x, y, line[:40 - x]))
+            y += self._line_skip + 1
+
+        prompt, x_prompt, field = self._choice_field(labels)
+        prompts.append(PromptDefinition(x_prompt, self._prompt_line, prompt))
+        if self._fast_select:
+            fields = []
+        else:
+            prompts.append(PromptDefinition(field.x + field.size, self._prompt_line, " + ENVOI"))
+            fields = [field]
+
+        nav = []
+        if has_prev:
+            nav.append('RETOUR')
+        if has_next:
+            nav.append('SUITE')
+        if nav:
+            if self._sequence is not None:
+                page_count = (len(self._sequence) + self._page_size - 1) // self._page_size
+                page_text = 'page %d/%d' % (num + 1, page_count)
+            else:
+                page_text = 'page %d' % (num + 1)
+            prompts.append(PromptDefinition(0, self._prompt_line + 1, (
+                '%s - %s' % (page_text, ' / '.join(nav))
+            ).center(40)))
+
+        prompts.extend(PromptDefinition(*addit_prompt) for addit_prompt in self._addit)
+
+        return compile_layer(prompts, fields)
+
+    @traced()
+    def render(self):
+        """ Renders the current page.
+        """
+        self._mt.set_mode(Minitel.VIDEOTEX)
+        self._mt.videotex_graphic_mode(False)
+        self._mt.send_raw(self._get_page(self.page).layer)
+
+    @traced()
+    def get_choice(self, max_wait=None):
+        """ Waits for the user input and returns it.
+
+        The entered value is checked against the options of the current page, and rejected
+        if not valid. ``SUITE`` and ``RETOUR`` keys display the next and previous pages.
+        Input can be cancelled by using the `SOMMAIRE` key, if not disabled by `cancelable=False`
+        parameter.
+
+        The selected option itself is available in the :py:attr:`selection` attribute on return.
+
+        Parameters:
+            max_wait (int): maximum wait time in seconds for selecting an option (if None, waits indefinitely)
+        Returns:
+            the option number in the whole choices list (starting from 1) or None if input has been
+            canceled or the wait time has been reached
+        """
+        self.selection = None
+        limit = time.time() + (max_wait if max_wait else float('inf'))
+        self.render()
+        if self._fast_select:
+            return self._get_key_choice(limit)
+
+        self._mt.show_cursor()
+        try:
+            while time.time() < limit:
+                page = self._get_page(self.page)
+                _, _, field = self._choice_field(page.labels)
+                value, key = self._mt.rlinput(
+                    field.size, field.marker, (field.x, field.y), max_wait=limit - time.time()
+                )
+                if key is None:
+                    return None
+
+                if key == KeyCode.NEXT and page.has_next:
+                    self.page += 1
+                    self.render()
+                elif key == KeyCode.PREV and page.has_prev:
+                    self.page -= 1
+                    self.render()
+                elif key == KeyCode.CONTENT and self._cancelable:
+                    return None
+                elif key in (KeyCode.SEND, CR):
+                    try:
+                        choice = int(value)
+                        if not 1 <= choice <= len(page.labels):
+                            raise ValueError()
+                    except ValueError:
+                        self._mt.beep()
+                    else:
+                        self.selection = page.labels[choice - 1]
+                        return self.page * self._page_size + choice
+                else:
+                    self._mt.beep()
+
+        finally:
+            self._mt.show_cursor(False)
+
+    def _get_key_choice(self, limit):
+        """ Fast selection mode input, the option being selected by its digit key.
+        """
+        while time.time() < limit:
+            page = self._get_page(self.page)
+            keys = [str(i + 1) for i in range(len(page.labels))]
+            if page.has_next:
+                keys.append(SEP + KeyCode.NEXT)
+            if page.has_prev:
+                keys.append(SEP + KeyCode.PREV)
+            if self._cancelable:
+                keys.append(SEP + KeyCode.CONTENT)
+
+            key = self._mt.wait_for_key(keys, max_wait=limit - time.time())
+            if key == SEP + KeyCode.NEXT:
+                self.page += 1
+                self.render()
+            elif key == SEP + KeyCode.PREV:
+                self.page -= 1
+                self.render()
+            elif key and key.isdigit():
+                choice = int(key)
+                self.selection = page.labels[choice - 1]
+                return self.page * self._page_size + choice
+            else:
+                return None
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+""" Paged display of long texts.
+
+The text is read lazily from a file object or any iterable of lines, and word-wrapped
+to the screen width. Only the displayed page is kept in memory, so that documents of
+any size can be browsed with a constant footprint.
+"""
+
+__author__ = 'Eric Pascual'
+
+from collections import OrderedDict
+import re
+import textwrap
+
+from .constants import KeyCode, CSI, SEP, U_TO_VT, Y_MAX
+
+_CONTROL_CHARS = re.compile(u'[\x00-\x1f\x7f]')
+_NON_DISPLAYABLE = re.compile(u'[^\x20-\x7e]')
+
+
+def _cell(match):
+    c = match.group(0)
+    return c if c in U_TO_VT else u'?'
+
+
+def displayable(text, encoding='utf-8'):
+    """ Returns a text in which the characters which cannot be displayed by the
+    Minitel are replaced.
+
+    Control characters are replaced by spaces, and characters without Videotex
+    equivalent by a question mark.
+
+    Parameters:
+        text (str): the text, either as unicode or as encoded bytes
+        encoding (str): the encoding of the text if provided as bytes (default: utf-8)
+
+    Returns:
+        unicode: the displayable text, with one character per screen cell
+    """
+    if isinstance(text, bytes):
+        text = text.decode(encoding, 'replace')
+    return _NON_DISPLAYABLE.sub(_cell, _CONTROL_CHARS.sub(u' ', text.expandtabs()))
+
+
+class TextPager(object):
+    """ Displays a long text one screen at a time.
+
+    The ``SUITE`` and ``RETOUR`` keys move to the next and previous pages, and
+    ``SOMMAIRE`` exits.
+
+    When the source is a seekable file, the pages are located by their position in the
+    file, and the positions of the last visited pages are cached, so that going back
+    only re-reads the text from the nearest known page. Other sources (generators,
+    sockets,...) cannot be re-read : the last pages are kept instead, and going back
+    further than this history is not possible.
+
+    Characters which are not displayable by the Minitel are replaced by a question mark,
+    the ones available as special sequences (accented letters,...) counting as a single
+    character for the wrapping.
+    """
+    def __init__(self, mt, source, width=None, page_lines=Y_MAX, encoding='utf-8',
+                 cache_size=64, history_size=8):
+        """
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+            source: a file object or an iterable of lines
+            width (int): the wrapping width. Default: the current screen width
+            page_lines (int): the number of text lines per page, the next screen line being used
+                for the navigation hints. Default: :py:data:`Y_MAX`
+            encoding (str): the encoding of the source, if lines are provided as bytes. Default: utf-8
+            cache_size (int): the maximum number of page positions kept for seekable sources. Default: 64
+            history_size (int): the number of pages kept for other sources. Default: 8
+
+        Raises:
+            ValueError: if a parameter is invalid
+        """
+        if not mt:
+            raise ValueError('mt parameter is mandatory')
+
+        if source is None:
+            raise ValueError('source parameter is mandatory')
+
+        if not 1 <= page_lines <= Y_MAX:
+            raise ValueError('invalid page lines count : %s' % page_lines)
+
+        self._mt = mt
+        self._width = width or mt.get_screen_width()
+        self._page_lines = page_lines
+        self._encoding = encoding
+        self._wrapper = textwrap.TextWrapper(width=self._width)
+
+        self._file = None
+        try:
+            self._start = (source.tell(), 0)
+            self._file = source
+        except (AttributeError, IOError, OSError):
+            pass
+
+        if self._file:
+            self._positions = OrderedDict()
+            self._cache_size = max(1, cache_size)
+        else:
+            self._rows = self._wrap_all(iter(source))
+            self._lookahead = []
+            self._history = OrderedDict()
+            self._history_size = max(1, history_size)
+            self._next_num = 0
+
+        self.page = 0
+
+    def _wrap(self, line):
+        """ Returns the rows of a line of the source.
+        """
+        line = displayable(line, self._encoding).rstrip()
+        return self._wrapper.wrap(line) or [u'']
+
+    def _wrap_all(self, lines):
+        for line in lines:
+            for row in self._wrap(line):
+                yield row
+
+    def _read_file_page(self, pos):
+        """ Reads the page starting at a given position.
+
+        Positions are made of the offset of a line in the file, and of the number of its
+        rows displayed on the previous page.
+
+        Returns:
+            tuple: the rows of the page and the position of the next one (None if last page)
+        """
+        offset, skip = pos
+        f = self._file
+        f.seek(offset)
+        rows = []
+        while True:
+            line_offset = f.tell()
+            line = f.readline()
+            if not line:
+                return rows, None
+
+            wrapped = self._wrap(line)
+            room = self._page_lines - len(rows)
+            if len(wrapped) - skip > room:
+                rows.extend(wrapped[skip:skip + room])
+                return rows, (line_offset, skip + room)
+
+            rows.extend(wrapped[skip:])
+            skip = 0
+            if len(rows) == self._page_lines:
+                next_offset = f.tell()
+                return rows, (next_offset, 0) if f.readline() else None
+
+    def _file_position(self, num):
+        """ Returns the position of a page, or None if it is past the end of the text.
+        """
+        if num == 0:
+            return self._start
+
+        try:
+            pos = self._positions.pop(num)
+        except KeyError:
+            # walk from the nearest known page
+            known = [n for n in self._positions if n < num]
+            start = max(known) if known else 0
+            pos = self._positions[start] if start else self._start
+            for n in range(start, num):
+                pos = self._read_file_page(pos)[1]
+                if pos is None:
+                    return None
+                self._remember(n + 1, pos)
+            return pos
+
+        self._remember(num, pos)
+        return pos
+
+    def _remember(self, num, pos):
+        self._positions.pop(num, None)
+        self._positions[num] = pos
+        while len(self._positions) > self._cache_size:
+            self._positions.popitem(last=False)
+
+    def _has_more_rows(self):
+        if not self._lookahead:
+            try:
+                self._lookahead.append(next(self._rows))
+            except StopIteration:
+                return False
+        return True
+
+    def _read_stream_page(self, num):
+        """ Returns the rows of a page of a non seekable source, and tells if a next page exists.
+        """
+        try:
+            rows = self._history.pop(num)
+        except KeyError:
+            if num != self._next_num:
+                return None, False
+
+            rows, self._lookahead = self._lookahead, []
+            while len(rows) < self._page_lines:
+                try:
+                    rows.append(next(self._rows))
+                except StopIteration:
+                    break
+            if num and not rows:
+                return None, False
+            self._next_num += 1
+
+        self._history[num] = rows
+        while len(self._history) > self._history_size:
+            self._history.popitem(last=False)
+
+        has_next = num + 1 in self._history or (num + 1 == self._next_num and self._has_more_rows())
+        return rows, has_next
+
+    def get_page(self, num):
+        """ Returns the content of a page.
+
+        Parameters:
+            num (int): the page number (0 based)
+
+        Returns:
+            tuple: the rows of the page and a flag telling if a next page exists. Rows are None if the
+            page does not exist or is not available anymore.
+        """
+        if num < 0:
+            return None, False
+
+        if self._file:
+            pos = self._file_position(num)
+            if pos is None:
+                return None, False
+            rows, next_pos = self._read_file_page(pos)
+            if num and not rows:
+                return None, False
+            if next_pos is not None:
+                self._remember(num + 1, next_pos)
+            return rows, next_pos is not None
+
+        return self._read_stream_page(num)
+
+    def render(self):
+        """ Displays the current page.
+        """
+        self._display(*self.get_page(self.page))
+
+    def _display(self, rows, has_next):
+        """ Displays the rows of the current page, read by :py:meth:`get_page`.
+        """
+        nav = []
+        if self.page:
+            nav.append('RETOUR')
+        if has_next:
+            nav.append('SUITE')
+        hint = 'page %d' % (self.page + 1)
+        if nav:
+            hint += ' - ' + ' / '.join(nav)
+
+        mt = self._mt
+        mt.send(
+            CSI + '2J' +
+            u''.join(mt.goto_xy_sequence(0, y) + row for y, row in enumerate(rows or [])) +
+            mt.goto_xy_sequence(0, self._page_lines) + hint.rjust(self._width - 1)
+        )
+
+    def _move(self, num):
+        rows, has_next = self.get_page(num)
+        if rows is None:
+            return False
+        self.page = num
+        self._display(rows, has_next)
+        return True
+
+    def next_page(self):
+        """ Displays the next page.
+
+        Returns:
+            bool: False if already on the last page
+        """
+        return self._move(self.page + 1)
+
+    def prev_page(self):
+        """ Displays the previous page.
+
+        Returns:
+            bool: False if already on the first page, or if it is not available anymore
+        """
+        return self._move(self.page - 1)
+
+    def show(self, max_wait=None):
+        """ Displays the text, and handles the navigation until the user exits.
+
+        Parameters:
+            max_wait (int): maximum wait time for a key, in seconds (if None, waits indefinitely)
+
+        Returns:
+            str: the exit key (``SOMMAIRE``), or None if the wait timed out
+        """
+        self.render()
+        while True:
+            key = self._mt.wait_for_key(
+                key_set=(SEP + KeyCode.NEXT, SEP + KeyCode.PREV, SEP + KeyCode.CONTENT),
+                max_wait=max_wait
+            )
+            if key == SEP + KeyCode.NEXT:
+                if not self.next_page():
+                    self._mt.beep()
+            elif key == SEP + KeyCode.PREV:
+                if not self.prev_page():
+                    self._mt.beep()
+            else:
+                return key
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+""" Playback of Videotex files.
+
+Files such as the ``.vt`` ones saved by the demos or the ``.vdt`` pages of historical
+services contain the raw bytes to be sent to the terminal. They are played as is,
+without going through the text encoding of :py:meth:`Minitel.send`.
+
+The file is memory-mapped and sent in chunks sized to what the link transmits in a
+short delay, so that the memory footprint does not depend on the file size, and the
+playback can be interrupted between chunks. When the system provides it, ``sendfile``
+is used to copy the data to the serial port without going through user space.
+"""
+
+__author__ = 'Eric Pascual'
+
+import errno
+import logging
+import mmap
+import os
+import select
+import threading
+
+from .writer import Priority, BITS_PER_BYTE
+
+log = logging.getLogger('minitel').getChild('player')
+
+# the bytes starting a multi-bytes sequence (ESC, US, SS2, REP, SEP)
+_INTRODUCERS = (b'\x1b', b'\x1f', b'\x19', b'\x12', b'\x13')
+# the longest sequence which must not be split between chunks
+_MAX_SEQUENCE = 8
+# the maximum wait time for room in the output buffer of the port, between termination checks
+_WRITE_WAIT = 0.1
+
+
+class FilePlayer(object):
+    """ Plays a Videotex file on a Minitel.
+
+    The player can be used as a context manager, the file being released on exit.
+
+    Note:
+        The played data are not interpreted, and can change the terminal settings (mode,
+        attributes,...) without the :py:class:`Minitel` instance being aware of it.
+    """
+    def __init__(self, mt, path, chunk_size=None):
+        """
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+            path (str): the path of the file to be played
+            chunk_size (int): the chunk size (default: what the link transmits in 0.1s)
+
+        Raises:
+            IOError: if the file cannot be opened
+        """
+        self._mt = mt
+        self._chunk_size = chunk_size or max(16, mt.ser.baudrate // (BITS_PER_BYTE * 10))
+        self._cancelled = threading.Event()
+
+        self._fp = open(path, 'rb')
+        self.size = os.fstat(self._fp.fileno()).st_size
+        self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def close(self):
+        """ Releases the file.
+        """
+        if self._map:
+            self._map.close()
+            self._map = None
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def cancel(self):
+        """ Stops the playback at the end of the current chunk.
+
+        Can be called from another thread.
+        """
+        self._cancelled.set()
+
+    def _chunk_end(self, start):
+        """ Returns the end of the chunk starting at a given offset, moved back so that
+        the last sequence is not split.
+        """
+        end = min(start + self._chunk_size, self.size)
+        if end == self.size:
+            return end
+        lower = max(start + 1, end - _MAX_SEQUENCE)
+        cut = max(self._map.rfind(c, lower, end) for c in _INTRODUCERS)
+        return cut if cut > start else end
+
+    def _interrupted(self):
+        mt = self._mt
+        return self._cancelled.is_set() or mt.terminating or (mt.cancel_on_key and mt.ser.inWaiting())
+
+    def _sendfile(self, out_fd, offset, end):
+        """ Copies a part of the file to the port.
+
+        Returns:
+            tuple: the offset reached, which is short of the end if the Minitel is terminating
+                or if sendfile is not supported, and False in the latter case
+        """
+        mt = self._mt
+        while offset < end:
+            try:
+                sent = os.sendfile(out_fd, self._fp.fileno(), offset, end - offset)
+            except OSError as e:
+                if e.errno in (errno.EINVAL, errno.ENOSYS):
+                    log.debug('sendfile not supported by the port, using regular writes')
+                    return offset, False
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                # the output buffer of the port is full
+                if mt.terminating:
+                    break
+                select.select([], [out_fd], [], _WRITE_WAIT)
+                continue
+            mt.record_output(self._map[offset:offset + sent])
+            offset += sent
+        return offset, True
+
+    def play(self):
+        """ Plays the file.
+
+        The playback stops if :py:meth:`cancel` is called, or if a key is hit while
+        :py:attr:`Minitel.cancel_on_key` is set. The display settings are then reset,
+        as done when cancelling bulk output.
+
+        Returns:
+            bool: False if the playback has been interrupted, True otherwise
+        """
+        self._cancelled.clear()
+        mt = self._mt
+        use_writer = mt.writer is not None
+        out_fd = None
+        if not use_writer and hasattr(os, 'sendfile'):
+            try:
+                out_fd = mt.ser.fileno()
+            except (AttributeError, NotImplementedError):
+                pass
+
+        offset = 0
+        while offset < self.size:
+            if self._interrupted():
+                log.debug('playback interrupted at %d/%d', offset, self.size)
+                mt.cancel_output(reset=True)
+                return False
+
+            end = self._chunk_end(offset)
+            if out_fd is not None:
+                offset, supported = self._sendfile(out_fd, offset, end)
+                if not supported:
+                    out_fd = None
+                    continue
+            else:
+                mt.send_raw(self._map[offset:end], Priority.BULK)
+                offset = end
+
+            if not use_writer:
+                # wait for the chunk to be transmitted, so that the playback can be stopped timely
+                mt.ser.flush()
+
+        return True
+
+
+def play_file(mt, path, chunk_size=None):
+    """ Convenience function playing a file.
+
+    Parameters:
+        mt (:py:class:`Minitel`): the Minitel instance
+        path (str): the path of the file to be played
+        chunk_size (int): the chunk size (default: what the link transmits in 0.1s)
+
+    Returns:
+        bool: False if the playback has been interrupted, True otherwise
+    """
+    with FilePlayer(mt, path, chunk_size) as player:
+        return player.play()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+""" Recording of the last exchanges with the Minitel.
+
+The :py:class:`TrafficRecorder` keeps the most recent data sent and received on the
+link, up to a given amount. It is cheap enough to be always active, and its content
+can be written to a file when something goes wrong, which allows diagnosing failures
+occurring in the field without having to run with the debug traces enabled.
+"""
+
+__author__ = 'Eric Pascual'
+
+from collections import deque
+import binascii
+import threading
+import time
+
+#: direction of the data sent to the Minitel
+TX = 'TX'
+#: direction of the data received from the Minitel
+RX = 'RX'
+
+
+class TrafficRecorder(object):
+    """ A bounded record of the link traffic.
+
+    The oldest records are discarded when the total size of the recorded data exceeds
+    the capacity, or when the count of records reaches its maximum. Data larger than
+    the capacity are truncated to their last bytes, so that the last record is always
+    kept.
+    """
+    def __init__(self, capacity=16384, max_records=4096):
+        """
+        Parameters:
+            capacity (int): the maximum count of recorded bytes (default: 16 KiB)
+            max_records (int): the maximum count of records (default: 4096)
+        """
+        self.capacity = capacity
+        self.max_records = max_records
+        self._records = deque()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def record(self, direction, data):
+        """ Records data exchanged on the link.
+
+        Parameters:
+            direction (str): :py:data:`TX` or :py:data:`RX`
+            data (str): the data
+        """
+        if len(data) > self.capacity:
+            data = data[len(data) - self.capacity:]
+        with self._lock:
+            self._records.append((time.time(), direction, data))
+            self._size += len(data)
+            while len(self._records) > 1 and (self._size > self.capacity or len(self._records) > self.max_records):
+                self._size -= len(self._records.popleft()[2])
+
+    def records(self):
+        """ Returns the recorded data.
+
+        Returns:
+            list of tuple: the records, as (timestamp, direction, data) tuples, oldest first
+        """
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        """ Discards the recorded data.
+        """
+        with self._lock:
+            self._records.clear()
+            self._size = 0
+
+    def dump(self, path, reason=None):
+        """ Writes the recorded data to a file, in a readable form.
+
+        Each record is written on a line, with its time, its direction and its bytes
+        in hexadecimal.
+
+        Parameters:
+            path (str): the file path
+            reason (str): an optional explanation, written at the top of the file
+        """
+        records = self.records()
+        with open(path, 'w') as fp:
+            if reason:
+                fp.write('# %s\n' % reason)
+            for timestamp, direction, data in records:
+                fp.write('%s.%03d %s %s\n' % (
+                    time.strftime('%H:%M:%S', time.localtime(timestamp)), int(timestamp * 1000) % 1000,
+                    direction, binascii.hexlify(data).decode('ascii')
+                ))
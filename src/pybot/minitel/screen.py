@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+""" Incremental rendering of Teleinfo screens.
+
+The renderer keeps a copy of the displayed screen, and updates it with the shortest
+sequences it can find : lines which moved up or down are shifted with the line
+insertion and deletion commands instead of being rewritten, and characters inserted
+or deleted in a line are handled the same way. Scrolling tables and lists are thus
+updated with a few bytes, instead of a full repaint.
+
+Lines are matched between the displayed screen and the new one by a longest common
+subsequence search, as done by curses.
+"""
+
+__author__ = 'Eric Pascual'
+
+import re
+
+from .core import Minitel
+from .constants import Y_MAX
+from .pager import displayable
+from .sequences import TeleinfoCommand, goto_sequence
+
+#: the maximum count of characters considered for insertions and deletions inside a line
+MAX_CHAR_SHIFT = 16
+
+_NON_ASCII = re.compile(u'[^\x20-\x7e]')
+
+
+def _goto(x, y):
+    return goto_sequence(x, y, teleinfo=True)
+
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _common_suffix(a, b, limit):
+    i = 0
+    while i < limit and a[-1 - i] == b[-1 - i]:
+        i += 1
+    return i
+
+
+def _rewrite_sequence(y, old, new):
+    """ Returns the sequence rewriting the part of a line which differs.
+    """
+    p = _common_prefix(old, new)
+    if p == len(new):
+        return ''
+    s = _common_suffix(old, new, len(new) - p)
+    best = _goto(p, y) + new[p:len(new) - s]
+
+    # clearing the end of the line is cheaper than writing spaces
+    q = max(p, len(new.rstrip()))
+    if q < len(new) - s:
+        seq = _goto(p, y) + new[p:q] + TeleinfoCommand.EL % 0
+        if len(seq) < len(best):
+            best = seq
+    return best
+
+
+def line_sequence(y, old, new):
+    """ Returns the shortest sequence found for changing a displayed line into a new one.
+
+    Besides rewriting the part which differs, insertions and deletions of characters
+    are tried, so that a text shifted right or left is not written again.
+
+    Parameters:
+        y (int): the line number
+        old (str): the displayed line
+        new (str): the new line, with the same length
+
+    Returns:
+        str: the sequence
+    """
+    best = _rewrite_sequence(y, old, new)
+    if not best:
+        return best
+
+    width = len(new)
+    p = _common_prefix(old, new)
+    for k in range(1, min(MAX_CHAR_SHIFT, width - p - 1) + 1):
+        # k characters inserted at p
+        shifted = old[:p] + ' ' * k + old[p:width - k]
+        seq = _goto(p, y) + TeleinfoCommand.ICH % k + _rewrite_sequence(y, shifted, new)
+        if len(seq) < len(best):
+            best = seq
+
+        # k characters deleted at p
+        shifted = old[:p] + old[p + k:] + ' ' * k
+        seq = _goto(p, y) + TeleinfoCommand.DCH % k + _rewrite_sequence(y, shifted, new)
+        if len(seq) < len(best):
+            best = seq
+
+    return best
+
+
+def match_lines(old, new, blanks=False):
+    """ Matches the lines of two screens.
+
+    Parameters:
+        old (list of str): the displayed lines
+        new (list of str): the new lines
+        blanks (bool): if False (default), blank lines are not matched, since they are
+            produced for free by the line insertions and deletions
+
+    Returns:
+        list of tuple: the (old index, new index) pairs of the matched lines, in increasing order
+    """
+    old_keys = [hash(l) if blanks or l.strip() else None for l in old]
+    new_keys = [hash(l) if blanks or l.strip() else None for l in new]
+
+    n, m = len(old), len(new)
+    lengths = [[0] * (m + 1) for _ in range(n + 1)]
+    for i in range(n - 1, -1, -1):
+        row, below = lengths[i], lengths[i + 1]
+        for j in range(m - 1, -1, -1):
+            if old_keys[i] is not None and old_keys[i] == new_keys[j] and old[i] == new[j]:
+                row[j] = below[j + 1] + 1
+            else:
+                row[j] = max(below[j], row[j + 1])
+
+    pairs = []
+    i = j = 0
+    while i < n and j < m:
+        if old_keys[i] is not None and old_keys[i] == new_keys[j] and old[i] == new[j]:
+            pairs.append((i, j))
+            i += 1
+            j += 1
+        elif lengths[i + 1][j] >= lengths[i][j + 1]:
+            i += 1
+        else:
+            j += 1
+    return pairs
+
+
+def _runs(indexes):
+    """ Groups sorted indexes in (start, count) runs.
+    """
+    runs = []
+    for i in indexes:
+        if runs and runs[-1][0] + runs[-1][1] == i:
+            runs[-1][1] += 1
+        else:
+            runs.append([i, 1])
+    return runs
+
+
+def scroll_sequence(old, new, blanks=False):
+    """ Returns the line insertions and deletions moving the matched lines of the
+    displayed screen to their new position.
+
+    Deletions are applied first, from the bottom up so that the positions of the
+    remaining ones are not affected, then insertions from the top down.
+
+    Parameters:
+        old (list of str): the displayed lines
+        new (list of str): the new lines
+        blanks (bool): see :py:func:`match_lines`
+
+    Returns:
+        tuple: the sequence, and the lines displayed once it is applied
+    """
+    pairs = match_lines(old, new, blanks)
+    if not pairs or all(i == j for i, j in pairs):
+        return '', list(old)
+
+    height = len(old)
+    blank = ' ' * len(new[0])
+    screen = list(old)
+    parts = []
+
+    # lines below the last matched one are rewritten anyway
+    matched_old = set(i for i, _ in pairs)
+    for start, count in reversed(_runs(i for i in range(pairs[-1][0]) if i not in matched_old)):
+        parts.append(_goto(0, start) + TeleinfoCommand.DL % count)
+        del screen[start:start + count]
+        screen.extend([blank] * count)
+
+    matched_new = set(j for _, j in pairs)
+    for start, count in _runs(j for j in range(pairs[-1][1]) if j not in matched_new):
+        parts.append(_goto(0, start) + TeleinfoCommand.IL % count)
+        screen[start:start] = [blank] * count
+        del screen[height:]
+
+    return ''.join(parts), screen
+
+
+def update_sequence(old, new):
+    """ Returns the sequence changing a displayed screen into a new one.
+
+    The updates using line insertions and deletions, with and without matching the
+    blank lines, are compared to the in-place one, and the shortest is returned.
+
+    Parameters:
+        old (list of str): the displayed lines
+        new (list of str): the new lines, with the same count and lengths
+
+    Returns:
+        str: the sequence
+    """
+    best = ''.join(line_sequence(y, o, n) for y, (o, n) in enumerate(zip(old, new)))
+
+    for blanks in (False, True):
+        scroll, screen = scroll_sequence(old, new, blanks)
+        if scroll:
+            seq = scroll + ''.join(line_sequence(y, o, n) for y, (o, n) in enumerate(zip(screen, new)))
+            if len(seq) < len(best):
+                best = seq
+
+    return best
+
+
+class TeleinfoScreen(object):
+    """ An 80 columns Teleinfo screen, updated incrementally.
+
+    The content is provided as a whole with :py:meth:`update`, which sends only what
+    differs from the displayed one.
+
+    Note:
+        The renderer handles plain text only. Characters outside of the ASCII printable
+        range are replaced by a question mark.
+    """
+    def __init__(self, mt, width=80, height=Y_MAX + 1):
+        """
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+            width (int): the screen width. Default: 80
+            height (int): the screen height. Default: 24
+
+        Raises:
+            ValueError: if mt is not provided
+        """
+        if not mt:
+            raise ValueError('mt parameter is mandatory')
+
+        self._mt = mt
+        self._width = width
+        self._height = height
+        self._lines = None
+
+    @property
+    def lines(self):
+        """ The lines currently displayed, or None if the screen has not been drawn yet.
+        """
+        return list(self._lines) if self._lines else None
+
+    def _normalize(self, lines):
+        lines = [_NON_ASCII.sub(u'?', displayable(l))[:self._width].ljust(self._width) for l in lines]
+        lines = lines[:self._height]
+        lines.extend([u' ' * self._width] * (self._height - len(lines)))
+        return lines
+
+    def clear(self):
+        """ Switches the terminal to Teleinfo mode and clears the screen.
+        """
+        self._mt.set_mode(Minitel.TELEINFO)
+        self._mt.send(TeleinfoCommand.ED % 2)
+        self._lines = [u' ' * self._width] * self._height
+
+    def invalidate(self):
+        """ Forgets the displayed content, forcing a full redraw on next update.
+        """
+        self._lines = None
+
+    def update(self, lines):
+        """ Displays new content.
+
+        Parameters:
+            lines (list of str): the lines of the screen. Missing lines are cleared,
+                and lines are padded or truncated to the screen width.
+
+        Returns:
+            int: the size of the sent sequence
+        """
+        if self._lines is None:
+            self.clear()
+
+        lines = self._normalize(lines)
+        seq = update_sequence(self._lines, lines)
+        if seq:
+            self._mt.send(seq)
+        self._lines = lines
+        return len(seq)
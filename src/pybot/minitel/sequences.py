@@ -5,7 +5,7 @@
 
 __author__ = 'Eric Pascual'
 
-from .constants import ESC, CSI
+from .constants import ESC, CSI, US, Y_MAX
 
 
 class Protocol(object):
@@ -41,6 +41,9 @@ class Protocol(object):
     START_STOP_ERROR_CORRECTION = '\x44'
     START_STOP_CAPS_LOCK = '\x45'
 
+    ROLL_ON = PRO2 + '\x69' + START_STOP_ROLL
+    ROLL_OFF = PRO2 + '\x6a' + START_STOP_ROLL
+
     START_STOP_KEYB_EXT = '\x41'
     START_STOP_KEYB_CURS_CODES = '\x43'
 
@@ -114,8 +117,83 @@ class TextAttribute(object):
 GET_POS = ESC + '\x61'
 
 
+def goto_sequence(x, y, teleinfo=False):
+    """ Returns the sequence moving the cursor to the given 0 based coordinates.
+
+    No range checking is done here, see :py:meth:`pybot.minitel.core.Minitel.goto_xy`
+    for the checked version.
+
+    Parameters:
+        x (int): X (col) position
+        y (int): Y (line) position
+        teleinfo (bool): True for the Teleinfo variant of the sequence, False for the Videotex one
+
+    Returns:
+        str: the sequence
+    """
+    if teleinfo:
+        # the CUP parameters are 1 based
+        return TeleinfoCommand.CUP % (y + 1, x + 1)
+    return US + chr(0x41 + y) + chr(0x41 + x)
+
+
+class Drcs(object):
+    """ Sequences for the dynamically redefinable character sets (DRCS) of the
+    Minitel 2 and later models.
+    """
+    #: starts the loading of the redefined G0 set
+    LOAD_G0 = US + '\x23\x20\x20\x20\x42\x49'
+    #: starts the loading of the redefined G1 set
+    LOAD_G1 = US + '\x23\x20\x20\x20\x43\x49'
+    #: starts the loading of the characters from a given code (to be formatted with the char)
+    LOAD_FROM = US + '\x23%s\x30'
+    #: terminates a character pattern
+    END_CHAR = '\x30'
+
+    #: uses the redefined set as G0
+    USE_G0 = ESC + '\x28\x20\x42'
+    #: uses the redefined set as G1
+    USE_G1 = ESC + '\x29\x20\x43'
+    #: goes back to the standard G0 set
+    STD_G0 = ESC + '\x28\x40'
+    #: goes back to the standard G1 set
+    STD_G1 = ESC + '\x29\x63'
+
+
 class VideotexMode(object):
     """ Rendering modes for Videotex
     """
     GRAPHICS = '\x0e'
     TEXT = '\x0f'
+
+
+def _encoded(sequence):
+    return sequence if isinstance(sequence, bytes) else sequence.encode('latin-1')
+
+
+class Encoded(object):
+    """ Pre-encoded Videotex sequences, for assembling the output directly as bytes
+    in the drawing loops, without building and encoding texts on each call.
+    """
+    #: cursor positioning, indexed by line then column
+    GOTO = tuple(
+        tuple(_encoded(goto_sequence(x, y)) for x in range(40))
+        for y in range(Y_MAX + 1)
+    )
+    #: foreground colors, indexed by color
+    FG = tuple(_encoded(ESC + chr(0x40 + c)) for c in range(8))
+    #: background colors, indexed by color
+    BG = tuple(_encoded(ESC + chr(0x50 + c)) for c in range(8))
+    #: character sizes, indexed by width then height (minus 1)
+    CHAR_SIZE = tuple(
+        tuple(_encoded(ESC + chr(0x4c + (h - 1) + (w - 1) * 2)) for h in (1, 2))
+        for w in (1, 2)
+    )
+    #: text attributes, keyed as :py:attr:`TextAttribute.VIDEOTEX`
+    TEXT_ATTRIBUTE = dict(
+        (attr, tuple(_encoded(seq) for seq in seqs))
+        for attr, seqs in TextAttribute.VIDEOTEX.items()
+    )
+    TEXT = _encoded(VideotexMode.TEXT)
+    GRAPHICS = _encoded(VideotexMode.GRAPHICS)
+    CLEAR_SCREEN = _encoded(CSI + '2J')
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+""" Scrolling display of text streams, such as logs.
+
+The viewer uses the roll mode of the Minitel : lines are appended at the bottom of
+the screen and the terminal scrolls the previous ones by itself, so that each new
+line costs only its own bytes, instead of a repaint of the whole screen.
+"""
+
+__author__ = 'Eric Pascual'
+
+import logging
+import threading
+
+from .core import Minitel
+from .constants import CR, LF, Y_MAX
+from .pager import displayable
+
+
+class TailViewer(object):
+    """ Displays lines at the bottom of the screen, scrolling the previous ones up.
+
+    The header is displayed in the status line, which is not affected by the scrolling.
+    Lines longer than the screen width are split over several lines.
+
+    The viewer can be used as a context manager, the roll mode being active inside
+    the managed block.
+    """
+    def __init__(self, mt, header=None, encoding='utf-8'):
+        """
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+            header (str): the text displayed in the status line
+            encoding (str): the encoding of the lines provided as bytes. Default: utf-8
+
+        Raises:
+            ValueError: if mt is not provided
+        """
+        if not mt:
+            raise ValueError('mt parameter is mandatory')
+
+        self._mt = mt
+        self._header = header
+        self._encoding = encoding
+        self._width = 40
+        self._line_open = False
+        self._lock = threading.Lock()
+        self.active = False
+
+    def start(self):
+        """ Clears the screen and activates the roll mode.
+        """
+        mt = self._mt
+        mt.set_mode(Minitel.VIDEOTEX)
+        mt.videotex_graphic_mode(False)
+        mt.show_cursor(False)
+        mt.clear_all()
+        mt.set_roll_mode(True)
+        if self._header:
+            mt.display_status(self._header)
+        mt.send(mt.goto_xy_sequence(0, Y_MAX))
+        self._line_open = False
+        self.active = True
+
+    def stop(self, clear=True):
+        """ Deactivates the roll mode.
+
+        Parameters:
+            clear (bool): if True (default), the screen and the status line are cleared
+        """
+        mt = self._mt
+        mt.set_roll_mode(False)
+        if clear:
+            mt.clear_all()
+        self.active = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def set_header(self, header):
+        """ Changes the text displayed in the status line.
+
+        Parameters:
+            header (str): the new header
+        """
+        self._header = header
+        self._mt.clear_status()
+        if header:
+            self._mt.display_status(header)
+
+    def lines_sequence(self, lines):
+        """ Returns the sequence appending lines at the bottom of the screen.
+
+        The cursor is left at the end of the last line, so that the line feed is
+        sent with the next line only. A line filling the whole width has already moved
+        the cursor to a new line, and is not followed by a line feed.
+
+        Parameters:
+            lines (iterable of str): the lines
+
+        Returns:
+            str: the sequence
+        """
+        width = self._width
+        parts = []
+        for line in lines:
+            line = displayable(line, self._encoding).rstrip()
+            for start in range(0, max(len(line), 1), width):
+                row = line[start:start + width]
+                if self._line_open:
+                    parts.append(CR + LF)
+                parts.append(row)
+                self._line_open = len(row) < width
+        return u''.join(parts)
+
+    def write(self, *lines):
+        """ Appends lines at the bottom of the screen.
+
+        Lines can also be provided as a single string containing line feeds.
+
+        Parameters:
+            lines (str): the lines
+        """
+        with self._lock:
+            self._mt.send(self.lines_sequence(
+                l for line in lines for l in line.splitlines() or ['']
+            ))
+
+
+class TailHandler(logging.Handler):
+    """ A logging handler displaying records in a :py:class:`TailViewer`.
+    """
+    def __init__(self, viewer, level=logging.NOTSET):
+        """
+        Parameters:
+            viewer (:py:class:`TailViewer`): the viewer, started by the caller
+            level (int): the handler level
+        """
+        logging.Handler.__init__(self, level)
+        self.viewer = viewer
+
+    def emit(self, record):
+        try:
+            self.viewer.write(self.format(record))
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+""" Tracing of the Minitel operations.
+
+When a :py:class:`Tracer` is attached to a :py:class:`Minitel` instance (with its
+``tracer`` attribute), the public operations of the Minitel, of the forms and of the
+menus record spans, telling how long they took, how many bytes they sent and how
+many request/reply round trips they did.
+
+The interaction latency is measured too : it is the time elapsed between the arrival
+of a key and the next output, which is either its echo or the update of the screen
+it triggered. Keys echoed by the terminal itself are not measured.
+
+Durations are aggregated in histograms, from which percentiles can be queried at
+any time. Tracing has no cost when no tracer is attached.
+"""
+
+__author__ = 'Eric Pascual'
+
+from collections import deque, namedtuple
+import functools
+import math
+import threading
+import time
+
+#: the name of the histogram of the interaction latencies
+KEY_TO_OUTPUT = 'key-to-output'
+
+
+class Histogram(object):
+    """ A histogram with logarithmic buckets.
+
+    The buckets bounds grow geometrically, so that the relative precision of the
+    percentiles is the same whatever is the value, and the memory used does not
+    depend on the count of recorded values.
+    """
+    def __init__(self, resolution=1e-4, buckets_per_octave=8):
+        """
+        Parameters:
+            resolution (float): the upper bound of the first bucket (default: 0.1 ms)
+            buckets_per_octave (int): the count of buckets for values doubling (default: 8)
+        """
+        self._resolution = resolution
+        self._factor = buckets_per_octave / math.log(2)
+        self._growth = 2 ** (1. / buckets_per_octave)
+        self._buckets = {}
+        self.count = 0
+        self.total = 0.
+        self.min = self.max = None
+
+    def _index(self, value):
+        if value <= self._resolution:
+            return 0
+        return int(math.ceil(math.log(value / self._resolution) * self._factor))
+
+    def _upper_bound(self, index):
+        return self._resolution * self._growth ** index
+
+    def record(self, value):
+        """ Records a value.
+
+        Parameters:
+            value (float): the value
+        """
+        index = self._index(value)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p):
+        """ Returns the value below which a given percentage of the recorded ones are.
+
+        The returned value is the upper bound of the bucket containing the percentile,
+        limited to the observed maximum.
+
+        Parameters:
+            p (float): the percentage, in [0, 100]
+
+        Returns:
+            float: the percentile, or None if nothing has been recorded
+        """
+        if not self.count:
+            return None
+
+        rank = max(1, int(math.ceil(self.count * p / 100.)))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """ Returns the statistics of the recorded values.
+
+        Parameters:
+            percentiles (iterable of float): the percentiles to be included
+
+        Returns:
+            dict: the count, min, max, mean and the percentiles (keyed as ``p50``,...)
+        """
+        result = {'count': self.count, 'min': self.min, 'max': self.max, 'mean': self.mean}
+        for p in percentiles:
+            result['p%g' % p] = self.percentile(p)
+        return result
+
+
+class Span(namedtuple('Span', 'name start end bytes_sent round_trips')):
+    """ A traced operation.
+
+    Attributes:
+        name (str): the operation name
+        start (float): the start time
+        end (float): the end time
+        bytes_sent (int): the count of bytes sent during the operation
+        round_trips (int): the count of requests waiting for a reply from the terminal
+    """
+    __slots__ = ()
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class _OpenSpan(object):
+    __slots__ = ('name', 'start', 'bytes_sent', 'round_trips')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.bytes_sent = self.round_trips = 0
+
+
+class Tracer(object):
+    """ Records the spans of the traced operations, and the interaction latencies.
+
+    Spans can be nested, the bytes and round trips being counted in all the enclosing
+    spans. Each thread has its own stack of spans.
+    """
+    def __init__(self, history_size=256):
+        """
+        Parameters:
+            history_size (int): the count of the last finished spans kept (default: 256)
+        """
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._key_time = None
+        self.histograms = {}
+        self.recent = deque(maxlen=history_size)
+        self.bytes_sent = 0
+        self.round_trips = 0
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = stack = []
+            return stack
+
+    def _record(self, name, value):
+        with self._lock:
+            try:
+                histogram = self.histograms[name]
+            except KeyError:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(value)
+
+    def begin(self, name):
+        """ Opens a span.
+
+        Parameters:
+            name (str): the operation name
+        """
+        self._stack().append(_OpenSpan(name))
+
+    def end(self):
+        """ Closes the innermost open span.
+
+        Returns:
+            :py:class:`Span`: the finished span
+        """
+        current = self._stack().pop()
+        span = Span(current.name, current.start, time.time(), current.bytes_sent, current.round_trips)
+        self._record(span.name, span.duration)
+        self.recent.append(span)
+        return span
+
+    def span(self, name):
+        """ Returns a context manager tracing the enclosed block.
+
+        Parameters:
+            name (str): the operation name
+        """
+        return _SpanContext(self, name)
+
+    def key_received(self):
+        """ Notifies the arrival of a key.
+
+        Only the first key received since the last output is considered.
+        """
+        if self._key_time is None:
+            self._key_time = time.time()
+
+    def key_echoed(self):
+        """ Notifies that the last key has been displayed by the terminal local echo.
+
+        No output answers it, and the pending latency measure is thus dropped.
+        """
+        self._key_time = None
+
+    def data_sent(self, count):
+        """ Notifies data sent to the terminal.
+
+        Parameters:
+            count (int): the count of bytes
+        """
+        key_time, self._key_time = self._key_time, None
+        if key_time is not None:
+            self._record(KEY_TO_OUTPUT, time.time() - key_time)
+        self.bytes_sent += count
+        for span in self._stack():
+            span.bytes_sent += count
+
+    def round_trip(self):
+        """ Notifies a request waiting for a reply from the terminal.
+        """
+        self.round_trips += 1
+        for span in self._stack():
+            span.round_trips += 1
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """ Returns the statistics of all the traced operations.
+
+        Parameters:
+            percentiles (iterable of float): the percentiles to be included
+
+        Returns:
+            dict: the statistics of the durations (see :py:meth:`Histogram.summary`), keyed
+            by operation name
+        """
+        with self._lock:
+            return dict((name, h.summary(percentiles)) for name, h in self.histograms.items())
+
+    def reset(self):
+        """ Clears the recorded statistics.
+        """
+        with self._lock:
+            self.histograms.clear()
+            self.recent.clear()
+            self.bytes_sent = self.round_trips = 0
+            self._key_time = None
+
+
+class _SpanContext(object):
+    __slots__ = ('_tracer', '_name')
+
+    def __init__(self, tracer, name):
+        self._tracer, self._name = tracer, name
+
+    def __enter__(self):
+        self._tracer.begin(self._name)
+        return self._tracer
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._tracer.end()
+
+
+def _find_tracer(obj):
+    tracer = getattr(obj, 'tracer', None)
+    if tracer is None:
+        mt = getattr(obj, '_mt', None)
+        tracer = getattr(mt, 'tracer', None)
+    return tracer
+
+
+def traced(name=None):
+    """ Decorator tracing the calls of a method.
+
+    The tracer is the ``tracer`` attribute of the instance, or the one of its
+    ``_mt`` attribute for the objects using a :py:class:`Minitel`. Nothing is recorded
+    if there is none.
+
+    Parameters:
+        name (str): the operation name (default: the qualified method name)
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            tracer = _find_tracer(self)
+            if tracer is None:
+                return method(self, *args, **kwargs)
+
+            tracer.begin(name or '%s.%s' % (type(self).__name__, method.__name__))
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                tracer.end()
+
+        return wrapper
+    return decorator
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+
+""" Windows and pads composited on the Videotex screen.
+
+Windows are rectangular regions of the screen, each one with its own content,
+cursor and attributes, writes being clipped to its bounds. Pads are surfaces of any
+size, larger than the screen if needed, which are displayed through views showing
+part of them.
+
+Nothing is sent to the Minitel while drawing : the :py:class:`Compositor` merges the
+visible windows and views in their stacking order, and sends only the cells which
+changed since the previous frame, in a single batch. Overlapping parts of the
+interface thus do not fight anymore over the cursor position and the current
+attributes, and what is covered is never painted.
+
+Note:
+    Windows are displayed in Videotex text mode. Since the background color is a zone
+    attribute in this mode, only the foreground color and the character attributes
+    (blink, inverse and underscore) are managed.
+"""
+
+__author__ = 'Eric Pascual'
+
+from .core import Minitel, encode
+from .constants import ESC, Y_MAX
+from .pager import displayable
+from .sequences import TextAttribute, Encoded
+
+SCREEN_WIDTH = 40
+SCREEN_HEIGHT = Y_MAX + 1
+
+# cell attributes bits, the foreground color using the 3 lower ones
+BLINK = 0x08
+INVERSE = 0x10
+UNDERSCORE = 0x20
+
+#: the attributes of the text displayed after a cursor positioning
+DEFAULT_ATTR = 7
+
+_FLAGS = (
+    (BLINK, TextAttribute.VIDEOTEX[TextAttribute.BLINK]),
+    (INVERSE, TextAttribute.VIDEOTEX[TextAttribute.INVERSE]),
+    (UNDERSCORE, TextAttribute.VIDEOTEX[TextAttribute.UNDERSCORE]),
+)
+
+_BLANK = (u' ', DEFAULT_ATTR)
+
+# encoded forms of the characters and of the attributes changes, built on first use
+_encoded_chars = {}
+_encoded_attrs = {}
+
+# gaps of unchanged cells shorter than this are rewritten instead of moving the cursor
+_MAX_GAP = 3
+
+
+def attr_sequence(current, attr):
+    """ Returns the sequence switching from a set of attributes to another one.
+
+    Parameters:
+        current (int): the current attributes
+        attr (int): the new attributes
+
+    Returns:
+        str: the sequence
+    """
+    seq = ''
+    if (attr ^ current) & 0x07:
+        seq += ESC + chr(0x40 + (attr & 0x07))
+    for flag, (off, on) in _FLAGS:
+        if (attr ^ current) & flag:
+            seq += on if attr & flag else off
+    return seq
+
+
+def _encoded_attr(current, attr):
+    try:
+        return _encoded_attrs[current, attr]
+    except KeyError:
+        return _encoded_attrs.setdefault((current, attr), encode(attr_sequence(current, attr)))
+
+
+class Surface(object):
+    """ A grid of character cells, with a cursor and current attributes.
+
+    Writes are clipped to the bounds of the surface.
+    """
+    def __init__(self, width, height):
+        """
+        Parameters:
+            width (int): the width in characters
+            height (int): the height in characters
+
+        Raises:
+            ValueError: if invalid dimensions
+        """
+        if width < 1 or height < 1:
+            raise ValueError('invalid dimensions (%s, %s)' % (width, height))
+
+        self.width = width
+        self.height = height
+        self.cx = self.cy = 0
+        self.attr = DEFAULT_ATTR
+        self.cells = [[_BLANK] * width for _ in range(height)]
+        self.changed = True
+
+    def move(self, x, y):
+        """ Moves the cursor.
+
+        Parameters:
+            x (int): X (col) position
+            y (int): Y (line) position
+        """
+        self.cx, self.cy = x, y
+
+    def set_attr(self, fg=None, blink=None, inverse=None, underscore=None):
+        """ Sets the attributes of the text written next.
+
+        Parameters:
+            fg (int): foreground color (if None, don't change it)
+            blink (bool): blinking text (if None, don't change it)
+            inverse (bool): inverted video (if None, don't change it)
+            underscore (bool): underscored text (if None, don't change it)
+
+        Raises:
+            ValueError: if color is out of range
+        """
+        attr = self.attr
+        if fg is not None:
+            if not 0 <= fg <= 7:
+                raise ValueError('Foreground out of range: %d' % fg)
+            attr = (attr & ~0x07) | fg
+        for flag, value in ((BLINK, blink), (INVERSE, inverse), (UNDERSCORE, underscore)):
+            if value is not None:
+                attr = attr | flag if value else attr & ~flag
+        self.attr = attr
+
+    def write(self, text):
+        """ Writes a text at the cursor position, with the current attributes.
+
+        The text wraps at the right edge, and line feeds move the cursor to the start
+        of the next line. What goes past the bottom edge is lost.
+
+        Parameters:
+            text (str): the text
+        """
+        cells, attr, width = self.cells, self.attr, self.width
+        x, y = self.cx, self.cy
+        for i, line in enumerate(text.split('\n')):
+            if i:
+                x, y = 0, y + 1
+            for c in displayable(line):
+                if x >= width:
+                    x, y = 0, y + 1
+                if y >= self.height:
+                    break
+                if y >= 0 and x >= 0:
+                    cells[y][x] = (c, attr)
+                x += 1
+        self.cx, self.cy = x, y
+        self.changed = True
+
+    def write_at(self, x, y, text):
+        """ Moves the cursor and writes a text.
+
+        Parameters:
+            x (int): X (col) position
+            y (int): Y (line) position
+            text (str): the text
+        """
+        self.move(x, y)
+        self.write(text)
+
+    def fill(self, char=u' ', x=0, y=0, width=None, height=None):
+        """ Fills a rectangular area with a character, using the current attributes.
+
+        Parameters:
+            char (str): the fill character (default: space)
+            x, y (int): the top-left corner of the area (default: 0, 0)
+            width, height (int): the area dimensions (default: up to the edges)
+        """
+        x_end = self.width if width is None else min(self.width, x + width)
+        y_end = self.height if height is None else min(self.height, y + height)
+        cell = (displayable(char)[:1] or u' ', self.attr)
+        for row in self.cells[max(y, 0):y_end]:
+            row[max(x, 0):x_end] = [cell] * (x_end - max(x, 0))
+        self.changed = True
+
+    def clear(self):
+        """ Clears the surface and moves the cursor home.
+        """
+        self.cells = [[_BLANK] * self.width for _ in range(self.height)]
+        self.cx = self.cy = 0
+        self.changed = True
+
+
+class Pad(Surface):
+    """ A surface which is not bound to the screen, and can be larger than it.
+
+    Pads are displayed through views created by :py:meth:`Compositor.view`.
+    """
+
+
+class Window(Surface):
+    """ A surface displayed at a given position of the screen.
+
+    Windows are created by :py:meth:`Compositor.window`.
+    """
+    def __init__(self, compositor, x, y, width, height):
+        super(Window, self).__init__(width, height)
+        self._compositor = compositor
+        self.x, self.y = x, y
+        self.visible = True
+
+    def move_to(self, x, y):
+        """ Moves the window on the screen.
+        """
+        self.x, self.y = x, y
+        self._compositor.touch()
+
+    def show(self, visible=True):
+        """ Shows or hides the window.
+        """
+        self.visible = visible
+        self._compositor.touch()
+
+    def hide(self):
+        self.show(False)
+
+    def _source(self):
+        return self, 0, 0
+
+
+class PadView(object):
+    """ A region of the screen displaying a part of a pad.
+
+    Views are created by :py:meth:`Compositor.view`.
+    """
+    def __init__(self, compositor, pad, x, y, width, height, px=0, py=0):
+        self._compositor = compositor
+        self.pad = pad
+        self.x, self.y = x, y
+        self.width, self.height = width, height
+        self.px, self.py = px, py
+        self.visible = True
+
+    def scroll_to(self, px, py):
+        """ Changes the displayed part of the pad.
+
+        Parameters:
+            px, py (int): the position in the pad of the top-left corner of the view
+        """
+        self.px = max(0, min(px, self.pad.width - self.width))
+        self.py = max(0, min(py, self.pad.height - self.height))
+        self._compositor.touch()
+
+    def move_to(self, x, y):
+        """ Moves the view on the screen.
+        """
+        self.x, self.y = x, y
+        self._compositor.touch()
+
+    def show(self, visible=True):
+        """ Shows or hides the view.
+        """
+        self.visible = visible
+        self._compositor.touch()
+
+    def hide(self):
+        self.show(False)
+
+    def _source(self):
+        return self.pad, self.px, self.py
+
+
+class Compositor(object):
+    """ Merges windows and pad views, and updates the screen with their changes.
+
+    Layers are stacked in their creation order, the last one being on top. The screen
+    is updated by :py:meth:`flush`, which sends the changed cells in a single batch.
+    """
+    def __init__(self, mt):
+        """
+        Parameters:
+            mt (:py:class:`Minitel`): the Minitel instance
+
+        Raises:
+            ValueError: if mt is not provided
+        """
+        if not mt:
+            raise ValueError('mt parameter is mandatory')
+
+        self._mt = mt
+        self._layers = []
+        self._shown = None
+        self._touched = True
+        # reused for assembling the frames
+        self._buffer = bytearray()
+
+    def touch(self):
+        """ Signals a change in the layers placement.
+        """
+        self._touched = True
+
+    def invalidate(self):
+        """ Forgets the displayed content, forcing a full redraw on next flush.
+
+        To be used when something else has drawn on the screen.
+        """
+        self._shown = None
+        self._touched = True
+
+    def window(self, x, y, width, height):
+        """ Creates a window on top of the existing layers.
+
+        Parameters:
+            x, y (int): the screen position of the top-left corner
+            width, height (int): the window dimensions
+
+        Returns:
+            :py:class:`Window`: the window
+        """
+        return self._add(Window(self, x, y, width, height))
+
+    def view(self, pad, x, y, width, height, px=0, py=0):
+        """ Creates a view of a pad on top of the existing layers.
+
+        Parameters:
+            pad (:py:class:`Pad`): the displayed pad
+            x, y (int): the screen position of the top-left corner
+            width, height (int): the view dimensions
+            px, py (int): the position in the pad of the top-left corner of the view
+
+        Returns:
+            :py:class:`PadView`: the view
+        """
+        return self._add(PadView(self, pad, x, y, width, height, px, py))
+
+    def _add(self, layer):
+        self._layers.append(layer)
+        self.touch()
+        return layer
+
+    def remove(self, layer):
+        """ Removes a layer.
+        """
+        self._layers.remove(layer)
+        self.touch()
+
+    def raise_(self, layer):
+        """ Puts a layer on top of the others.
+        """
+        self._layers.remove(layer)
+        self._layers.append(layer)
+        self.touch()
+
+    def lower(self, layer):
+        """ Puts a layer below the others.
+        """
+        self._layers.remove(layer)
+        self._layers.insert(0, layer)
+        self.touch()
+
+    def compose(self):
+        """ Returns the content of the screen resulting from the visible layers.
+
+        Returns:
+            list: the cells, as a list of rows
+        """
+        screen = [[_BLANK] * SCREEN_WIDTH for _ in range(SCREEN_HEIGHT)]
+        for layer in self._layers:
+            if not layer.visible:
+                continue
+            surface, ox, oy = layer._source()
+            x0, x1 = max(layer.x, 0), min(layer.x + layer.width, SCREEN_WIDTH)
+            y0, y1 = max(layer.y, 0), min(layer.y + layer.height, SCREEN_HEIGHT)
+            sx = x0 - layer.x + ox
+            for y in range(y0, y1):
+                sy = y - layer.y + oy
+                if 0 <= sy < surface.height:
+                    row = surface.cells[sy][sx:sx + x1 - x0]
+                    screen[y][x0:x0 + len(row)] = row
+        return screen
+
+    def _changed(self):
+        return self._touched or any(
+            layer._source()[0].changed for layer in self._layers if layer.visible
+        )
+
+    def frame_sequence(self, screen):
+        """ Returns the sequence updating the displayed screen to a new content.
+
+        Parameters:
+            screen (list): the new content, as returned by :py:meth:`compose`
+
+        Returns:
+            bytes: the encoded sequence
+        """
+        return bytes(self._assemble(screen))
+
+    def _assemble(self, screen):
+        """ Assembles the encoded frame sequence in the reusable buffer, and returns it.
+        """
+        shown = self._shown
+        buf = self._buffer
+        del buf[:]
+        if shown is None:
+            buf += Encoded.CLEAR_SCREEN
+            shown = [[_BLANK] * SCREEN_WIDTH for _ in range(SCREEN_HEIGHT)]
+
+        for y, (old, new) in enumerate(zip(shown, screen)):
+            if old == new:
+                continue
+            changed = [x for x in range(SCREEN_WIDTH) if old[x] != new[x]]
+            runs = []
+            for x in changed:
+                if runs and x - runs[-1][1] <= _MAX_GAP:
+                    runs[-1][1] = x + 1
+                else:
+                    runs.append([x, x + 1])
+
+            goto = Encoded.GOTO[y]
+            for start, end in runs:
+                # positioning resets the attributes
+                buf += goto[start]
+                attr = DEFAULT_ATTR
+                for c, cell_attr in new[start:end]:
+                    if cell_attr != attr:
+                        buf += _encoded_attr(attr, cell_attr)
+                        attr = cell_attr
+                    try:
+                        buf += _encoded_chars[c]
+                    except KeyError:
+                        buf += _encoded_chars.setdefault(c, encode(c))
+                if attr != DEFAULT_ATTR:
+                    buf += _encoded_attr(attr, DEFAULT_ATTR)
+
+        return buf
+
+    def flush(self):
+        """ Updates the screen with the changes of the layers.
+
+        Returns:
+            int: the size of the sent data
+        """
+        if not self._changed():
+            return 0
+
+        mt = self._mt
+        mt.set_mode(Minitel.VIDEOTEX)
+        mt.videotex_graphic_mode(False)
+
+        screen = self.compose()
+        data = self._assemble(screen)
+        if data:
+            mt.send_raw(memoryview(data))
+            mt.fg, mt.bg = 7, 0
+
+        self._shown = screen
+        self._touched = False
+        for layer in self._layers:
+            layer._source()[0].changed = False
+        return len(data)
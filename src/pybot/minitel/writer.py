@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+
+""" Background output to the serial link.
+"""
+
+__author__ = 'Eric Pascual'
+
+from collections import deque
+import threading
+import logging
+import time
+import re
+
+log = logging.getLogger('minitel').getChild('writer')
+
+#: bits transmitted per byte on the link (start bit, 7 data bits, parity bit, stop bit)
+BITS_PER_BYTE = 10
+
+
+class Priority(object):
+    """ The priorities of the output.
+    """
+    #: written before anything else queued. The data must leave the cursor position and attributes
+    #: unchanged, as the status line writes do, since they can be inserted in the middle of other output.
+    URGENT = 0
+    #: written in sequence
+    NORMAL = 1
+    #: written in sequence with normal output, but can be cancelled while pending
+    BULK = 2
+
+
+# tokens which must not be split : escape sequences and other multi-bytes controls on one side,
+# runs of characters which can be split anywhere on the other side
+_TOKENS = re.compile(br'''
+    (\x1b\[[\x30-\x3f]*[\x20-\x2f]*[\x40-\x7e]?
+    | \x1b\x39.{0,1} | \x1b\x3a.{0,2} | \x1b\x3b.{0,3}
+    | \x1b[\x23\x28\x29]\x20?.?
+    | \x1b.?
+    | \x1f.{0,2}
+    | \x19[\x41-\x4b].? | \x19.?
+    | [\x12\x13].?)
+    | [^\x12\x13\x19\x1b\x1f]+
+''', re.S | re.X)
+
+
+def split_chunks(data, size):
+    """ Splits encoded data in chunks of a given maximum size, without splitting
+    the control sequences they contain.
+
+    A chunk can thus be larger than the requested size if a sequence is longer than it.
+
+    Parameters:
+        data (bytes): the encoded data
+        size (int): the maximum chunk size
+
+    Returns:
+        list of bytes: the chunks
+    """
+    chunks = []
+    current = []
+    current_size = 0
+    for m in _TOKENS.finditer(data):
+        token = m.group()
+        if m.group(1) is None:
+            # plain characters run, which can be split anywhere
+            while current_size + len(token) > size:
+                cut = size - current_size
+                current.append(token[:cut])
+                chunks.append(b''.join(current))
+                current, current_size = [], 0
+                token = token[cut:]
+        elif current and current_size + len(token) > size:
+            chunks.append(b''.join(current))
+            current, current_size = [], 0
+
+        if token:
+            current.append(token)
+            current_size += len(token)
+
+    if current:
+        chunks.append(b''.join(current))
+    return chunks
+
+
+def write_all(ser, data):
+    """ Writes data to a serial port, completing partial writes.
+
+    The data are written through a memory view, so that what remains after a partial
+    write is not copied.
+
+    Parameters:
+        ser (:py:class:`serial.Serial`): the serial port
+        data (bytes, bytearray or memoryview): the data
+    """
+    view = memoryview(data)
+    while view:
+        count = ser.write(view)
+        if count is None or count >= len(view):
+            return
+        view = view[count:]
+
+
+class OutputWriter(threading.Thread):
+    """ Writes data to a serial port from a dedicated thread.
+
+    The data are queued by :py:meth:`write`, which returns immediately, and written
+    in sequence by the thread. The writer keeps track of the count of bytes not
+    yet written, so that the time needed for sending them can be estimated.
+
+    Data are written according to their priority (see :py:class:`Priority`). Urgent data
+    are written before anything else pending, and bulk ones can be discarded with
+    :py:meth:`cancel_bulk` as long as they are not yet written.
+
+    Optional features are :
+
+        back-pressure
+            when ``max_size`` is set, :py:meth:`write` blocks while the pending data
+            would exceed this size (urgent data excepted)
+
+        watermarks
+            the ``on_high`` callback is invoked when the pending data reach the high
+            watermark, and ``on_low`` when they go back under the low one. They are
+            called from the thread in which the crossing occurs, and must not block.
+
+        coalescing
+            when ``coalesce_delay`` is set, small writes queued within this delay
+            are grouped into a single one, up to ``max_chunk`` bytes. Bulk data are
+            not grouped, so that they can be cancelled chunk by chunk.
+    """
+    def __init__(self, ser, name=None, max_size=None,
+                 high_watermark=None, low_watermark=None, on_high=None, on_low=None,
+                 coalesce_delay=0, max_chunk=1024, on_error=None):
+        """
+        Parameters:
+            ser (:py:class:`serial.Serial`): the serial port
+            name (str): the thread name (default: derived from the port name)
+            max_size (int): the maximum count of pending bytes (default: unlimited)
+            high_watermark (int): the count of pending bytes triggering ``on_high``
+            low_watermark (int): the count of pending bytes triggering ``on_low`` (default: half
+                the high watermark)
+            on_high (callable): invoked without argument when the high watermark is reached
+            on_low (callable): invoked without argument when the low watermark is reached back
+            coalesce_delay (float): the time window (in seconds) for grouping writes (default: 0,
+                no grouping)
+            max_chunk (int): the maximum size of grouped writes (default: 1024)
+            on_error (callable): invoked with the exception when a write fails
+        """
+        super(OutputWriter, self).__init__(name=name or 'writer-%s' % getattr(ser, 'port', '?'))
+        self.daemon = True
+
+        if high_watermark and low_watermark is None:
+            low_watermark = high_watermark // 2
+        if high_watermark and not 0 <= low_watermark < high_watermark:
+            raise ValueError('low watermark must be lower than high watermark')
+
+        self._ser = ser
+        self._urgent = deque()
+        self._regular = deque()
+        self._stopping = False
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._max_size = max_size
+        self._high_watermark = high_watermark
+        self._low_watermark = low_watermark
+        self._on_high = on_high
+        self._on_low = on_low
+        self._above_high = False
+        self._coalesce_delay = coalesce_delay
+        self._max_chunk = max_chunk
+        self._on_error = on_error
+        self.error = None
+        # reused for grouping the writes, since only the thread assembles and writes them
+        self._chunk = bytearray()
+
+    def write(self, data, priority=Priority.NORMAL, block=True):
+        """ Queues data for being written.
+
+        If a maximum size is defined, waits until there is room enough for the data
+        in the queue. Data larger than the maximum size are accepted once the queue
+        is empty.
+
+        Parameters:
+            data (bytes): the encoded data
+            priority (int): the output priority (default: ``Priority.NORMAL``)
+            block (bool): if False, the data are queued at once, even if this exceeds the
+                maximum size
+        """
+        if not data:
+            return
+
+        with self._cond:
+            if self._max_size and block and priority != Priority.URGENT:
+                while self._pending and self._pending + len(data) > self._max_size:
+                    self._cond.wait()
+            self._pending += len(data)
+            crossed = bool(self._high_watermark) and not self._above_high \
+                and self._pending >= self._high_watermark
+            if crossed:
+                self._above_high = True
+
+            if priority == Priority.URGENT:
+                self._urgent.append(data)
+            else:
+                self._regular.append((data, priority == Priority.BULK))
+            self._cond.notify_all()
+
+        if crossed and self._on_high:
+            self._on_high()
+
+    def cancel_bulk(self):
+        """ Discards the bulk data not yet written.
+
+        Returns:
+            int: the count of discarded bytes
+        """
+        on_low = None
+        with self._cond:
+            discarded = sum(len(data) for data, bulk in self._regular if bulk)
+            if discarded:
+                # updated in place, since the writer thread can be holding a reference on it
+                kept = [item for item in self._regular if not item[1]]
+                self._regular.clear()
+                self._regular.extend(kept)
+                on_low = self._update_pending(-discarded)
+        if on_low:
+            on_low()
+        return discarded
+
+    @property
+    def has_bulk(self):
+        """ Tells if bulk data are pending."""
+        with self._cond:
+            return any(bulk for _, bulk in self._regular)
+
+    @property
+    def pending(self):
+        """ The count of bytes not yet written."""
+        return self._pending
+
+    def backlog_time(self):
+        """ Returns the estimated time needed for writing the pending bytes at the
+        current speed of the link.
+
+        Returns:
+            float: the time in seconds
+        """
+        return float(self._pending * BITS_PER_BYTE) / self._ser.baudrate
+
+    def drain(self, timeout=None):
+        """ Waits until all the queued data have been written.
+
+        Parameters:
+            timeout (float): maximum wait time in seconds (if None, waits indefinitely)
+
+        Returns:
+            bool: True if all data have been written, False if the timeout expired
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while self._pending:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            return not self._pending
+
+    def stop(self, timeout=None):
+        """ Terminates the thread once the data queued so far are written.
+
+        Parameters:
+            timeout (float): maximum wait time in seconds for the thread termination
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self.join(timeout)
+
+    def _update_pending(self, delta):
+        """ Updates the pending bytes count and returns the watermark callback to be
+        invoked if any. Must be called with the condition lock acquired.
+        """
+        self._pending += delta
+        self._cond.notify_all()
+        if self._above_high and self._pending <= self._low_watermark:
+            self._above_high = False
+            return self._on_low
+
+    def _next(self):
+        """ Returns the next data to be written, None if the thread must terminate.
+        Must be called with the condition lock acquired.
+        """
+        while not (self._urgent or self._regular):
+            if self._stopping:
+                return None
+            self._cond.wait()
+
+        queue = self._urgent or self._regular
+        data = queue.popleft()
+        if queue is self._regular:
+            data, bulk = data
+            if bulk:
+                return data
+
+        if not self._coalesce_delay:
+            return data
+
+        # group the small writes of the same priority which occur meanwhile
+        chunk = self._chunk
+        del chunk[:]
+        chunk += data
+        size = len(data)
+        deadline = time.time() + self._coalesce_delay
+        while size < self._max_chunk:
+            if queue is self._regular and self._urgent:
+                # urgent data queued while waiting are written first
+                break
+            if queue:
+                if queue is self._regular:
+                    if queue[0][1] or size + len(queue[0][0]) > self._max_chunk:
+                        break
+                    data = queue.popleft()[0]
+                else:
+                    if size + len(queue[0]) > self._max_chunk:
+                        break
+                    data = queue.popleft()
+                chunk += data
+                size += len(data)
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0 or self._stopping:
+                    break
+                self._cond.wait(remaining)
+
+        return chunk
+
+    def run(self):
+        while True:
+            with self._cond:
+                data = self._next()
+            if data is None:
+                return
+
+            try:
+                write_all(self._ser, data)
+            except Exception as e:
+                # keep track of the problem, the data being lost anyway
+                log.error('write failed on %s (%s)', self.name, e)
+                self.error = e
+                if self._on_error:
+                    self._on_error(e)
+
+            with self._cond:
+                on_low = self._update_pending(-len(data))
+            if on_low:
+                on_low()